@@ -18,9 +18,27 @@ import azure.functions as af
 app = af.FunctionApp(http_auth_level=af.AuthLevel.ANONYMOUS)
 
 
+import inspect
+import threading
 from functools import partial
 from dataclasses import dataclass
-from typing import Callable, Any, Mapping
+from typing import Callable, Any, Mapping, Optional, Union, Sequence
+
+from wip_qh.profiling import RequestProfiler
+from wip_qh.content_codecs import negotiate, codec_for_content_type, JSON_MIMETYPE
+from wip_qh.response_cache import (
+    CacheSpec,
+    CachedResponse,
+    ResponseCache,
+    cache_spec,
+)
+from wip_qh.deadlines import (
+    DeadlineExceeded,
+    DeadlinePoolFull,
+    effective_timeout,
+    call_with_deadline,
+)
+from wip_qh import jobs as _jobs
 
 FunctionOutput = Any
 
@@ -52,7 +70,39 @@ def http_response(
     return af.HttpResponse(cast(output), status_code=status_code, mimetype=mimetype)
 
 
+def codec_extract_params(
+    req: af.HttpRequest, *, body_param: str = 'value', registry: Mapping = None
+) -> dict:
+    """
+    Extract function params from a request, decoding a non-JSON body with the codec
+    of its Content-Type (see `wip_qh.content_codecs`), as the `body_param` param.
+    """
+    content_type = req.headers.get('content-type')
+    codec = codec_for_content_type(content_type, registry=registry)
+    if codec is None or codec.mimetype == JSON_MIMETYPE:
+        return default_extract_params(req)
+    return {**req.params, body_param: codec.decode(req.get_body())}
+
+
+def negotiated_http_response(
+    output: FunctionOutput,
+    req: af.HttpRequest,
+    *,
+    registry: Mapping = None,
+    status_code: int = 200,
+) -> af.HttpResponse:
+    """
+    Egress encoding the output with the codec that best matches the request's
+    Accept header (see `wip_qh.content_codecs`).
+    """
+    codec = negotiate(req.headers.get('accept'), output, registry=registry)
+    return af.HttpResponse(
+        codec.encode(output), status_code=status_code, mimetype=codec.mimetype
+    )
+
+
 from i2 import Wrap
+from urllib.parse import parse_qsl
 
 
 @dataclass
@@ -61,18 +111,123 @@ class AzureWrap:
     ingress: Callable[[af.HttpRequest], dict]
     egress: Callable[[FunctionOutput], af.HttpResponse]
     exception_handles: dict
+    profiler: Optional[RequestProfiler] = None
+    cache: Optional[CacheSpec] = None
+    response_cache: Optional[ResponseCache] = None
+    deadline: Optional[float] = None
+    invalidates: Sequence[str] = ()  # functions whose cached responses calls drop
+
+    def __post_init__(self):
+        # Egresses with a `req` parameter also get the request (e.g. to negotiate)
+        self._egress_takes_req = 'req' in Sig(self.egress).names
+        if self.cache is not None:
+            if self._egress_takes_req:  # (then responses depend on the Accept header)
+                self.cache = self.cache.varying_with('accept')
+            if self.response_cache is None:
+                self.response_cache = ResponseCache()
+        self._precompute_pending = bool(
+            self.cache is not None and self.cache.precompute_targets()
+        )
+        self._precompute_lock = threading.Lock()
 
     @property
     def __name__(self):
         return self.func.__name__
 
     def __call__(self, req: af.HttpRequest) -> af.HttpResponse:
+        if self._precompute_pending:
+            self.ensure_precomputed(req.route_params)
+        if self.cache is None or req.method.upper() != 'GET':
+            response = self._profiled_call(req)
+        else:
+            response = self._cached_call(req)
+        if self.invalidates and response.status_code < 400:
+            for func_name in self.invalidates:
+                self.response_cache.invalidate(func_name)
+        return response
+
+    def _cached_call(self, req: af.HttpRequest) -> af.HttpResponse:
+        key = self.cache.key_for(
+            self.__name__, req.route_params, req.params, req.headers
+        )
+        cached = self.response_cache.get(key)
+        if cached is None:
+            generation = self.response_cache.generation(self.__name__)
+            response = self._profiled_call(req)
+            if response.status_code == 200:
+                cached = CachedResponse(
+                    response.get_body(),
+                    headers=list(response.headers.items()),
+                    media_type=response.mimetype,
+                )
+                self.response_cache.set(
+                    key, cached, self.cache.ttl, generation=generation
+                )
+            return response
+        return af.HttpResponse(
+            cached.body,
+            status_code=cached.status_code,
+            headers={**dict(cached.headers), 'x-cache': 'hit'},
+            mimetype=cached.media_type,
+        )
+
+    def ensure_precomputed(self, route_params: Mapping = ()):
+        """
+        Precompute, if it wasn't done yet. This is done at the first request, not at
+        registration, so that registering (importing the function app) doesn't call
+        any function.
+        """
+        with self._precompute_lock:
+            if self._precompute_pending:
+                self._precompute_pending = False
+                self.precompute(route_params)
+
+    def precompute(self, route_params: Mapping = ()):
+        """Compute (and cache) the responses of the `precompute` targets of `cache`"""
+        for target in self.cache.precompute_targets():
+            _, _, query = target.partition('?')
+            req = af.HttpRequest(
+                'GET',
+                f"/api/{self.__name__}{target}",
+                params=dict(parse_qsl(query)),
+                route_params=dict(route_params),
+                body=b'',
+            )
+            self(req)
+
+    def _profiled_call(self, req: af.HttpRequest) -> af.HttpResponse:
+        if self.profiler is None or not self.profiler.should_profile(req.headers):
+            return self._call(req)
+        fmt = self.profiler.fmt_for(req.headers)
+        profiling = partial(self.profiler.profiling, self.__name__, fmt=fmt)
+        if (
+            effective_timeout(self.deadline, req.headers) is not None
+            and not inspect.iscoroutinefunction(self.func)
+        ):  # (the function is run in a deadline thread: profile it there)
+            return self._call(req, profiling=profiling)
+        with profiling():
+            return self._call(req)
+
+    def _call(self, req: af.HttpRequest, *, profiling=None) -> af.HttpResponse:
         try:
             params = self.ingress(req)  # extract params
-            result = self.func(  # call the function
-                **params
-            )  # if positional args are needed, or there are extra params we can use i2.call_forgivingly here
+            timeout = effective_timeout(self.deadline, req.headers)
+            if timeout is not None:
+                func = self.func
+                if profiling is not None:
+                    func = partial(_call_profiled, func, profiling)
+                result = call_with_deadline(func, params, timeout)
+            else:
+                result = self.func(  # call the function
+                    **params
+                )  # if positional args are needed, or there are extra params we can use i2.call_forgivingly here
+            if self._egress_takes_req:
+                return self.egress(result, req=req)
             return self.egress(result)
+        except DeadlineExceeded as e:
+            return af.HttpResponse(str(e), status_code=504)
+        except DeadlinePoolFull as e:
+            return af.HttpResponse(str(e), status_code=503)
         except tuple(self.exception_handles) as e:
             for exc_type, exc_handle in self.exception_handles.items():
                 if isinstance(e, exc_type):
@@ -83,6 +238,11 @@ class AzureWrap:
                     return af.HttpResponse(body, **remaining_kwargs)
 
 
+def _call_profiled(func, profiling, **kwargs):
+    with profiling():
+        return func(**kwargs)
+
+
 from i2 import double_up_as_factory, name_of_obj
 
 
@@ -105,18 +265,44 @@ def azure_wrap(
         KeyError: dict(body=str, status_code=404),
         Exception: dict(body=str, status_code=400),
     },
+    profiler: Optional[RequestProfiler] = None,
+    cache=None,
+    response_cache: Optional[ResponseCache] = None,
+    deadline: Optional[float] = None,
+    invalidates: Sequence[str] = (),
 ) -> AzureWrap:
+    """
+    Wrap func into an Azure (http) function.
+
+    `cache` marks the function's GET responses as cacheable: it can be a
+    `wip_qh.response_cache.CacheSpec`, a ttl, True (no expiry), or a dict of
+    `CacheSpec` fields. Its precomputable responses are computed at the first request.
+
+    `invalidates` names the functions whose cached responses (in `response_cache`)
+    successful calls to func drop.
+
+    `deadline` (in seconds) is how long a call may take before it gets a 504 response
+    (clients can ask for a shorter one with an ``x-deadline-ms`` header; see
+    `wip_qh.deadlines`).
+    """
     if isinstance(ingress, dict):
         cast = ingress
         ingress = partial(extract_and_cast, cast=cast)
     elif ingress is None:
         ingress = default_extract_params
+    if egress is None:
+        egress = http_response
 
     return AzureWrap(
         func,
         ingress=ingress,
         egress=egress,
         exception_handles=exception_handles,
+        profiler=profiler,
+        cache=cache_spec(cache),
+        response_cache=response_cache,
+        deadline=deadline,
+        invalidates=tuple(invalidates),
     )
 
 
@@ -124,25 +310,524 @@ def default_app_factory():
     return af.FunctionApp(http_auth_level=af.AuthLevel.ANONYMOUS)
 
 
-def add_app_route(func, *, app=None, route=None, methods=("GET", "POST"), ingress=None):
+def add_app_route(
+    func,
+    *,
+    app=None,
+    route=None,
+    methods=("GET", "POST"),
+    ingress=None,
+    egress=None,
+    profiler: Optional[RequestProfiler] = None,
+    cache=None,
+    deadline: Optional[float] = None,
+    response_cache: Optional[ResponseCache] = None,
+    invalidates: Sequence[str] = (),
+):
     if app is None:
         app = default_app_factory()
     if route is None:
         route = name_of_obj(func)
     app_route = app.route(route=route, methods=methods)
-    _azure_wrap = azure_wrap(ingress=ingress)
+    _azure_wrap = azure_wrap(
+        ingress=ingress,
+        egress=egress,
+        profiler=profiler,
+        cache=cache,
+        response_cache=response_cache,
+        deadline=deadline,
+        invalidates=invalidates,
+    )
     return app_route(_azure_wrap(func))
 
 
-def dispatch_funcs(funcs, *, app=None, ingress=()):
-    ingress = dict(ingress)
+import re
+
+DFLT_DISPATCH_ROUTE = 'fn/{func_name}'
+
+
+@dataclass
+class AzureDispatch:
+    """
+    A single Azure function that dispatches requests to one of many wrapped functions,
+    according to the value of the `route_param` of the request's route.
+
+    The precomputable responses (of all the functions) are computed at the first
+    request.
+    """
+
+    wrappers: Mapping[str, AzureWrap]
+    route_param: str = 'func_name'
+    name: str = 'dispatch'
+
+    def __post_init__(self):
+        self._precompute_pending = True
+
+    @property
+    def __name__(self):
+        return self.name
+
+    def __call__(self, req: af.HttpRequest) -> af.HttpResponse:
+        if self._precompute_pending:
+            for func_name, wrapper in self.wrappers.items():
+                wrapper.ensure_precomputed({self.route_param: func_name})
+            self._precompute_pending = False
+        func_name = req.route_params.get(self.route_param)
+        wrapper = self.wrappers.get(func_name)
+        if wrapper is None:
+            return af.HttpResponse(f"Function not found: {func_name}", status_code=404)
+        return wrapper(req)
+
+
+def _route_param_name(route: str) -> str:
+    """
+    The name of the (single) parameter of a route template.
+
+    >>> _route_param_name('fn/{func_name}')
+    'func_name'
+    >>> _route_param_name('fn/{name:alpha}')
+    'name'
+    """
+    names = re.findall(r"{(\w+)(?::[^}]*)?}", route)
+    if len(names) != 1:
+        raise ValueError(f"The route should have exactly one parameter: {route}")
+    return names[0]
+
+
+def _function_name_for_route(route: str) -> str:
+    return 'dispatch_' + (re.sub(r"\W+", '_', route.split('{')[0]).strip('_') or 'root')
+
+
+def _normalize_funcs(funcs) -> Mapping[str, Callable]:
     if not isinstance(funcs, Mapping):
         funcs = {name_of_obj(func): func for func in funcs}
+    return funcs
+
+
+def _config_for(config: Mapping, route: str, func: Callable):
+    return config.get(func, None) or config.get(route, None)
+
+
+def _invalidations(funcs: Mapping[str, Callable], cache: Mapping) -> dict:
+    """
+    The ``{name: names_of_the_funcs_whose_cache_it_invalidates}`` of funcs.
+
+    >>> def get(): ...
+    >>> def put(): ...
+    >>> _invalidations({'get': get, 'put': put}, {get: {'invalidated_by': ['put']}})
+    {'get': [], 'put': ['get']}
+    """
+    specs = {
+        name: cache_spec(_config_for(cache, name, func)) for name, func in funcs.items()
+    }
+    return {
+        name: [
+            cached
+            for cached, spec in specs.items()
+            if spec is not None and name in spec.invalidated_by
+        ]
+        for name in funcs
+    }
+
+
+def _wrappers(
+    funcs,
+    ingress=(),
+    egress=(),
+    profiler=None,
+    cache=(),
+    deadline=(),
+    response_cache: Optional[ResponseCache] = None,
+):
+    """
+    The ``{name: AzureWrap}`` of funcs, configured by name (or func), sharing one
+    `response_cache` (a new one, if not given).
+    """
+    ingress, egress, cache = dict(ingress), dict(egress), dict(cache)
+    deadline = dict(deadline)
+    funcs = _normalize_funcs(funcs)
+    invalidations = _invalidations(funcs, cache)
+    if response_cache is None:
+        response_cache = ResponseCache()
+    return {
+        name: azure_wrap(
+            func,
+            ingress=_config_for(ingress, name, func),
+            egress=_config_for(egress, name, func),
+            profiler=profiler,
+            cache=_config_for(cache, name, func),
+            response_cache=response_cache,
+            deadline=_config_for(deadline, name, func),
+            invalidates=invalidations[name],
+        )
+        for name, func in funcs.items()
+    }
+
+
+def add_dispatch_route(
+    funcs,
+    *,
+    app=None,
+    route=DFLT_DISPATCH_ROUTE,
+    methods=("GET", "POST"),
+    ingress=(),
+    egress=(),
+    profiler: Optional[RequestProfiler] = None,
+    cache=(),
+    deadline=(),
+    response_cache: Optional[ResponseCache] = None,
+):
+    """
+    Register a single, parametrized, route (`route`, by default ``fn/{func_name}``)
+    that dispatches to all of `funcs`.
+
+    The functions are wrapped once, here, and looked up by name at request time,
+    so registering thousands of functions costs one Azure function, not thousands.
+    As with `dispatch_funcs`, `ingress`, `egress`, `cache` and `deadline` map function
+    names (or functions) to their ingress, egress, cache and deadline configurations.
+    """
+    if app is None:
+        app = default_app_factory()
+    wrappers = _wrappers(
+        funcs, ingress, egress, profiler, cache, deadline, response_cache
+    )
+    dispatch = AzureDispatch(
+        wrappers,
+        route_param=_route_param_name(route),
+        name=_function_name_for_route(route),
+    )
+    app.route(route=route, methods=methods)(dispatch)
+    return app
+
+
+def dispatch_funcs(
+    funcs,
+    *,
+    app=None,
+    ingress=(),
+    egress=(),
+    profiler: Optional[RequestProfiler] = None,
+    single_route: Optional[str] = None,
+    cache=(),
+    queue: Union[str, Mapping, None] = None,
+    deadline=(),
+    jobs: Optional[_jobs.JobRunner] = None,
+    response_cache: Optional[ResponseCache] = None,
+):
+    """
+    Register each of `funcs` as an http-triggered Azure function, or, if
+    `single_route` is given (e.g. ``'fn/{func_name}'``), all of them behind that
+    one route (see `add_dispatch_route`).
+
+    `cache` maps function names (or functions) to cache configurations (see
+    `azure_wrap`), the responses being cached in `response_cache` (by default, a new
+    one, for these functions). Precomputable ones are computed at the first request.
+    Likewise, `deadline` maps them to deadlines, in seconds.
+
+    If `queue` is given (a queue name, or a dict of `add_queue_route` arguments),
+    the functions are also served to the messages of that queue.
+
+    If a `jobs` runner is given, the functions can also be submitted as jobs, at
+    ``jobs/{func_name}`` (see `add_jobs_route`).
+    """
+    if jobs is not None:
+        if app is None:
+            app = default_app_factory()
+        add_jobs_route(funcs, jobs, app=app, ingress=ingress)
+    if queue is not None:
+        if isinstance(queue, str):
+            queue = {'queue_name': queue}
+        if app is None:
+            app = default_app_factory()
+        add_queue_route(
+            funcs, app=app, ingress=ingress, egress=egress, profiler=profiler, **queue
+        )
+    if single_route is not None:
+        return add_dispatch_route(
+            funcs,
+            app=app,
+            route=single_route,
+            ingress=ingress,
+            egress=egress,
+            profiler=profiler,
+            cache=cache,
+            deadline=deadline,
+            response_cache=response_cache,
+        )
+    ingress, egress, cache = dict(ingress), dict(egress), dict(cache)
+    deadline = dict(deadline)
+    funcs = _normalize_funcs(funcs)
+    invalidations = _invalidations(funcs, cache)
+    if response_cache is None:
+        response_cache = ResponseCache()
     if app is None:
         app = default_app_factory()
     for route, func in funcs.items():
-        _ingress = ingress.get(func, None) or ingress.get(route, None)
-        add_app_route(func, app=app, route=route, ingress=_ingress)
+        add_app_route(
+            func,
+            app=app,
+            route=route,
+            ingress=_config_for(ingress, route, func),
+            egress=_config_for(egress, route, func),
+            profiler=profiler,
+            cache=_config_for(cache, route, func),
+            deadline=_config_for(deadline, route, func),
+            response_cache=response_cache,
+            invalidates=invalidations[route],
+        )
+    return app
+
+
+# -------------------------------------------------------------------------------------
+# Queue triggers
+
+DFLT_QUEUE_CONNECTION = 'AzureWebJobsStorage'
+
+
+def _decode_body(body: bytes):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode('utf-8', errors='replace')
+
+
+@dataclass
+class QueueDispatch:
+    """
+    Handles queue messages that call the (http) wrapped functions, by name.
+
+    A message is a call, ``{"id": ..., "func": name, "params": {...}}``, or a batch:
+    a JSON list of calls. Each call goes through the same `AzureWrap` as the http
+    requests do (ingress, function, egress, exception handles), and gets a result,
+    ``{"id": ..., "status": 200, "result": ...}``, or, if it failed,
+    ``{"id": ..., "status": 4xx, "error": ...}``: a failing call doesn't fail the
+    others (nor the message, which would make Azure retry it all).
+
+    The results (a list, for batches) are written to the `out` binding, if any.
+    """
+
+    wrappers: Mapping[str, AzureWrap]
+    name: str = 'queue_dispatch'
+
+    @property
+    def __name__(self):
+        return self.name
+
+    def handle_call(self, call) -> dict:
+        if not isinstance(call, dict):
+            error = "A call should be a {id, func, params} object"
+            return {'id': None, 'status': 400, 'error': error}
+        call_id, func_name = call.get('id'), call.get('func')
+        wrapper = self.wrappers.get(func_name)
+        if wrapper is None:
+            error = f"Function not found: {func_name}"
+            return {'id': call_id, 'status': 404, 'error': error}
+        req = af.HttpRequest(
+            'POST',
+            f"/api/{func_name}",
+            headers={'content-type': 'application/json'},
+            params={},
+            route_params={},
+            body=json.dumps(call.get('params') or {}).encode('utf-8'),
+        )
+        try:
+            response = wrapper(req)
+        except Exception as e:  # (exceptions that exception_handles don't handle)
+            return {'id': call_id, 'status': 500, 'error': f"{type(e).__name__}: {e}"}
+        if response is None:
+            return {'id': call_id, 'status': 500, 'error': "No response"}
+        body = _decode_body(response.get_body())
+        if response.status_code >= 400:
+            return {'id': call_id, 'status': response.status_code, 'error': body}
+        return {'id': call_id, 'status': response.status_code, 'result': body}
+
+    def handle_message(self, body: Union[bytes, str]):
+        """The result(s) of the call(s) of a message's body"""
+        try:
+            calls = json.loads(body)
+        except ValueError as e:
+            return {'id': None, 'status': 400, 'error': f"Invalid JSON: {e}"}
+        if isinstance(calls, list):
+            return [self.handle_call(call) for call in calls]
+        return self.handle_call(calls)
+
+    def __call__(self, msg: af.QueueMessage, out=None):
+        results = self.handle_message(msg.get_body())
+        if out is not None:
+            out.set(json.dumps(results))
+        return results
+
+
+class LocalOut:
+    """
+    A stand-in for an `azure.functions.Out` binding, to call queue handlers locally.
+
+    >>> wrappers = _wrappers([_apply_func], ingress={'apply_func': {'arg': int}})
+    >>> dispatch = QueueDispatch(wrappers)
+    >>> out = LocalOut()
+    >>> calls = [
+    ...     {'id': 1, 'func': 'apply_func', 'params': {'arg': 3, 'func_name': 'plus_one'}},
+    ...     {'id': 2, 'func': 'apply_func', 'params': {'arg': 3, 'func_name': 'nope'}},
+    ... ]
+    >>> _ = dispatch(af.QueueMessage(body=json.dumps(calls)), out)
+    >>> json.loads(out.get())
+    [{'id': 1, 'status': 200, 'result': 4}, {'id': 2, 'status': 404, 'error': "'nope'"}]
+    """
+
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def _queue_function(dispatch: QueueDispatch, with_output: bool):
+    # (Azure binds the trigger and output to the function's parameters, by name)
+    if with_output:
+
+        def queue_function(msg: af.QueueMessage, out: af.Out[str]) -> None:
+            dispatch(msg, out)
+
+    else:
+
+        def queue_function(msg: af.QueueMessage) -> None:
+            dispatch(msg)
+
+    queue_function.__name__ = dispatch.name
+    return queue_function
+
+
+def add_queue_route(
+    funcs,
+    *,
+    app=None,
+    queue_name: str,
+    output_queue_name: Optional[str] = None,
+    connection: str = DFLT_QUEUE_CONNECTION,
+    ingress=(),
+    egress=(),
+    profiler: Optional[RequestProfiler] = None,
+):
+    """
+    Register a queue-triggered Azure function that calls `funcs` for the calls of
+    the messages of `queue_name` (see `QueueDispatch`), writing results to
+    `output_queue_name`, if given.
+
+    (Azure delivers queue messages one per invocation: to process calls in bulk,
+    put many of them in each message, as a JSON list.)
+    """
+    if app is None:
+        app = default_app_factory()
+    wrappers = _wrappers(funcs, ingress, egress, profiler)
+    name = 'queue_' + re.sub(r"\W+", '_', queue_name)
+    dispatch = QueueDispatch(wrappers, name=name)
+    function = _queue_function(dispatch, with_output=output_queue_name is not None)
+    if output_queue_name is not None:
+        function = app.queue_output(
+            arg_name='out', queue_name=output_queue_name, connection=connection
+        )(function)
+    app.queue_trigger(arg_name='msg', queue_name=queue_name, connection=connection)(
+        function
+    )
+    return app
+
+
+# -------------------------------------------------------------------------------------
+# Jobs
+
+DFLT_JOBS_ROUTE = _jobs.DFLT_JOBS_PREFIX + '/{*path}'
+
+
+@dataclass
+class AzureJobs:
+    """
+    A single Azure function serving the job API (see `wip_qh.jobs`) of the wrapped
+    functions: ``POST jobs/{func_name}``, ``GET jobs/{job_id}``,
+    ``GET jobs/{job_id}/result`` and ``DELETE jobs/{job_id}``.
+
+    The params of a submission are extracted with the function's ingress (a 400 if
+    it fails, or if a JSON body isn't valid JSON), and checked against the function's
+    signature (a 422 if they don't fit it), and the function itself (not its wrapper)
+    is run by the `runner`.
+    """
+
+    wrappers: Mapping[str, AzureWrap]
+    runner: _jobs.JobRunner
+    prefix: str = _jobs.DFLT_JOBS_PREFIX
+    name: str = 'jobs'
+
+    def __post_init__(self):
+        self.runner.funcs.update(
+            {name: wrapper.func for name, wrapper in self.wrappers.items()}
+        )
+
+    @property
+    def __name__(self):
+        return self.name
+
+    def _respond(self, req: af.HttpRequest, path: str) -> _jobs.HttpResponse:
+        method = req.method.upper()
+        name, _, rest = path.strip('/').partition('/')  # (a func name, or a job id)
+        if method == 'POST' and not rest and name in self.wrappers:
+            return self._submit(req, name)
+        if method == 'GET' and not rest:
+            return _jobs.status_response(self.runner, name)
+        if method == 'GET' and rest == 'result':
+            return _jobs.result_response(self.runner, name)
+        if method == 'DELETE' and not rest:
+            return _jobs.cancel_response(self.runner, name)
+        return 404, json.dumps({'detail': f"Not found: {path}"}).encode('utf-8'), {}
+
+    def _submit(self, req: af.HttpRequest, name: str) -> _jobs.HttpResponse:
+        wrapper = self.wrappers[name]
+        content_type = req.headers.get('content-type') or JSON_MIMETYPE
+        body = req.get_body()
+        if body and content_type.startswith(JSON_MIMETYPE):
+            try:
+                payload = json.loads(body)
+            except ValueError as e:
+                return _jobs.error_response(400, f"Invalid JSON: {e}")
+            if not isinstance(payload, dict):
+                return _jobs.error_response(422, "The params should be a JSON object")
+        try:
+            params = wrapper.ingress(req)
+        except Exception as e:
+            return _jobs.error_response(400, f"Invalid params: {e}")
+        invalid = _jobs.invalid_params_response(wrapper.func, params)
+        if invalid is not None:
+            return invalid
+        return _jobs.submit_response(self.runner, name, params, prefix=self.prefix)
+
+    def __call__(self, req: af.HttpRequest) -> af.HttpResponse:
+        status_code, body, headers = self._respond(
+            req, req.route_params.get('path', '')
+        )
+        return af.HttpResponse(
+            body, status_code=status_code, headers=headers, mimetype=JSON_MIMETYPE
+        )
+
+
+def add_jobs_route(
+    funcs,
+    runner: _jobs.JobRunner,
+    *,
+    app=None,
+    route: str = DFLT_JOBS_ROUTE,
+    ingress=(),
+):
+    """
+    Register a (catch-all) route serving the job API of `funcs` (see `AzureJobs`).
+    `ingress` maps function names (or functions) to their ingress configurations.
+    """
+    if app is None:
+        app = default_app_factory()
+    wrappers = _wrappers(funcs, ingress)
+    prefix = route.split('{')[0].strip('/')
+    jobs = AzureJobs(wrappers, runner, prefix=prefix)
+    app.route(route=route, methods=("GET", "POST", "DELETE"))(jobs)
     return app
 
 
@@ -150,9 +835,13 @@ def dispatch_funcs(funcs, *, app=None, ingress=()):
 
 # wip_qh/azure/azure_funcs_02.py
 import azure.functions as af
-from wip_qh.azure.core_logic import list_funcs, apply_func
+from wip_qh.azure.core_logic import list_funcs, apply_func, apply_pipeline
 
-app = dispatch_funcs([list_funcs, apply_func], ingress=dict(apply_func={'arg': int}))
+app = dispatch_funcs(
+    [list_funcs, apply_func, apply_pipeline],
+    ingress=dict(apply_func={'arg': int}, apply_pipeline={'arg': int}),
+    cache=dict(list_funcs={'precompute': True}),
+)
 
 
 # app = af.FunctionApp(http_auth_level=af.AuthLevel.ANONYMOUS)
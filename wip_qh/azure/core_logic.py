@@ -2,19 +2,185 @@
 The core logic
 """
 
+import ast
+from importlib import import_module
+from importlib.util import find_spec
+from collections.abc import Mapping
+from functools import reduce
+from typing import Callable, Union, Iterable, Sequence, Optional
+
+ENTRY_POINT_GROUP = 'wip_qh.funcs'
+
+FuncSpec = Union[str, Callable]  # a 'module:qualname' import path, or the function
+
+
+def vectorizable(func: Callable = None, *, impl: Callable = None):
+    """
+    Mark func as having a vectorized implementation, ``impl``, taking (and returning)
+    an array of its inputs (if not given, func itself works on arrays, as is).
+    Pipelines (see `apply_pipeline`) whose stages are all vectorizable process batches
+    in array passes, instead of element by element.
+    """
+    if func is None:
+        return lambda func: vectorizable(func, impl=impl)
+    func.vectorized = impl or func
+    return func
+
+
+@vectorizable
 def plus_one(x):
     return x + 1
 
 
+@vectorizable
 def times_two(x):
     # Note: As provided, this simply adds one.
     return x + 1
 
 
-funcs = {
-    'plus_one': plus_one,
-    'times_two': times_two,
-}
+def import_object(path: str):
+    """
+    Import an object from a ``'module:qualname'`` (or ``'module.name'``) path.
+
+    >>> import_object('math:sqrt')(4)
+    2.0
+    >>> import_object('os.path.basename')('a/b')
+    'b'
+    """
+    if ':' in path:
+        module_path, qualname = path.split(':', 1)
+    else:
+        module_path, qualname = path.rsplit('.', 1)
+    obj = import_module(module_path)
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def public_function_names(module_path: str) -> Iterable[str]:
+    """
+    The names of the public functions defined at the top level of a module,
+    found by parsing its source, so without importing it.
+    """
+    spec = find_spec(module_path)
+    if spec is None or not spec.origin or not spec.origin.endswith('.py'):
+        raise ValueError(f"Can't find the source of module {module_path}")
+    with open(spec.origin, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=spec.origin)
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if not node.name.startswith('_'):
+                yield node.name
+
+
+def _entry_points(group: str):
+    from importlib.metadata import entry_points
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):  # python 3.10+
+        return eps.select(group=group)
+    return eps.get(group, ())
+
+
+class FuncRegistry(Mapping):
+    """
+    A ``{name: function}`` mapping whose functions are only imported the first time
+    they're asked for. Listing the names (iterating) never imports anything.
+
+    Functions can be registered directly, by import path, from the public functions
+    of a module (found without importing it), or from the entry points of the
+    installed distributions. Entry points are only looked for (which means reading
+    the metadata of all the installed distributions) when they're needed: when the
+    names are listed, or a name isn't found among the directly registered ones,
+    which take precedence.
+
+    >>> import sys
+    >>> registry = FuncRegistry({'rgb_to_hsv': 'colorsys:rgb_to_hsv'})
+    >>> list(registry)
+    ['rgb_to_hsv']
+    >>> registry.is_loaded('rgb_to_hsv')
+    False
+    >>> registry['rgb_to_hsv'](1, 0, 0)
+    (0.0, 1.0, 1)
+    >>> registry.is_loaded('rgb_to_hsv')
+    True
+
+    >>> registry = FuncRegistry().register_module('tabnanny', names=['check'])
+    >>> list(registry), 'tabnanny' in sys.modules
+    (['check'], False)
+
+    """
+
+    def __init__(self, specs: Mapping[str, FuncSpec] = ()):
+        self._specs = dict(specs)
+        self._loaded = {}
+        self._entry_point_groups = []  # (the groups not scanned yet)
+
+    def _scan_entry_points(self) -> bool:
+        """Register the entry points of the groups not scanned yet (if any)"""
+        if not self._entry_point_groups:
+            return False
+        groups, self._entry_point_groups = self._entry_point_groups, []
+        for group in groups:
+            for ep in _entry_points(group):
+                self._specs.setdefault(ep.name, ep.value)
+        return True
+
+    def __getitem__(self, name: str) -> Callable:
+        try:
+            return self._loaded[name]
+        except KeyError:
+            if name not in self._specs:
+                self._scan_entry_points()
+            spec = self._specs[name]  # a KeyError here means "no such function"
+            func = import_object(spec) if isinstance(spec, str) else spec
+            self._loaded[name] = func
+            return func
+
+    def __iter__(self):
+        self._scan_entry_points()
+        return iter(self._specs)
+
+    def __len__(self):
+        self._scan_entry_points()
+        return len(self._specs)
+
+    def __contains__(self, name):
+        if name not in self._specs:
+            self._scan_entry_points()
+        return name in self._specs
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._loaded
+
+    def register(self, name: str, spec: FuncSpec):
+        self._specs[name] = spec
+        self._loaded.pop(name, None)
+        return self
+
+    def register_module(self, module_path: str, names: Iterable[str] = None):
+        """Register (lazily) the public functions of a module, or the given names"""
+        if names is None:
+            names = public_function_names(module_path)
+        for name in names:
+            self.register(name, f"{module_path}:{name}")
+        return self
+
+    def register_entry_points(self, group: str = ENTRY_POINT_GROUP):
+        """
+        Register the functions declared as entry points of `group`: the entry
+        points are looked for when needed, and their functions imported when used.
+        """
+        self._entry_point_groups.append(group)
+        return self
+
+
+funcs = FuncRegistry(
+    {
+        'plus_one': plus_one,
+        'times_two': times_two,
+    }
+).register_entry_points()
 
 
 def list_funcs():
@@ -31,3 +197,88 @@ def apply_func(*, arg, func_name='plus_one'):
     f = get_func(func_name)
     return f(arg)
 
+
+def _compose(stages: Sequence[Callable]) -> Callable:
+    return lambda x: reduce(lambda acc, f: f(acc), stages, x)
+
+
+def _numeric_array(args: Sequence, np):
+    """args as a 1-D int64 or float64 array, or None if they aren't all ints (that fit
+    in 64 bits), or all floats"""
+    types = set(map(type, args))  # (exact types: bools aren't ints here)
+    if types == {int}:
+        dtype = np.int64
+    elif types == {float}:
+        dtype = np.float64
+    else:
+        return None
+    try:
+        return np.array(args, dtype=dtype)
+    except OverflowError:
+        return None
+
+
+def _apply_vectorized(stages: Sequence[Callable], args: Sequence):
+    """
+    Apply the stages' vectorized implementations, chained, to the array of args.
+    Returns None (for the caller to process args element by element) if the stages
+    aren't all vectorizable, args aren't all ints or all floats, or the array results
+    could differ from the element by element ones: if they're not numbers, one per
+    arg, or integers that overflowed (which numpy wraps silently).
+
+    >>> _apply_vectorized([plus_one], [1, 2])
+    [2, 3]
+    >>> _apply_vectorized([plus_one], [2**63 - 1]) is None  # (would wrap)
+    True
+    >>> _apply_vectorized([plus_one], [1, 2.5]) is None  # (would all be floats)
+    True
+    """
+    impls = [getattr(stage, 'vectorized', None) for stage in stages]
+    if not all(impls):
+        return None
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    arr = _numeric_array(args, np)
+    if arr is None:
+        return None
+    with np.errstate(all='ignore'):
+        out = np.asarray(_compose(impls)(arr))
+        if out.shape != arr.shape or out.dtype.kind not in 'iuf':
+            return None
+        if arr.dtype.kind == 'i':
+            # the same computation in floats doesn't wrap: far apart values mean
+            # some integer overflowed
+            approx = np.asarray(_compose(impls)(arr.astype(np.float64)))
+            if approx.shape != out.shape or not np.allclose(
+                out, approx, rtol=1e-9, atol=0, equal_nan=True
+            ):
+                return None
+    return out.tolist()
+
+
+def apply_pipeline(
+    *, func_names: Union[str, Sequence[str]], arg=None, args: Sequence = None
+):
+    """
+    Apply a chain of registered functions (the first one first) to arg, or to each
+    of args, in one go: the stages' outputs are passed on as they are, and batches
+    are processed in one pass (in array passes if all the stages are vectorizable).
+
+    >>> apply_pipeline(func_names=['plus_one', 'plus_one'], arg=3)
+    5
+    >>> apply_pipeline(func_names='plus_one,times_two', args=[1, 2, 3])
+    [3, 4, 5]
+    """
+    if isinstance(func_names, str):
+        func_names = [name.strip() for name in func_names.split(',') if name.strip()]
+    stages = [get_func(name) for name in func_names]  # (KeyError if unknown)
+    if args is None:
+        return _compose(stages)(arg)
+    if arg is not None:
+        raise ValueError("Give either arg or args, not both")
+    outputs = _apply_vectorized(stages, args)
+    if outputs is not None:
+        return outputs
+    return list(map(_compose(stages), args))
@@ -0,0 +1,265 @@
+"""
+Test the single-route (``fn/{func_name}``) dispatch mode of `dispatch_funcs`.
+"""
+
+import json
+import azure.functions as af
+
+from wip_qh.azure.azure_funcs_02 import dispatch_funcs
+from wip_qh.azure.core_logic import list_funcs, apply_func
+from wip_qh.azure.test_azure_funcs_01 import routes_of_app
+
+
+def mk_single_route_app():
+    return dispatch_funcs(
+        [list_funcs, apply_func],
+        ingress=dict(apply_func={'arg': int}),
+        single_route='fn/{func_name}',
+    )
+
+
+def _request(func_name, params=None, body=None, method="GET"):
+    return af.HttpRequest(
+        method=method,
+        url=f"/api/fn/{func_name}",
+        route_params={'func_name': func_name},
+        params=params or {},
+        body=body,
+    )
+
+
+def test_single_route_registers_one_function():
+    routes = dict(routes_of_app(mk_single_route_app()))
+    assert list(routes) == ['dispatch_fn']
+
+
+def test_single_route_dispatch():
+    dispatch = dict(routes_of_app(mk_single_route_app()))['dispatch_fn']
+
+    resp = dispatch(_request('list_funcs'))
+    assert resp.status_code == 200
+    assert json.loads(resp.get_body()) == list_funcs()
+
+    # per-function ingress (the 'arg' cast to int) is kept
+    resp = dispatch(_request('apply_func', params={'arg': '3'}))
+    assert resp.status_code == 200
+    assert json.loads(resp.get_body()) == 4
+
+    body = json.dumps({'arg': 3, 'func_name': 'times_two'}).encode()
+    resp = dispatch(_request('apply_func', body=body, method="POST"))
+    assert json.loads(resp.get_body()) == 4
+
+
+def test_single_route_unknown_function():
+    dispatch = dict(routes_of_app(mk_single_route_app()))['dispatch_fn']
+    assert dispatch(_request('nonexistent')).status_code == 404
+    # unknown func_name given to apply_func is still a 404 (KeyError handle)
+    resp = dispatch(_request('apply_func', params={'arg': '3', 'func_name': 'nope'}))
+    assert resp.status_code == 404
+
+
+def test_single_route_precomputed_cache():
+    from wip_qh.response_cache import ResponseCache
+
+    cache = ResponseCache()
+    app = dispatch_funcs(
+        [list_funcs, apply_func],
+        single_route='fn/{func_name}',
+        cache=dict(list_funcs={'precompute': True}),
+        response_cache=cache,
+    )
+    assert len(cache) == 0  # nothing is computed at registration (import time)
+    dispatch = dict(routes_of_app(app))['dispatch_fn']
+    dispatch(_request('apply_func', params={'arg': '3'}))  # (the first request)
+    assert len(cache) == 1
+    resp = dispatch(_request('list_funcs'))
+    assert resp.headers['x-cache'] == 'hit'
+    assert json.loads(resp.get_body()) == list_funcs()
+
+
+def test_apps_have_their_own_cache_and_invalidations():
+    store = {}
+
+    def get_value(key: str):
+        return store.get(key, '')
+
+    def set_value(key: str, value: str):
+        store[key] = value
+        return value
+
+    def mk_app():
+        return dispatch_funcs(
+            [get_value, set_value],
+            single_route='fn/{func_name}',
+            cache={get_value: {'invalidated_by': ['set_value']}},
+        )
+
+    dispatch = dict(routes_of_app(mk_app()))['dispatch_fn']
+    other_dispatch = dict(routes_of_app(mk_app()))['dispatch_fn']
+    get = _request('get_value', params={'key': 'k'})
+    assert json.loads(dispatch(get).get_body()) == ''
+    assert dispatch(get).headers['x-cache'] == 'hit'
+    assert 'x-cache' not in other_dispatch(get).headers  # (not the same cache)
+
+    body = json.dumps({'key': 'k', 'value': 'v'}).encode()
+    dispatch(_request('set_value', body=body, method='POST'))
+    resp = dispatch(get)
+    assert 'x-cache' not in resp.headers and json.loads(resp.get_body()) == 'v'
+
+
+def test_queue_trigger_batches():
+    from wip_qh.azure.azure_funcs_02 import LocalOut
+
+    app = dispatch_funcs(
+        [list_funcs, apply_func],
+        ingress=dict(apply_func={'arg': int}),
+        queue={'queue_name': 'calls', 'output_queue_name': 'results'},
+    )
+    routes = dict(routes_of_app(app))
+    assert 'queue_calls' in routes and 'apply_func' in routes  # (http ones too)
+
+    calls = [
+        {
+            'id': 'a',
+            'func': 'apply_func',
+            'params': {'arg': '3', 'func_name': 'times_two'},
+        },
+        {
+            'id': 'b',
+            'func': 'apply_func',
+            'params': {'arg': 'x', 'func_name': 'plus_one'},
+        },
+        {'id': 'c', 'func': 'nope'},
+        {'id': 'd', 'func': 'list_funcs'},
+    ]
+    out = LocalOut()
+    routes['queue_calls'](af.QueueMessage(body=json.dumps(calls)), out)
+    results = {r['id']: r for r in json.loads(out.get())}
+    assert results['a'] == {'id': 'a', 'status': 200, 'result': 4}
+    assert results['b']['status'] == 400  # (a failing call doesn't fail the others)
+    assert results['c']['status'] == 404
+    assert results['d']['result'] == list_funcs()
+
+
+def test_deadline():
+    import time
+
+    def slow(secs: float):
+        time.sleep(secs)
+        return 'done'
+
+    app = dispatch_funcs(
+        [slow], ingress=dict(slow={'secs': float}), deadline=dict(slow=0.1)
+    )
+    func = dict(routes_of_app(app))['slow']
+
+    def req(secs, headers=None):
+        return af.HttpRequest(
+            'GET', '/api/slow', params={'secs': secs}, headers=headers or {}, body=b''
+        )
+
+    assert json.loads(func(req('0.01')).get_body()) == 'done'
+    tic = time.perf_counter()
+    assert func(req('2')).status_code == 504
+    assert time.perf_counter() - tic < 1
+    assert func(req('0.05', {'x-deadline-ms': '10'})).status_code == 504
+
+
+def test_deadline_pool_full(monkeypatch):
+    import threading
+    from wip_qh import deadlines
+
+    monkeypatch.setattr(deadlines, '_free_threads', threading.BoundedSemaphore(1))
+    deadlines._free_threads.acquire()  # (the only thread is taken)
+    app = dispatch_funcs([list_funcs], deadline=dict(list_funcs=1))
+    func = dict(routes_of_app(app))['list_funcs']
+    resp = func(af.HttpRequest('GET', '/api/list_funcs', body=b''))
+    assert resp.status_code == 503
+
+
+def test_deadlined_calls_are_profiled_in_their_thread(tmp_path):
+    from wip_qh.profiling import RequestProfiler
+
+    def crunch(n: int):
+        return sum(i * i for i in range(n))
+
+    profiler = RequestProfiler(output_dir=str(tmp_path), token='s3cret')
+    app = dispatch_funcs(
+        [crunch],
+        ingress=dict(crunch={'n': int}),
+        profiler=profiler,
+        deadline=dict(crunch=5),
+    )
+    func = dict(routes_of_app(app))['crunch']
+    headers = {'x-profile': '1', 'x-profile-token': 's3cret'}
+    req = af.HttpRequest(
+        'GET', '/api/crunch', params={'n': '1000'}, headers=headers, body=b''
+    )
+    assert json.loads(func(req).get_body()) == 332833500
+    [filepath] = tmp_path.glob('*-crunch-*.folded')
+    assert ':crunch:' in filepath.read_text()
+
+
+def test_apply_pipeline():
+    from wip_qh.azure import core_logic
+    from wip_qh.azure.azure_funcs_02 import app
+
+    func = dict(routes_of_app(app))['apply_pipeline']
+
+    def post(payload):
+        body = json.dumps(payload).encode()
+        return func(af.HttpRequest('POST', '/api/apply_pipeline', body=body))
+
+    chain = ['plus_one', 'times_two', 'plus_one']
+    assert json.loads(post({'func_names': chain, 'arg': 3}).get_body()) == 6
+    resp = post({'func_names': chain, 'args': [1, 2, 3]})
+    assert json.loads(resp.get_body()) == [4, 5, 6]
+    resp = post({'func_names': 'plus_one,nope', 'arg': 3})
+    assert resp.status_code == 404
+
+    # a non-vectorizable stage: batches are processed element by element
+    core_logic.funcs.register('halve', lambda x: x / 2)
+    try:
+        resp = post({'func_names': ['plus_one', 'halve'], 'args': [1, 3]})
+        assert json.loads(resp.get_body()) == [1.0, 2.0]
+    finally:
+        core_logic.funcs._specs.pop('halve')
+        core_logic.funcs._loaded.pop('halve', None)
+
+
+def test_jobs():
+    from wip_qh.jobs import JobRunner
+
+    runner = JobRunner()
+    app = dispatch_funcs(
+        [list_funcs, apply_func], ingress=dict(apply_func={'arg': int}), jobs=runner
+    )
+    jobs = dict(routes_of_app(app))['jobs']
+
+    def req(method, path, params=None, body=b''):
+        return af.HttpRequest(
+            method,
+            f'/api/jobs/{path}',
+            route_params={'path': path},
+            params=params or {},
+            body=body,
+        )
+
+    resp = jobs(req('POST', 'apply_func', {'arg': '3', 'func_name': 'plus_one'}))
+    assert resp.status_code == 202
+    job_id = json.loads(resp.get_body())['id']
+    assert resp.headers['location'] == f'/jobs/{job_id}'
+    runner.wait(job_id, timeout=5)
+    assert json.loads(jobs(req('GET', f'{job_id}/result')).get_body()) == 4
+    assert json.loads(jobs(req('GET', job_id)).get_body())['status'] == 'succeeded'
+    assert jobs(req('DELETE', job_id)).status_code == 409
+    assert jobs(req('POST', 'nope')).status_code == 404
+    assert jobs(req('GET', 'nope/result')).status_code == 404
+
+    # bad submissions are refused, rather than queued as jobs that fail
+    assert jobs(req('POST', 'apply_func', {'arg': 'abc'})).status_code == 400
+    assert jobs(req('POST', 'apply_func', body=b'{"arg": ')).status_code == 400
+    assert jobs(req('POST', 'apply_func', body=b'[3]')).status_code == 422
+    resp = jobs(req('POST', 'apply_func', {'arg': '3', 'nope': '1'}))
+    assert resp.status_code == 422
+    runner.shutdown()
@@ -0,0 +1,83 @@
+"""
+Test the lazily loaded function registry, and the pipelines, of `core_logic`.
+"""
+
+import sys
+import subprocess
+from collections import namedtuple
+
+import pytest
+
+from wip_qh.azure import core_logic
+from wip_qh.azure.core_logic import FuncRegistry
+
+EntryPoint = namedtuple('EntryPoint', 'name value')
+
+
+def test_entry_points_are_scanned_lazily(monkeypatch):
+    scanned = []
+
+    def fake_entry_points(group):
+        scanned.append(group)
+        return [
+            EntryPoint('hsv', 'colorsys:rgb_to_hsv'),
+            EntryPoint('plus_one', 'math:sqrt'),  # (registered ones take precedence)
+        ]
+
+    monkeypatch.setattr(core_logic, '_entry_points', fake_entry_points)
+    registry = FuncRegistry({'plus_one': core_logic.plus_one}).register_entry_points()
+    assert registry['plus_one'](1) == 2
+    assert scanned == []  # (no need to scan for a registered function)
+
+    assert registry['hsv'](1, 0, 0) == (0.0, 1.0, 1)
+    assert scanned == [core_logic.ENTRY_POINT_GROUP]
+    assert sorted(registry) == ['hsv', 'plus_one']
+    assert 'nope' not in registry
+    assert scanned == [core_logic.ENTRY_POINT_GROUP]  # (scanned only once)
+
+
+def test_listing_scans_entry_points(monkeypatch):
+    monkeypatch.setattr(
+        core_logic, '_entry_points', lambda group: [EntryPoint('sqrt', 'math:sqrt')]
+    )
+    registry = FuncRegistry().register_entry_points('my.group')
+    assert list(registry) == ['sqrt'] and len(registry) == 1
+    assert not registry.is_loaded('sqrt')
+
+
+def test_no_scan_at_import():
+    code = (
+        "from wip_qh.azure import core_logic; "
+        "print(core_logic.funcs._entry_point_groups)"
+    )
+    out = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True
+    ).stdout
+    assert out.strip() == repr([core_logic.ENTRY_POINT_GROUP])
+
+
+@pytest.mark.parametrize(
+    'args',
+    [
+        [1, 2, 3],
+        [0.5, -1.5],
+        [2**63 - 1, 1],  # (overflows int64)
+        [2**70],  # (doesn't fit in int64)
+        [1, 2.5],  # (mixed: numpy would make floats of the ints)
+        [True, 2],
+        [],
+    ],
+)
+def test_pipelines_vectorize_without_changing_results(args):
+    chain = ['plus_one', 'times_two']
+    expected = [x + 2 for x in args]
+    outputs = core_logic.apply_pipeline(func_names=chain, args=args)
+    assert outputs == expected
+    assert list(map(type, outputs)) == list(map(type, expected))
+
+
+@pytest.mark.parametrize('args', [[[1, 2], [3, 4]], [[1, 2], [3]]])
+def test_pipelines_of_non_scalars_fail_as_element_by_element(args):
+    # (numpy would add 2-D arrays element-wise, and fail on ragged ones)
+    with pytest.raises(TypeError):
+        core_logic.apply_pipeline(func_names=['plus_one'], args=args)
@@ -0,0 +1,430 @@
+"""
+Closed-loop capacity testing of the web service apps.
+
+`serve_app` runs an app (given as a ``"module:attr"`` import string, e.g.
+``"wip_qh.fastapi_refactors.fastapi_refactor_03:app"``) in a local uvicorn process,
+and `capacity_sweep` drives it with a weighted mix of requests (`RequestMix`) at
+increasing concurrency levels.
+
+The load is closed-loop: each of the `concurrency` workers sends a request, waits for
+its response, and sends the next one, over its own kept-alive connection. So the
+offered load adapts to the server's speed, and, as concurrency grows, throughput
+increases until the server saturates, after which only latency grows.
+`saturation_point` finds that knee: the per-instance capacity to size deployments
+with.
+
+From the command line:
+
+    python -m wip_qh.capacity wip_qh.fastapi_refactors.fastapi_refactor_03:app \\
+        --levels 1,2,4,8,16,32 --duration 5
+
+Note that the load generator is a (threaded) python process: check that it isn't
+the bottleneck (its CPU shouldn't be maxed out before the server's is), or run it
+with ``--host`` against a server on another machine.
+
+"""
+
+import sys
+import math
+import time
+import json
+import random
+import socket
+import threading
+import subprocess
+import http.client
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import List, Optional, Sequence, Tuple, Iterable
+
+DFLT_HOST = '127.0.0.1'
+DFLT_PORT = 8765
+DFLT_LEVELS = (1, 2, 4, 8, 16, 32, 64)
+DFLT_DURATION = 5.0
+DFLT_MIN_GAIN = 0.05
+DFLT_STARTUP_TIMEOUT = 20.0
+
+
+# -------------------------------------------------------------------------------------
+# Request mixes
+
+
+@dataclass
+class RequestSpec:
+    """A request to send, and its weight in a mix"""
+
+    method: str
+    path: str
+    body: Optional[dict] = None
+    weight: float = 1.0
+    name: Optional[str] = None
+
+    def __post_init__(self):
+        if self.name is None:
+            self.name = self.path.strip('/').split('/')[0].split('?')[0]
+        self._body_bytes = None if self.body is None else json.dumps(self.body).encode()
+
+
+@dataclass
+class RequestMix:
+    """
+    A weighted mix of requests to draw from.
+
+    >>> mix = RequestMix([RequestSpec('GET', '/a', weight=3), RequestSpec('GET', '/b')])
+    >>> rng = random.Random(0)
+    >>> draws = [mix.draw(rng).name for _ in range(1000)]
+    >>> 650 < draws.count('a') < 850
+    True
+    """
+
+    specs: List[RequestSpec]
+
+    def __post_init__(self):
+        if not self.specs:
+            raise ValueError("A request mix needs at least one request")
+        self._weights = [spec.weight for spec in self.specs]
+
+    def draw(self, rng: random.Random) -> RequestSpec:
+        return rng.choices(self.specs, weights=self._weights)[0]
+
+    @classmethod
+    def from_weights(cls, **weights):
+        """A mix of the standard routes (see `standard_requests`), with given weights"""
+        return cls(
+            [
+                replace(standard_requests[name], weight=weight)
+                for name, weight in weights.items()
+            ]
+        )
+
+
+# The requests of the routes that all the apps serve
+standard_requests = {
+    'store_get': RequestSpec('GET', '/store_get/alice?key=fruit'),
+    'store_set': RequestSpec(
+        'POST', '/store_set/alice?key=load_test', body={'value': {'some': 'value'}}
+    ),
+    'greeter': RequestSpec('GET', '/greeter/Hi?name=load&n=2'),
+    'random_integer': RequestSpec('GET', '/random_integer?smallest=1&highest=100'),
+}
+
+# A read-mostly default
+dflt_mix = RequestMix.from_weights(
+    store_get=6, store_set=1, greeter=2, random_integer=1
+)
+
+
+# -------------------------------------------------------------------------------------
+# Serving apps
+
+
+def _port_is_open(host: str, port: int) -> bool:
+    with socket.socket() as sock:
+        sock.settimeout(0.2)
+        return sock.connect_ex((host, port)) == 0
+
+
+@contextmanager
+def serve_app(
+    app: str,
+    *,
+    host: str = DFLT_HOST,
+    port: int = DFLT_PORT,
+    factory: bool = False,
+    workers: int = 1,
+    startup_timeout: float = DFLT_STARTUP_TIMEOUT,
+):
+    """
+    Run app (a ``"module:attr"`` import string) in a uvicorn subprocess, for the
+    duration of the context. Use ``factory=True`` if attr is a function making the app.
+    """
+    if _port_is_open(host, port):
+        raise RuntimeError(f"Something is already listening on {host}:{port}")
+    cmd = [sys.executable, '-m', 'uvicorn', app, '--host', host, '--port', str(port)]
+    cmd += ['--workers', str(workers), '--log-level', 'warning', '--no-access-log']
+    if factory:
+        cmd.append('--factory')
+    proc = subprocess.Popen(cmd)
+    try:
+        deadline = time.monotonic() + startup_timeout
+        while not _port_is_open(host, port):
+            if proc.poll() is not None:
+                raise RuntimeError(f"The server exited with code {proc.returncode}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"The server didn't start in {startup_timeout}s")
+            time.sleep(0.1)
+        yield f"http://{host}:{port}"
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# -------------------------------------------------------------------------------------
+# Closed-loop load
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """
+    The q-th percentile (nearest rank) of sorted values.
+
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 50)
+    5
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 99)
+    10
+    """
+    if not sorted_values:
+        return float('nan')
+    rank = max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+@dataclass
+class LevelResult:
+    """What was measured at one concurrency level (latencies in seconds)"""
+
+    concurrency: int
+    duration: float
+    n_requests: int
+    n_errors: int
+    latencies: List[float] = field(default_factory=list, repr=False)
+    errors_by_kind: dict = field(default_factory=dict)
+
+    @property
+    def throughput(self) -> float:
+        """Successful requests per second"""
+        return (self.n_requests - self.n_errors) / self.duration
+
+    @property
+    def error_rate(self) -> float:
+        return self.n_errors / self.n_requests if self.n_requests else 0.0
+
+    def latency(self, q: float) -> float:
+        return percentile(sorted(self.latencies), q)
+
+    def summary(self) -> dict:
+        return {
+            'concurrency': self.concurrency,
+            'throughput': round(self.throughput, 1),
+            'p50_ms': round(self.latency(50) * 1000, 2),
+            'p90_ms': round(self.latency(90) * 1000, 2),
+            'p99_ms': round(self.latency(99) * 1000, 2),
+            'error_rate': round(self.error_rate, 4),
+        }
+
+
+def _worker(host, port, mix, seed, stop_at, timeout, record):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    headers = {'Content-Type': 'application/json'}
+    try:
+        while time.monotonic() < stop_at:
+            spec = mix.draw(rng)
+            tic = time.perf_counter()
+            try:
+                conn.request(spec.method, spec.path, spec._body_bytes, headers)
+                response = conn.getresponse()
+                response.read()
+                error = None if response.status < 400 else f"http_{response.status}"
+            except (OSError, http.client.HTTPException) as e:
+                error = type(e).__name__
+                conn.close()  # (reconnects on next request)
+            record(time.perf_counter() - tic, error)
+    finally:
+        conn.close()
+
+
+def closed_loop(
+    base_url: str,
+    concurrency: int,
+    *,
+    mix: RequestMix = dflt_mix,
+    duration: float = DFLT_DURATION,
+    timeout: float = 30.0,
+    seed: int = 0,
+) -> LevelResult:
+    """Run `concurrency` closed-loop workers on base_url for `duration` seconds"""
+    host, port = _host_and_port(base_url)
+    latencies, errors_by_kind = [], {}
+    lock = threading.Lock()
+
+    def record(latency, error):
+        with lock:
+            latencies.append(latency)
+            if error is not None:
+                errors_by_kind[error] = errors_by_kind.get(error, 0) + 1
+
+    stop_at = time.monotonic() + duration
+    args = (host, port, mix)
+    threads = [
+        threading.Thread(
+            target=_worker, args=(*args, seed + i, stop_at, timeout, record)
+        )
+        for i in range(concurrency)
+    ]
+    tic = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return LevelResult(
+        concurrency,
+        duration=time.monotonic() - tic,
+        n_requests=len(latencies),
+        n_errors=sum(errors_by_kind.values()),
+        latencies=latencies,
+        errors_by_kind=errors_by_kind,
+    )
+
+
+def _host_and_port(base_url: str) -> Tuple[str, int]:
+    """
+    >>> _host_and_port('http://localhost:8000')
+    ('localhost', 8000)
+    """
+    netloc = base_url.split('://', 1)[-1].split('/', 1)[0]
+    host, _, port = netloc.partition(':')
+    return host, int(port or 80)
+
+
+# -------------------------------------------------------------------------------------
+# Sweeps and saturation
+
+
+def saturation_point(
+    results: Sequence[LevelResult],
+    *,
+    min_gain: float = DFLT_MIN_GAIN,
+    max_error_rate: float = 0.01,
+) -> Optional[LevelResult]:
+    """
+    The level past which more concurrency doesn't buy (at least `min_gain`, relative)
+    more throughput, or makes the error rate exceed `max_error_rate`.
+    None if the sweep didn't reach saturation.
+
+    >>> mk = lambda c, n, e=0: LevelResult(c, duration=1, n_requests=n, n_errors=e)
+    >>> saturation_point([mk(1, 100), mk(2, 190), mk(4, 350), mk(8, 360), mk(16, 355)])
+    LevelResult(concurrency=4, duration=1, n_requests=350, n_errors=0, errors_by_kind={})
+    >>> saturation_point([mk(1, 100), mk(2, 190), mk(4, 400, e=50)]).concurrency
+    2
+    >>> saturation_point([mk(1, 100), mk(2, 190)]) is None
+    True
+    """
+    for previous, current in zip(results, results[1:]):
+        if current.error_rate > max_error_rate:
+            return previous
+        if current.throughput < previous.throughput * (1 + min_gain):
+            return previous
+    return None
+
+
+def capacity_sweep(
+    base_url: str,
+    levels: Iterable[int] = DFLT_LEVELS,
+    *,
+    mix: RequestMix = dflt_mix,
+    duration: float = DFLT_DURATION,
+    min_gain: float = DFLT_MIN_GAIN,
+    stop_after_saturation: bool = True,
+    verbose: bool = False,
+) -> List[LevelResult]:
+    """
+    Run closed-loop load at each concurrency level. If `stop_after_saturation`,
+    the sweep stops one level after saturation was detected.
+    """
+    results = []
+    for concurrency in levels:
+        result = closed_loop(base_url, concurrency, mix=mix, duration=duration)
+        results.append(result)
+        if verbose:
+            print(format_row(result.summary()), flush=True)
+        if stop_after_saturation and len(results) >= 3:
+            if saturation_point(results[:-1], min_gain=min_gain) is not None:
+                break
+    return results
+
+
+_columns = ('concurrency', 'throughput', 'p50_ms', 'p90_ms', 'p99_ms', 'error_rate')
+
+
+def format_row(row) -> str:
+    return ''.join(f"{row[c]:>13}" for c in _columns)
+
+
+def report(results: Sequence[LevelResult], *, min_gain: float = DFLT_MIN_GAIN) -> str:
+    """A text table of the throughput/latency curve, and the saturation point"""
+    lines = [''.join(f"{c:>13}" for c in _columns)]
+    lines += [format_row(result.summary()) for result in results]
+    saturated = saturation_point(results, min_gain=min_gain)
+    if saturated is None:
+        lines.append("Not saturated: try higher concurrency levels")
+    else:
+        s = saturated.summary()
+        lines.append(
+            f"Saturation at concurrency {s['concurrency']}: "
+            f"{s['throughput']} req/s, p99 {s['p99_ms']} ms"
+        )
+    errors = {}
+    for result in results:
+        for kind, n in result.errors_by_kind.items():
+            errors[kind] = errors.get(kind, 0) + n
+    if errors:
+        lines.append(f"Errors: {errors}")
+    return '\n'.join(lines)
+
+
+def _parse_mix(mix_string: str) -> RequestMix:
+    """
+    >>> [(s.name, s.weight) for s in _parse_mix('store_get=3,greeter=1').specs]
+    [('store_get', 3.0), ('greeter', 1.0)]
+    """
+    weights = dict(item.split('=') for item in mix_string.split(','))
+    return RequestMix.from_weights(**{k: float(v) for k, v in weights.items()})
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('app', help="The app, as a 'module:attr' import string")
+    parser.add_argument('--levels', default=','.join(map(str, DFLT_LEVELS)))
+    parser.add_argument('--duration', type=float, default=DFLT_DURATION)
+    parser.add_argument(
+        '--mix', default=None, help="e.g. 'store_get=6,store_set=1,greeter=2'"
+    )
+    parser.add_argument('--host', default=DFLT_HOST)
+    parser.add_argument('--port', type=int, default=DFLT_PORT)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--factory', action='store_true')
+    parser.add_argument(
+        '--no-serve', action='store_true', help="Use an already running server"
+    )
+    args = parser.parse_args(argv)
+
+    levels = [int(x) for x in args.levels.split(',')]
+    mix = _parse_mix(args.mix) if args.mix else dflt_mix
+
+    def sweep(base_url):
+        print(''.join(f"{c:>13}" for c in _columns))
+        results = capacity_sweep(
+            base_url, levels, mix=mix, duration=args.duration, verbose=True
+        )
+        print(report(results).split('\n', len(results) + 1)[-1])
+
+    if args.no_serve:
+        sweep(f"http://{args.host}:{args.port}")
+    else:
+        with serve_app(
+            args.app,
+            host=args.host,
+            port=args.port,
+            factory=args.factory,
+            workers=args.workers,
+        ) as base_url:
+            sweep(base_url)
+
+
+if __name__ == '__main__':
+    main()
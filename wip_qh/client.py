@@ -0,0 +1,463 @@
+"""
+Python clients for the web services, generated from the same declarations that
+generated the services: route_specs (see `fast_api_app`) or a `dispatch_funcs`
+function registry (Azure).
+
+A client has one method per route, with the signature of the route's function,
+so that ``client.greeter('Hi', name='you')`` makes the right http request (path,
+query and body parameters, as the specs declare them) and returns the decoded
+JSON output.
+
+Clients use a single `httpx` client, so connections are pooled and kept alive
+across calls (no TCP/TLS handshake per call), and come in a sync (`ServiceClient`)
+and an async (`AsyncServiceClient`) flavor.
+
+Calls can also be batched:
+
+    with client.batch() as batch:
+        a = batch.greeter('Hi')
+        b = batch.get_store_value('alice', key='fruit')
+    a.result(), b.result()
+
+By default, the calls are made concurrently over the connection pool. If the service
+has an RPC batch route (as `fast_api_app(..., rpc_path='/rpc')` services do, see
+`wip_qh.fastapi_refactors.websocket_rpc`), give its path as ``batch_path`` (e.g.
+``DFLT_RPC_BATCH_PATH``) to send the whole batch as one request (or a few, of at
+most ``max_batch_size`` calls: keep that within the server's own limit).
+
+"""
+
+import inspect
+from urllib.parse import quote
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Mapping, Tuple, Optional, Iterable, List
+
+from i2 import name_of_obj
+
+DFLT_BASE_URL = 'http://localhost:8000'
+DFLT_AZURE_BASE_URL = 'http://localhost:7071/api'
+DFLT_RPC_BATCH_PATH = '/rpc/batch'  # (same as in websocket_rpc)
+DFLT_MAX_CONNECTIONS = 20
+DFLT_MAX_BATCH_SIZE = 500  # (same as in websocket_rpc)
+
+
+# -------------------------------------------------------------------------------------
+# Route calls: how to make a request out of a function call
+
+
+@dataclass
+class RouteCall:
+    """How to make the http request for a call to the function of a route"""
+
+    name: str
+    method: str
+    path: str
+    signature: inspect.Signature
+    path_params: Tuple[str, ...] = ()
+    query_params: Mapping[str, str] = field(default_factory=dict)  # name -> alias
+    body_params: Mapping[str, str] = field(default_factory=dict)  # name -> alias
+    embed_body: bool = True
+
+    def arguments(self, *args, **kwargs) -> dict:
+        """The arguments explicitly given (the service fills in the defaults)"""
+        return self.signature.bind_partial(*args, **kwargs).arguments
+
+    def request_parts(self, arguments: dict) -> dict:
+        """
+        The ``method``, ``url``, ``params`` and ``json`` of the request for the call.
+
+        >>> def greeter(greeting: str, name: str = 'world'): ...
+        >>> route = RouteCall(
+        ...     'greeter', 'GET', '/greeter/{greeting}', inspect.signature(greeter),
+        ...     path_params=('greeting',), query_params={'name': 'name'}
+        ... )
+        >>> route.request_parts(route.arguments('Hi', name='you'))
+        {'method': 'GET', 'url': '/greeter/Hi', 'params': {'name': 'you'}}
+        """
+        path_args = {k: quote(str(arguments[k]), safe='') for k in self.path_params}
+        url = self.path.format(**path_args)
+        parts = {'method': self.method, 'url': url}
+        params = {
+            alias: arguments[name]
+            for name, alias in self.query_params.items()
+            if name in arguments
+        }
+        if params:
+            parts['params'] = params
+        body = {
+            alias: arguments[name]
+            for name, alias in self.body_params.items()
+            if name in arguments
+        }
+        if self.body_params:
+            if self.embed_body:
+                parts['json'] = body
+            else:
+                parts['json'] = next(iter(body.values()), None)
+        return parts
+
+
+def route_calls_of_route_specs(route_specs: Mapping) -> Iterable[RouteCall]:
+    """The RouteCalls of route_specs (as `fast_api_app` would serve them)"""
+    from fastapi import params as fastapi_params
+    from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import (
+        mk_api_route_kwargs,
+        _ensure_list_of_upper_case_strings,
+    )
+    from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_05 import compile_path
+
+    for func, spec in route_specs.items():
+        api_route_kwargs = mk_api_route_kwargs(func, spec)
+        path = api_route_kwargs['path']
+        method = _ensure_list_of_upper_case_strings(api_route_kwargs['methods'])[0]
+        _, path_params = compile_path(path)
+        defaults = spec.get('defaults', {})
+        signature = inspect.signature(func)
+        query_params, body_params, embed = {}, {}, True
+        for name in signature.parameters:
+            default = defaults.get(name)
+            alias = getattr(default, 'alias', None) or name
+            if name in path_params:
+                continue
+            elif isinstance(default, fastapi_params.Body):
+                body_params[name] = alias
+                embed = embed and default.embed
+            else:
+                query_params[name] = alias
+        if len(body_params) > 1:
+            embed = True
+        yield RouteCall(
+            api_route_kwargs['name'],
+            method,
+            path,
+            signature,
+            path_params,
+            query_params,
+            body_params,
+            embed,
+        )
+
+
+def route_calls_of_funcs(
+    funcs, *, single_route: Optional[str] = None
+) -> Iterable[RouteCall]:
+    """
+    The RouteCalls of a `dispatch_funcs` registry (all params in a POSTed JSON body),
+    including the single-route (e.g. ``'fn/{func_name}'``) mode.
+    """
+    if not isinstance(funcs, Mapping):
+        funcs = {name_of_obj(func): func for func in funcs}
+    for name, func in funcs.items():
+        if single_route is None:
+            path = f"/{name}"
+        else:
+            path = '/' + single_route.split('{')[0] + name
+        signature = inspect.signature(func)
+        body_params = {p: p for p in signature.parameters}
+        yield RouteCall(name, 'POST', path, signature, body_params=body_params)
+
+
+# -------------------------------------------------------------------------------------
+# Clients
+
+
+class RemoteCallError(RuntimeError):
+    """Raised (by batch results) when a remote call failed"""
+
+    def __init__(self, error):
+        self.error = error
+        if isinstance(error, dict):
+            error = f"{error.get('type')}: {error.get('message')}"
+        super().__init__(error)
+
+
+_pending = object()
+
+
+class BatchResult:
+    """The (future) result of a batched call"""
+
+    def __init__(self):
+        self._result = _pending
+        self._error = None
+
+    def _set(self, response: dict):
+        if 'error' in response:
+            self._error = RemoteCallError(response['error'])
+        else:
+            self._result = response.get('result')
+
+    def done(self) -> bool:
+        return self._error is not None or self._result is not _pending
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        if self._result is _pending:
+            raise RuntimeError("The batch hasn't been sent yet")
+        return self._result
+
+
+def _mk_limits(max_connections: int):
+    import httpx
+
+    return httpx.Limits(
+        max_connections=max_connections, max_keepalive_connections=max_connections
+    )
+
+
+class _BaseServiceClient:
+    route_calls: Mapping[str, RouteCall] = {}
+
+    def __init__(
+        self,
+        base_url: str = DFLT_BASE_URL,
+        *,
+        http_client=None,
+        max_connections: int = DFLT_MAX_CONNECTIONS,
+        batch_path: Optional[str] = None,
+        max_batch_size: int = DFLT_MAX_BATCH_SIZE,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+        self.batch_path = batch_path
+        self.max_batch_size = max_batch_size
+        self.http_client = http_client or self._mk_http_client()
+
+    def _url(self, url: str) -> str:
+        return self.base_url + url
+
+    @staticmethod
+    def _output(response):
+        response.raise_for_status()
+        return response.json() if response.content else None
+
+    def _batches(self, calls: List[tuple]):
+        for i in range(0, len(calls), self.max_batch_size):
+            yield calls[i : i + self.max_batch_size]
+
+    @staticmethod
+    def _rpc_messages(calls: List[tuple]):
+        return [
+            {'id': i, 'func': route.name, 'params': arguments}
+            for i, (route, arguments, _) in enumerate(calls)
+        ]
+
+
+class ServiceClient(_BaseServiceClient):
+    """
+    Base class of the (sync) clients made by `mk_client`: one method per route,
+    over a pooled, keep-alive, `httpx.Client`.
+    """
+
+    def _mk_http_client(self):
+        import httpx
+
+        return httpx.Client(limits=_mk_limits(self.max_connections))
+
+    def _call(self, route: RouteCall, arguments: dict):
+        parts = route.request_parts(arguments)
+        parts['url'] = self._url(parts['url'])
+        return self._output(self.http_client.request(**parts))
+
+    def batch(self) -> '_Batch':
+        """Context manager collecting calls, to send them all on exit"""
+        return _Batch(self)
+
+    def _send_batch(self, calls: List[tuple]):
+        if self.batch_path is not None:
+            for batch in self._batches(calls):
+                url = self._url(self.batch_path)
+                messages = self._rpc_messages(batch)
+                responses = self._output(self.http_client.post(url, json=messages))
+                for (_, _, result), response in zip(batch, responses):
+                    result._set(response)
+        else:
+            with ThreadPoolExecutor(self.max_connections) as executor:
+                futures = [
+                    (result, executor.submit(self._call, route, arguments))
+                    for route, arguments, result in calls
+                ]
+                for result, future in futures:
+                    try:
+                        result._set({'result': future.result()})
+                    except Exception as e:
+                        result._set({'error': _error(e)})
+
+    def close(self):
+        self.http_client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncServiceClient(_BaseServiceClient):
+    """
+    Base class of the async clients made by `mk_async_client`: one coroutine method
+    per route, over a pooled, keep-alive, `httpx.AsyncClient`.
+    """
+
+    def _mk_http_client(self):
+        import httpx
+
+        return httpx.AsyncClient(limits=_mk_limits(self.max_connections))
+
+    async def _call(self, route: RouteCall, arguments: dict):
+        parts = route.request_parts(arguments)
+        parts['url'] = self._url(parts['url'])
+        return self._output(await self.http_client.request(**parts))
+
+    def batch(self) -> '_AsyncBatch':
+        """Async context manager collecting calls, to send them all on exit"""
+        return _AsyncBatch(self)
+
+    async def _send_batch(self, calls: List[tuple]):
+        import asyncio
+
+        if self.batch_path is not None:
+            for batch in self._batches(calls):
+                url = self._url(self.batch_path)
+                messages = self._rpc_messages(batch)
+                response = await self.http_client.post(url, json=messages)
+                for (_, _, result), response in zip(batch, self._output(response)):
+                    result._set(response)
+        else:
+            outputs = await asyncio.gather(
+                *(self._call(route, arguments) for route, arguments, _ in calls),
+                return_exceptions=True,
+            )
+            for (_, _, result), output in zip(calls, outputs):
+                if isinstance(output, BaseException):
+                    result._set({'error': _error(output)})
+                else:
+                    result._set({'result': output})
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+def _error(e: BaseException) -> dict:
+    return {'type': type(e).__name__, 'message': str(e)}
+
+
+class _BatchCollector:
+    """Has the client's route methods, but collecting the calls instead"""
+
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        route = self._client.route_calls.get(name)
+        if route is None:
+            raise AttributeError(name)
+
+        def collect(*args, **kwargs):
+            result = BatchResult()
+            self._calls.append((route, route.arguments(*args, **kwargs), result))
+            return result
+
+        return collect
+
+
+class _Batch(_BatchCollector):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None and self._calls:
+            self._client._send_batch(self._calls)
+
+
+class _AsyncBatch(_BatchCollector):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, *exc):
+        if exc_type is None and self._calls:
+            await self._client._send_batch(self._calls)
+
+
+# -------------------------------------------------------------------------------------
+# Client factories
+
+
+def _mk_route_method(route: RouteCall, is_async: bool):
+    self_param = inspect.Parameter('self', inspect.Parameter.POSITIONAL_OR_KEYWORD)
+    if is_async:
+
+        async def method(self, *args, **kwargs):
+            return await self._call(route, route.arguments(*args, **kwargs))
+
+    else:
+
+        def method(self, *args, **kwargs):
+            return self._call(route, route.arguments(*args, **kwargs))
+
+    params = [self_param, *route.signature.parameters.values()]
+    method.__signature__ = route.signature.replace(parameters=params)
+    method.__name__ = method.__qualname__ = route.name
+    method.__doc__ = f"{route.method} {route.path}"
+    return method
+
+
+def _mk_client_class(route_calls: Iterable[RouteCall], base, name: str):
+    route_calls = {route.name: route for route in route_calls}
+    is_async = issubclass(base, AsyncServiceClient)
+    methods = {
+        route_name: _mk_route_method(route, is_async)
+        for route_name, route in route_calls.items()
+    }
+    return type(name, (base,), dict(methods, route_calls=route_calls))
+
+
+def _route_calls(routes, single_route):
+    if isinstance(routes, Mapping) and all(
+        isinstance(spec, Mapping) for spec in routes.values()
+    ):
+        return list(route_calls_of_route_specs(routes))
+    return list(route_calls_of_funcs(routes, single_route=single_route))
+
+
+def mk_client_class(
+    routes, *, single_route: Optional[str] = None, is_async: bool = False
+):
+    """
+    Make a client class for routes: route_specs (a ``{func: spec}`` dict), or the
+    ``funcs`` given to `dispatch_funcs` (a list, or ``{name: func}`` dict).
+    """
+    base = AsyncServiceClient if is_async else ServiceClient
+    route_calls = _route_calls(routes, single_route)
+    return _mk_client_class(route_calls, base, base.__name__)
+
+
+def mk_client(
+    routes, base_url: str = DFLT_BASE_URL, *, single_route=None, **client_kwargs
+) -> ServiceClient:
+    """
+    Make a (sync) client for routes (route_specs or a `dispatch_funcs` registry).
+
+    For a `dispatch_funcs` registry, you'll probably want to give
+    ``base_url=DFLT_AZURE_BASE_URL``. For a service with an RPC batch route, give
+    ``batch_path=DFLT_RPC_BATCH_PATH`` (or wherever it is) to use it for batches.
+    """
+    cls = mk_client_class(routes, single_route=single_route)
+    return cls(base_url, **client_kwargs)
+
+
+def mk_async_client(
+    routes, base_url: str = DFLT_BASE_URL, *, single_route=None, **client_kwargs
+) -> AsyncServiceClient:
+    """Make an async client for routes (route_specs or a `dispatch_funcs` registry)"""
+    cls = mk_client_class(routes, single_route=single_route, is_async=True)
+    return cls(base_url, **client_kwargs)
@@ -0,0 +1,254 @@
+"""
+Content-negotiated encodings for web service inputs and outputs.
+
+A codec registry maps mimetypes to `Codec`s. Egress picks the codec from the
+request's ``Accept`` header (`negotiate`), and ingress picks it from the request's
+``Content-Type`` (`codec_for_content_type`).
+
+Besides JSON, a compact binary framing for NumPy arrays is registered (if numpy is
+installed), under `NDARRAY_MIMETYPE`:
+
+    b'NDAR' | header length (uint32, little endian) | JSON header | raw array buffer
+
+where the header is ``{"dtype": ..., "shape": [...]}``. The frame is made of two
+chunks, the second one being a `memoryview` of the array's own memory (see
+`Codec.encode_chunks`), so that it isn't joined with the header into one bytes.
+Served over ASGI, whose bodies have to be bytes, the array is still copied once, into
+the bytes of its chunk. Decoding gives an array that is a view of the received bytes.
+
+`json_dumps_bytes` is the one-pass JSON encoder of the routes whose outputs are
+declared JSON-compatible (``"output"`` in route specs): it uses ``orjson``, if
+installed, and the standard ``json`` otherwise. `EncodedJSON` marks bytes that are
+already JSON, and are sent as they are.
+
+"""
+
+import json
+import struct
+from dataclasses import dataclass, field
+from typing import Callable, Any, List, Tuple, Mapping, Optional
+
+JSON_MIMETYPE = 'application/json'
+NDARRAY_MIMETYPE = 'application/x-ndarray'
+
+
+def _always(obj) -> bool:
+    return True
+
+
+@dataclass
+class Codec:
+    """
+    How to encode (to bytes) and decode (from bytes) objects for a given mimetype.
+
+    `encode_chunks` returns a list of bytes-like chunks to be written one after the
+    other (so that big buffers can be written without being copied into one bytes).
+    `can_encode` says if the codec can encode a given object.
+    """
+
+    mimetype: str
+    encode_chunks: Callable[[Any], List[Any]]
+    decode: Callable[[bytes], Any]
+    can_encode: Callable[[Any], bool] = field(default=_always)
+
+    def encode(self, obj) -> bytes:
+        chunks = self.encode_chunks(obj)
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+
+# -------------------------------------------------------------------------------------
+# JSON
+
+
+class EncodedJSON(bytes):
+    """Bytes that are the JSON encoding of a value (see `json_dumps_bytes`)"""
+
+
+def to_jsonable(obj):
+    """
+    A JSON-compatible version of obj, for the objects `json.dumps` (or ``orjson``)
+    can't encode itself (it's their ``default``): numpy arrays and scalars, embedded
+    `EncodedJSON`, and whatever FastAPI's ``jsonable_encoder`` handles (pydantic
+    models, datetimes, ...).
+
+    >>> import datetime
+    >>> to_jsonable(datetime.date(2024, 1, 2))
+    '2024-01-02'
+    """
+    if hasattr(obj, 'tolist'):  # numpy arrays and scalars
+        return obj.tolist()
+    if isinstance(obj, EncodedJSON):  # (embedded in a bigger value)
+        return json.loads(obj)
+    from fastapi.encoders import jsonable_encoder
+
+    return jsonable_encoder(obj)
+
+
+def _json_encode_chunks(obj) -> List[bytes]:
+    if isinstance(obj, EncodedJSON):
+        return [obj]
+    return [json.dumps(obj, default=to_jsonable).encode('utf-8')]
+
+
+try:
+    import orjson
+
+    _orjson_options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def _json_dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj, default=to_jsonable, option=_orjson_options)
+
+except ImportError:
+
+    def _json_dumps_bytes(obj) -> bytes:
+        return json.dumps(
+            obj, ensure_ascii=False, separators=(',', ':'), default=to_jsonable
+        ).encode('utf-8')
+
+
+def json_dumps_bytes(obj) -> EncodedJSON:
+    """
+    Encode a JSON-compatible object to (compact) JSON bytes, in one pass.
+    `EncodedJSON` objects are returned as they are.
+
+    >>> json_dumps_bytes({'apple': 1, 'list': [1.5, None, 'a']})
+    b'{"apple":1,"list":[1.5,null,"a"]}'
+    """
+    if isinstance(obj, EncodedJSON):
+        return obj
+    return EncodedJSON(_json_dumps_bytes(obj))
+
+
+json_codec = Codec(JSON_MIMETYPE, _json_encode_chunks, json.loads)
+
+
+# -------------------------------------------------------------------------------------
+# NumPy arrays
+
+_ndarray_magic = b'NDAR'
+_header_len_struct = struct.Struct('<I')
+
+
+def _ndarray_encode_chunks(arr) -> list:
+    import numpy as np
+
+    arr = np.ascontiguousarray(arr)  # (no copy if it already is)
+    header = json.dumps({'dtype': arr.dtype.str, 'shape': arr.shape}).encode()
+    prefix = _ndarray_magic + _header_len_struct.pack(len(header)) + header
+    return [prefix, memoryview(arr).cast('B')]
+
+
+def _ndarray_decode(data: bytes):
+    import numpy as np
+
+    data = memoryview(data)
+    if bytes(data[:4]) != _ndarray_magic:
+        raise ValueError("Not an ndarray frame (bad magic bytes)")
+    (header_len,) = _header_len_struct.unpack_from(data, 4)
+    header_end = 4 + _header_len_struct.size + header_len
+    header = json.loads(bytes(data[4 + _header_len_struct.size : header_end]))
+    arr = np.frombuffer(data[header_end:], dtype=np.dtype(header['dtype']))
+    return arr.reshape(header['shape'])
+
+
+def _is_ndarray(obj) -> bool:
+    return type(obj).__name__ == 'ndarray' and hasattr(obj, '__array_interface__')
+
+
+ndarray_codec = Codec(
+    NDARRAY_MIMETYPE, _ndarray_encode_chunks, _ndarray_decode, _is_ndarray
+)
+
+# -------------------------------------------------------------------------------------
+# Registry and negotiation
+
+# The registry: {mimetype: codec}, the first one being the default
+codecs = {JSON_MIMETYPE: json_codec}
+
+try:
+    import numpy  # noqa: F401
+
+    codecs[NDARRAY_MIMETYPE] = ndarray_codec
+except ImportError:
+    pass
+
+
+def register_codec(codec: Codec, *, registry: dict = None):
+    """Add a codec to the registry (the default `codecs`, if not given)"""
+    if registry is None:
+        registry = codecs
+    registry[codec.mimetype] = codec
+    return codec
+
+
+def parse_accept(accept: Optional[str]) -> List[Tuple[str, float]]:
+    """
+    Parse an ``Accept`` header into ``(mimetype, q)`` pairs, most preferred first.
+
+    >>> parse_accept('application/json;q=0.5, application/x-ndarray, */*;q=0.1')
+    [('application/x-ndarray', 1.0), ('application/json', 0.5), ('*/*', 0.1)]
+    >>> parse_accept(None)
+    [('*/*', 1.0)]
+    """
+    if not accept:
+        return [('*/*', 1.0)]
+    parsed = []
+    for i, part in enumerate(accept.split(',')):
+        mimetype, *params = (p.strip() for p in part.split(';'))
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if mimetype and q > 0:
+            parsed.append((mimetype.lower(), q, i))
+    parsed.sort(key=lambda x: (-x[1], x[2]))
+    return [(mimetype, q) for mimetype, q, _ in parsed]
+
+
+def _matches(pattern: str, mimetype: str) -> bool:
+    if pattern in ('*/*', mimetype):
+        return True
+    if pattern.endswith('/*'):
+        return mimetype.startswith(pattern[:-1])
+    return False
+
+
+def negotiate(accept: Optional[str], obj: Any, *, registry: Mapping = None) -> Codec:
+    """
+    Pick the codec to encode `obj` with, given the ``Accept`` header.
+
+    The most preferred acceptable mimetype whose codec can encode obj wins.
+    If there's none, the registry's first (default) codec is used.
+
+    >>> negotiate('application/x-ndarray', {'a': 1}).mimetype
+    'application/json'
+    >>> negotiate('*/*', [1, 2]).mimetype
+    'application/json'
+    """
+    registry = codecs if registry is None else registry
+    for pattern, _ in parse_accept(accept):
+        for mimetype, codec in registry.items():
+            if _matches(pattern, mimetype) and codec.can_encode(obj):
+                return codec
+    return next(iter(registry.values()))
+
+
+def codec_for_content_type(
+    content_type: Optional[str], *, registry: Mapping = None
+) -> Optional[Codec]:
+    """
+    The codec to decode a body of the given ``Content-Type`` with (None if no codec).
+
+    >>> codec_for_content_type('application/json; charset=utf-8').mimetype
+    'application/json'
+    >>> codec_for_content_type('text/csv') is None
+    True
+    """
+    registry = codecs if registry is None else registry
+    if not content_type:
+        return None
+    mimetype = content_type.split(';', 1)[0].strip().lower()
+    return registry.get(mimetype)
@@ -0,0 +1,188 @@
+"""
+Per-route deadlines: a call that takes longer than its deadline gets a 504 response,
+promptly, instead of holding the worker for as long as it takes.
+
+The deadline of a call is the route's (``"deadline"`` in route_specs, or
+``azure_wrap(deadline=...)``, in seconds), or the one the client asks for in the
+`DFLT_DEADLINE_HEADER` header (in milliseconds), whichever is shorter. Routes without
+a deadline ignore the header (clients can't make calls run in the deadline pool).
+
+Async functions are cancelled when their deadline is exceeded.
+Sync functions can't be: they're run in a thread (of a pool of
+`DFLT_MAX_DEADLINE_THREADS`), that's abandoned (left to finish in the background)
+when the deadline is exceeded, so that the worker is freed. Abandoned threads keep
+their place in the pool until they finish: when they're all taken, calls are refused
+(`DeadlinePoolFull`, a 503), rather than queued behind them.
+
+"""
+
+import asyncio
+import inspect
+import threading
+import contextvars
+from functools import partial
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeout,
+)
+from typing import Optional, Mapping, Callable
+
+DFLT_DEADLINE_HEADER = 'x-deadline-ms'
+DFLT_MAX_DEADLINE_THREADS = 64
+
+_executor = None
+_executor_lock = threading.Lock()
+_free_threads = threading.BoundedSemaphore(DFLT_MAX_DEADLINE_THREADS)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call didn't complete before its deadline"""
+
+
+class DeadlinePoolFull(RuntimeError):
+    """Raised when all the threads of the deadline pool are taken"""
+
+
+def _deadline_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    DFLT_MAX_DEADLINE_THREADS, thread_name_prefix='deadline'
+                )
+    return _executor
+
+
+def _submit(func: Callable, kwargs: dict) -> Future:
+    """
+    Run func(**kwargs) in a thread of the deadline pool (in a copy of the current
+    context), or raise `DeadlinePoolFull` if there's no thread left.
+    """
+    free_threads = _free_threads
+    if not free_threads.acquire(blocking=False):
+        raise DeadlinePoolFull(
+            f"All {DFLT_MAX_DEADLINE_THREADS} deadline threads are taken"
+        )
+    context = contextvars.copy_context()
+    try:
+        future = _deadline_executor().submit(context.run, partial(func, **kwargs))
+    except BaseException:
+        free_threads.release()
+        raise
+    future.add_done_callback(lambda _: free_threads.release())
+    return future
+
+
+def _in_running_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def effective_timeout(
+    deadline: Optional[float],
+    headers: Optional[Mapping] = None,
+    *,
+    header: str = DFLT_DEADLINE_HEADER,
+) -> Optional[float]:
+    """
+    The timeout (in seconds) of a call, given the route's deadline and the request's
+    headers (that may ask for a shorter one). None means no timeout.
+
+    >>> effective_timeout(2.0, {'x-deadline-ms': '500'})
+    0.5
+    >>> effective_timeout(2.0, {'x-deadline-ms': '5000'})
+    2.0
+    >>> effective_timeout(2.0, {})
+    2.0
+
+    Routes without a deadline have no timeout, whatever the headers ask for:
+
+    >>> effective_timeout(None, {'x-deadline-ms': '250'}) is None
+    True
+    """
+    if deadline is None:
+        return None
+    requested = headers.get(header) if headers is not None else None
+    if requested is not None:
+        try:
+            requested = max(float(requested) / 1000, 0.0)
+        except ValueError:
+            requested = None
+    if requested is None:
+        return deadline
+    return min(deadline, requested)
+
+
+async def acall_with_deadline(
+    func: Callable, kwargs: dict, timeout: Optional[float], *, run_sync=None
+):
+    """
+    Await func(**kwargs), raising `DeadlineExceeded` if it takes more than timeout
+    seconds. If func is sync, it's run in a thread of the deadline pool (or, if
+    there's no timeout, with `run_sync`, by default, starlette's threadpool).
+    """
+    if inspect.iscoroutinefunction(func):
+        call = func(**kwargs)
+    elif timeout is None:
+        if run_sync is None:
+            from starlette.concurrency import run_in_threadpool as run_sync
+        return await run_sync(func, **kwargs)
+    else:
+        call = asyncio.wrap_future(_submit(func, kwargs))
+    if timeout is None:
+        return await call
+    # (not wait_for, so that a TimeoutError of func isn't taken for ours)
+    task = asyncio.ensure_future(call)
+    try:
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if not done:
+        task.cancel()
+        raise DeadlineExceeded(f"Deadline of {timeout:g}s exceeded")
+    return task.result()
+
+
+def call_with_deadline(func: Callable, kwargs: dict, timeout: Optional[float]):
+    """
+    Call func(**kwargs) from sync code, raising `DeadlineExceeded` if it takes more
+    than timeout seconds. Async functions are run (and cancelled) in an event loop
+    (in a thread of their own, if this one is running a loop already), sync ones, in
+    a thread of the deadline pool.
+
+    >>> import time
+    >>> def slow(secs):
+    ...     time.sleep(secs)
+    ...     return 'done'
+    >>> call_with_deadline(slow, {'secs': 0.01}, timeout=1)
+    'done'
+    >>> call_with_deadline(slow, {'secs': 0.5}, timeout=0.01)
+    Traceback (most recent call last):
+      ...
+    wip_qh.deadlines.DeadlineExceeded: Deadline of 0.01s exceeded
+    """
+    if inspect.iscoroutinefunction(func):
+        run = partial(_run_with_deadline, func, kwargs, timeout)
+        if _in_running_loop():  # (asyncio.run can't be used here)
+            return _submit(run, {}).result()
+        return run()
+    if timeout is None:
+        return func(**kwargs)
+    future = _submit(func, kwargs)
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        if future.done():  # (it's a TimeoutError of func)
+            raise
+        future.cancel()  # (only works if it didn't start yet)
+        raise DeadlineExceeded(f"Deadline of {timeout:g}s exceeded")
+
+
+def _run_with_deadline(func: Callable, kwargs: dict, timeout: Optional[float]):
+    return asyncio.run(acall_with_deadline(func, kwargs, timeout))
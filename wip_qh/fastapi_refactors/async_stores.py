@@ -0,0 +1,137 @@
+"""
+An async store protocol, so that network-backed stores don't block a thread per call.
+
+An async store has ``aget(key)``, ``aset(key, value)`` and ``adelete(key)``
+coroutine methods, and an ``aiter_keys()`` async iterator. Stores with native async
+clients (HTTP, databases...) implement it directly, and sync (``MutableMapping``)
+stores are adapted with `to_async_store`: in-memory ones are called directly, and the
+others in a worker thread.
+
+`AsyncStoreAccess` is the async `StoreAccess`, and the ``a*`` functions of
+`fastapi_refactor_00` (``aget_store_value``...) the async versions of the web
+services' functions, served by ``fastapi_refactor_06``. They get their stores from
+``fastapi_refactor_00.async_store_getter`` (a ``user -> async store`` function, or
+coroutine function), so to serve the stores of an async client:
+
+    fastapi_refactor_00.async_store_getter = lambda user: MyAsyncStore(client, user)
+
+"""
+
+from dataclasses import dataclass
+from typing import (
+    Protocol,
+    runtime_checkable,
+    MutableMapping,
+    AsyncIterator,
+    Any,
+    List,
+)
+
+from starlette.concurrency import run_in_threadpool
+
+
+@runtime_checkable
+class AsyncStore(Protocol):
+    async def aget(self, key) -> Any: ...
+
+    async def aset(self, key, value) -> None: ...
+
+    async def adelete(self, key) -> None: ...
+
+    def aiter_keys(self) -> AsyncIterator: ...
+
+
+def _is_in_memory(store) -> bool:
+    """Whether store is a dict (or a plain `dol.Store` of one), so never blocks"""
+    if isinstance(store, dict):
+        return True
+    from dol import Store
+
+    return type(store) is Store and isinstance(store.store, dict)
+
+
+class AsyncStoreAdapter:
+    """
+    The async store interface of a sync MutableMapping. Its operations are run in a
+    worker thread if `offload` (by default, unless store is in memory).
+
+    >>> import asyncio
+    >>> store = AsyncStoreAdapter({'apple': 1})
+    >>> async def demo():
+    ...     await store.aset('banana', 2)
+    ...     await store.adelete('apple')
+    ...     return [k async for k in store.aiter_keys()], await store.aget('banana')
+    >>> asyncio.run(demo())
+    (['banana'], 2)
+    """
+
+    def __init__(self, store: MutableMapping, *, offload: bool = None):
+        self.store = store
+        self.offload = not _is_in_memory(store) if offload is None else offload
+
+    async def _run(self, func, *args):
+        if self.offload:
+            return await run_in_threadpool(func, *args)
+        return func(*args)
+
+    async def aget(self, key):
+        return await self._run(self.store.__getitem__, key)
+
+    async def aset(self, key, value):
+        await self._run(self.store.__setitem__, key, value)
+
+    async def adelete(self, key):
+        await self._run(self.store.__delitem__, key)
+
+    async def aiter_keys(self):
+        for key in await self._run(list, self.store):
+            yield key
+
+    async def aselect(self, key, paths):
+        """The selected parts of the value of key (see `wip_qh.projection`)"""
+        from wip_qh.projection import select_from_store
+
+        return await self._run(select_from_store, self.store, key, paths)
+
+
+def to_async_store(store) -> AsyncStore:
+    """The store itself if it's an async store, or its `AsyncStoreAdapter`"""
+    if isinstance(store, AsyncStore):
+        return store
+    return AsyncStoreAdapter(store)
+
+
+@dataclass
+class AsyncStoreAccess:
+    """
+    The async `StoreAccess`: list, read, write, and delete coroutines.
+
+    >>> import asyncio
+    >>> s = AsyncStoreAccess.from_uri('test_uri')
+    >>> asyncio.run(s.list())
+    ['alice', 'bob']
+    """
+
+    store: AsyncStore
+
+    def __post_init__(self):
+        self.store = to_async_store(self.store)
+
+    @classmethod
+    def from_uri(cls, uri: str = None):
+        """The AsyncStoreAccess of (the store of) a `StoreAccess.from_uri` uri"""
+        from wip_qh.fastapi_refactors.fastapi_refactor_00 import StoreAccess, DFLT_URI
+
+        return cls(StoreAccess.from_uri(uri or DFLT_URI).store)
+
+    async def list(self) -> List:
+        return [key async for key in self.store.aiter_keys()]
+
+    async def read(self, key):
+        return await self.store.aget(key)
+
+    async def write(self, key, value):
+        await self.store.aset(key, value)
+
+    async def delete(self, key):
+        await self.store.adelete(key)
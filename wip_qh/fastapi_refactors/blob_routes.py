@@ -0,0 +1,315 @@
+"""
+A blob mode for the store routes: streaming uploads and http Range reads.
+
+`set_store_value` takes its value as a JSON body, that is fully buffered and parsed
+before the store even sees it, and `get_store_value` returns the whole value.
+For big values, that means big memory spikes. The routes made by `add_blob_routes`
+instead:
+
+- stream the request body into the store, chunk by chunk (`store_set`), and
+- serve `Range` requests with partial content (`store_get`), reading only the
+  requested bytes, chunk by chunk.
+
+For this to happen without holding the value in memory, the (user) store should
+have a file-like interface: an ``open(key, mode)`` method (and, optionally, a
+``size(key)`` method). `FilesBlobStore` is such a store. Other MutableMappings
+still work, but the value is then held in memory, as bytes (values that aren't
+bytes, or strings, are read as their JSON encoding).
+
+``fast_api_app(..., blob_prefix='/blob')`` adds these routes to an app.
+
+"""
+
+import os
+import io
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, MutableMapping, Optional, Tuple, Iterator
+
+from fastapi import Request, Query, Response, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from wip_qh.content_codecs import json_dumps_bytes
+from wip_qh.fastapi_refactors import fastapi_refactor_00
+
+DFLT_CHUNK_SIZE = 64 * 1024
+DFLT_BLOB_PREFIX = '/blob'
+
+
+class InvalidBlobKey(KeyError):
+    """Raised for keys that can't be the name of a blob (file)"""
+
+
+class FilesBlobStore(MutableMapping):
+    """
+    A store of bytes values, kept as files in `rootdir`, with a file-like interface.
+
+    Writes (through `open(key, 'wb')` or ``__setitem__``) go to a temporary file that
+    replaces the key's file when closed, so readers never see partially written values.
+
+    >>> import tempfile
+    >>> s = FilesBlobStore(tempfile.mkdtemp())
+    >>> with s.open('greeting', 'wb') as f:
+    ...     _ = f.write(b'hello ')
+    ...     _ = f.write(b'world')
+    >>> s['greeting'], s.size('greeting'), list(s)
+    (b'hello world', 11, ['greeting'])
+    >>> del s['greeting']
+    >>> len(s)
+    0
+    """
+
+    def __init__(self, rootdir: str):
+        self.rootdir = rootdir
+        os.makedirs(rootdir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        if not key or '/' in key or key.startswith('.'):
+            raise InvalidBlobKey(f"Invalid key: {key}")
+        return os.path.join(self.rootdir, key)
+
+    def open(self, key: str, mode: str = 'rb'):
+        if mode == 'rb':
+            return open(self._path(key), 'rb')
+        elif mode == 'wb':
+            return _atomic_writer(self._path(key))
+        raise ValueError(f"mode should be 'rb' or 'wb', not {mode}")
+
+    def size(self, key: str) -> int:
+        try:
+            return os.path.getsize(self._path(key))
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __getitem__(self, key):
+        try:
+            with self.open(key, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value: bytes):
+        with self.open(key, 'wb') as f:
+            f.write(value)
+
+    def __delitem__(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for name in sorted(os.listdir(self.rootdir)):
+            if not name.startswith('.'):
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+@contextmanager
+def _atomic_writer(path: str):
+    dirname, basename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=f".{basename}.")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+# -------------------------------------------------------------------------------------
+# File-like access to any store
+
+
+@contextmanager
+def _buffered_writer(store: MutableMapping, key):
+    buffer = io.BytesIO()
+    yield buffer
+    store[key] = buffer.getvalue()
+
+
+def open_for_write(store: MutableMapping, key):
+    """A (context manager) writer of the value of key, in store"""
+    if hasattr(store, 'open'):
+        return store.open(key, 'wb')
+    return _buffered_writer(store, key)
+
+
+def _as_bytes(value) -> bytes:
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    return json_dumps_bytes(value)
+
+
+def open_for_read(store: MutableMapping, key):
+    """A readable, seekable, file-like view of the value of key, in store"""
+    if hasattr(store, 'open'):
+        try:
+            return store.open(key, 'rb')
+        except FileNotFoundError:
+            raise KeyError(key)
+    return io.BytesIO(_as_bytes(store[key]))
+
+
+def blob_size(store: MutableMapping, key) -> int:
+    if hasattr(store, 'size'):
+        return store.size(key)
+    with open_for_read(store, key) as f:
+        return f.seek(0, io.SEEK_END)
+
+
+# -------------------------------------------------------------------------------------
+# Ranges
+
+
+class RangeNotSatisfiable(ValueError):
+    """Raised when a Range header can't be satisfied for the blob's size"""
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a ``Range`` header into an ``(start, stop)`` byte range (`stop` exclusive),
+    or None if there's no (usable) range. Only the first range of a multi-range
+    header is used.
+
+    >>> parse_range('bytes=0-99', 1000)
+    (0, 100)
+    >>> parse_range('bytes=900-', 1000)
+    (900, 1000)
+    >>> parse_range('bytes=-100', 1000)
+    (900, 1000)
+    >>> parse_range('bytes=990-2000', 1000)
+    (990, 1000)
+    >>> parse_range(None, 1000) is None
+    True
+    >>> parse_range('bytes=1000-', 1000)
+    Traceback (most recent call last):
+      ...
+    wip_qh.fastapi_refactors.blob_routes.RangeNotSatisfiable: bytes=1000- (size 1000)
+    """
+    if not range_header:
+        return None
+    unit, _, ranges = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or not ranges:
+        return None
+    first = ranges.split(',')[0].strip()
+    start_str, sep, end_str = first.partition('-')
+    try:
+        if not sep:
+            return None
+        if not start_str:  # suffix range: the last N bytes
+            start, stop = max(size - int(end_str), 0), size
+        else:
+            start = int(start_str)
+            stop = min(int(end_str) + 1, size) if end_str else size
+    except ValueError:
+        return None
+    if start >= size or start >= stop:
+        raise RangeNotSatisfiable(f"{range_header} (size {size})")
+    return start, stop
+
+
+def iter_file_range(f, start: int, stop: int, chunk_size=DFLT_CHUNK_SIZE) -> Iterator:
+    """Yield the bytes of file f, from start to stop, in chunks (and close f)"""
+    try:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+# -------------------------------------------------------------------------------------
+# Routes
+
+
+def _dflt_store_getter(user: str):
+    # Look it up at call time, so that reassigning the module's store_getter works
+    return fastapi_refactor_00.store_getter(user)
+
+
+def add_blob_routes(
+    app,
+    *,
+    store_getter: Callable[[str], MutableMapping] = _dflt_store_getter,
+    prefix: str = DFLT_BLOB_PREFIX,
+    chunk_size: int = DFLT_CHUNK_SIZE,
+):
+    """
+    Add the blob versions of `store_set` and `store_get` to app, under prefix:
+
+    - ``POST {prefix}/store_set/{user}?key=...``: the (raw) request body is streamed
+      into the store, chunk by chunk.
+    - ``GET {prefix}/store_get/{user}?key=...``: serves the value (as
+      ``application/octet-stream``), honoring ``Range`` headers with 206 responses.
+    """
+
+    async def store_set(request: Request, user: str, key: str = Query()):
+        # (the store and file operations, that may block, are run in threads)
+        try:
+            store = await run_in_threadpool(store_getter, user)
+            writer = await run_in_threadpool(open_for_write, store, key)
+            f = await run_in_threadpool(writer.__enter__)
+        except InvalidBlobKey as e:
+            raise HTTPException(400, detail=str(e.args[0]))
+        except KeyError:
+            raise HTTPException(404, detail=f"No such user: {user}")
+        size = 0
+        try:
+            async for chunk in request.stream():
+                if chunk:
+                    await run_in_threadpool(f.write, chunk)
+                    size += len(chunk)
+        except BaseException as e:
+            await run_in_threadpool(writer.__exit__, type(e), e, e.__traceback__)
+            raise
+        await run_in_threadpool(writer.__exit__, None, None, None)
+        return {"message": "Value set successfully", "size": size}
+
+    def store_get(request: Request, user: str, key: str = Query()):
+        try:
+            store = store_getter(user)
+        except KeyError:
+            raise HTTPException(404, detail=f"No such user: {user}")
+        try:
+            size = blob_size(store, key)
+        except InvalidBlobKey as e:
+            raise HTTPException(400, detail=str(e.args[0]))
+        except KeyError:
+            raise HTTPException(404, detail=f"No such key: {key}")
+        headers = {'accept-ranges': 'bytes'}
+        try:
+            byte_range = parse_range(request.headers.get('range'), size)
+        except RangeNotSatisfiable:
+            headers['content-range'] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is None:
+            start, stop, status_code = 0, size, 200
+        else:
+            (start, stop), status_code = byte_range, 206
+            headers['content-range'] = f"bytes {start}-{stop - 1}/{size}"
+        headers['content-length'] = str(stop - start)
+        chunks = iter_file_range(open_for_read(store, key), start, stop, chunk_size)
+        return StreamingResponse(
+            chunks,
+            status_code=status_code,
+            headers=headers,
+            media_type='application/octet-stream',
+        )
+
+    app.add_api_route(
+        f"{prefix}/store_set/{{user}}", store_set, methods=['POST', 'PUT']
+    )
+    app.add_api_route(f"{prefix}/store_get/{{user}}", store_get, methods=['GET'])
+    return app
@@ -0,0 +1,254 @@
+"""
+A change feed of the writes made to a mall, served as Server-Sent Events (SSE).
+
+`ChangeFeed` is an `ObservedMall` observer that numbers each write with a
+monotonically increasing sequence number, keeps the most recent ones in a bounded
+buffer, and pushes them to the subscribers whose (user, key prefix) filter they
+match.
+
+The route added by `add_change_feed_route` streams them as SSE:
+
+    id: 42
+    event: set
+    data: {"seq": 42, "user": "alice", "key": "fruit", "value": {...}}
+
+A client that reconnects with a ``Last-Event-ID`` header (which browsers'
+``EventSource`` send automatically) gets the events it missed, replayed from the
+buffer, before the live ones. If they're not in the buffer anymore (or if the client
+is too slow to keep up), it gets a ``gap`` event, telling it to reload its data.
+
+To feed it the web services' writes:
+
+    mall = ObservedMall(fastapi_refactor_00.backend_mall)
+    fastapi_refactor_00.store_getter = mall.__getitem__
+    feed = mall.add_observer(ChangeFeed())
+    app = fast_api_app(route_specs, change_feed=feed)
+
+"""
+
+import json
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, List, Any
+
+from wip_qh.fastapi_refactors.observed_mall import DELETED
+
+DFLT_BUFFER_SIZE = 10_000
+DFLT_SUBSCRIBER_QUEUE_SIZE = 1_000
+DFLT_KEEPALIVE_SECONDS = 15.0
+DFLT_CHANGE_FEED_PATH = '/changes/{user}'
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    seq: int
+    user: str
+    key: Any
+    value: Any = DELETED
+
+    @property
+    def kind(self) -> str:
+        return 'delete' if self.value is DELETED else 'set'
+
+    def matches(self, user: Optional[str], prefix: str = '') -> bool:
+        return (user is None or self.user == user) and str(self.key).startswith(prefix)
+
+    def to_sse(self, *, include_value: bool = True) -> str:
+        """
+        >>> print(ChangeEvent(3, 'alice', 'fruit', {'apple': 1}).to_sse(), end='')
+        id: 3
+        event: set
+        data: {"seq": 3, "user": "alice", "key": "fruit", "value": {"apple": 1}}
+        <BLANKLINE>
+        """
+        data = {'seq': self.seq, 'user': self.user, 'key': self.key}
+        if include_value and self.value is not DELETED:
+            data['value'] = self.value
+        data = json.dumps(data, default=repr)
+        return f"id: {self.seq}\nevent: {self.kind}\ndata: {data}\n\n"
+
+
+def gap_sse(last_seq: int) -> str:
+    data = json.dumps({'last_seq': last_seq})
+    return f"event: gap\ndata: {data}\n\n"
+
+
+class _Subscriber:
+    def __init__(self, user, prefix, loop, maxsize):
+        self.user, self.prefix = user, prefix
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True  # (the reader sends a gap event once drained)
+
+    def push(self, event: ChangeEvent) -> bool:
+        """Push event (if it matches). Returns False if the subscriber is gone."""
+        if event.matches(self.user, self.prefix):
+            try:
+                self.loop.call_soon_threadsafe(self._put, event)
+            except RuntimeError:  # (its loop was closed, without unsubscribing)
+                return False
+        return True
+
+
+class ChangeFeed:
+    """
+    Sequence-numbered write events, to replay and subscribe to.
+
+    >>> feed = ChangeFeed()
+    >>> feed('alice', 'fruit', 1)
+    >>> feed('bob', 'cars', 2)
+    >>> feed('alice', 'planets', DELETED)
+    >>> [(e.seq, e.user, e.key, e.kind) for e in feed.events_since(1, user='alice')]
+    [(3, 'alice', 'planets', 'delete')]
+    >>> feed.last_seq
+    3
+    """
+
+    def __init__(
+        self,
+        *,
+        buffer_size: int = DFLT_BUFFER_SIZE,
+        subscriber_queue_size: int = DFLT_SUBSCRIBER_QUEUE_SIZE,
+    ):
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.subscriber_queue_size = subscriber_queue_size
+        self.last_seq = 0
+
+    def __call__(self, user, key, value):
+        """Record a write (an `ObservedMall` observer)"""
+        with self._lock:
+            self.last_seq += 1
+            event = ChangeEvent(self.last_seq, user, key, value)
+            self._buffer.append(event)
+            subscribers = list(self._subscribers)
+        gone = [subscriber for subscriber in subscribers if not subscriber.push(event)]
+        if gone:
+            with self._lock:
+                self._subscribers.difference_update(gone)
+
+    def oldest_seq(self) -> int:
+        """The sequence number of the oldest event still in the buffer"""
+        with self._lock:
+            return self._buffer[0].seq if self._buffer else self.last_seq + 1
+
+    def events_since(
+        self, seq: int, *, user: Optional[str] = None, prefix: str = ''
+    ) -> List[ChangeEvent]:
+        with self._lock:
+            events = list(self._buffer)
+        return [e for e in events if e.seq > seq and e.matches(user, prefix)]
+
+    def subscribe(self, user: Optional[str] = None, prefix: str = '') -> _Subscriber:
+        """Subscribe (from a coroutine: events are delivered to its event loop)"""
+        subscriber = _Subscriber(
+            user, prefix, asyncio.get_running_loop(), self.subscriber_queue_size
+        )
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    async def sse_stream(
+        self,
+        user: Optional[str] = None,
+        *,
+        prefix: str = '',
+        last_event_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        keepalive: float = DFLT_KEEPALIVE_SECONDS,
+        include_values: bool = True,
+    ):
+        """
+        Yield the SSE messages of the events (of user, whose keys start with prefix)
+        following `last_event_id` (or, if not given, of the events to come).
+        The stream ends after `limit` events, if given.
+        """
+        subscriber = self.subscribe(user, prefix)
+        try:
+            last = self.last_seq if last_event_id is None else last_event_id
+            n = 0
+            if last_event_id is not None and not (
+                self.oldest_seq() <= last + 1 <= self.last_seq + 1
+            ):  # (events were dropped from the buffer, or the id isn't from us)
+                yield gap_sse(self.last_seq)
+                return
+            for event in self.events_since(last, user=user, prefix=prefix):
+                yield event.to_sse(include_value=include_values)
+                last = event.seq
+                n += 1
+                if limit is not None and n >= limit:
+                    return
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event.seq <= last:  # (already replayed)
+                    continue
+                yield event.to_sse(include_value=include_values)
+                last = event.seq
+                n += 1
+                if limit is not None and n >= limit:
+                    return
+                if subscriber.overflowed and subscriber.queue.empty():
+                    yield gap_sse(last)
+                    return
+        finally:
+            self.unsubscribe(subscriber)
+
+
+def add_change_feed_route(
+    app,
+    feed: ChangeFeed,
+    *,
+    path: str = DFLT_CHANGE_FEED_PATH,
+    keepalive: float = DFLT_KEEPALIVE_SECONDS,
+):
+    """
+    Add an SSE route streaming the changes of a user's store (``{user}`` of path),
+    optionally restricted to the keys starting with a ``prefix`` (query parameter).
+    Clients resume with a ``Last-Event-ID`` header (or ``last_event_id`` query param).
+    """
+    from fastapi import Header, Query
+    from fastapi.responses import StreamingResponse
+
+    def changes(
+        user: str,
+        prefix: str = Query(''),
+        last_event_id: Optional[int] = Query(None),
+        limit: Optional[int] = Query(None),
+        values: bool = Query(True),
+        last_event_id_header: Optional[int] = Header(None, alias='Last-Event-ID'),
+    ):
+        if last_event_id is None:
+            last_event_id = last_event_id_header
+        stream = feed.sse_stream(
+            user,
+            prefix=prefix,
+            last_event_id=last_event_id,
+            limit=limit,
+            keepalive=keepalive,
+            include_values=values,
+        )
+        return StreamingResponse(
+            stream,
+            media_type='text/event-stream',
+            headers={'cache-control': 'no-cache', 'x-accel-buffering': 'no'},
+        )
+
+    app.add_api_route(path, changes, methods=['GET'], name='changes')
+    return app
@@ -0,0 +1,320 @@
+"""
+A durable, in-memory mall: reads and writes are those of dicts, but every write is
+also appended to a journal file, and the whole mall is periodically written to a
+(compacted) snapshot file, so that it can be restored on boot.
+
+The files of a `DurableMall`, in its `rootdir`, are:
+
+- ``snapshot.<gen>.json``: the mall, as it was when journal ``<gen>`` was started
+- ``journal.<gen>.jsonl``: the writes made since, one JSON line each:
+  ``{"u": user, "k": key, "v": value}``, or ``{"u": user, "k": key, "d": 1}`` for
+  deletions, and ``{"u": user, "s": {...}}``/``{"u": user, "d": 1}`` for whole users.
+
+Restoring loads the last snapshot and replays the journals that follow it (a last,
+partially written, line, as a crash can leave, is ignored).
+
+`fsync` says when to force the journal to disk:
+
+- ``'always'``: on every write (no write is ever lost, at the price of a disk sync;
+  new files are also made durable, by syncing their directory)
+- ``'interval'``: every `fsync_interval` seconds, if there were writes (a machine
+  crash can lose the writes of the last interval)
+- ``'never'``: leave it to the OS (writes survive process crashes, not machine ones)
+
+In all cases, writes are journaled before they're applied in memory (a write that
+can't be journaled, e.g. a value that isn't JSON, fails without changing the mall),
+and handed to the OS before the write returns.
+
+To use it as the web services' mall:
+
+    mall = DurableMall('/var/lib/wip_qh/mall', fsync='interval')
+    fastapi_refactor_00.store_getter = mall.__getitem__
+
+"""
+
+import os
+import json
+import glob
+import time
+import tempfile
+import threading
+from typing import MutableMapping, Literal, Optional, Iterator
+
+FsyncPolicy = Literal['always', 'interval', 'never']
+
+DFLT_FSYNC: FsyncPolicy = 'interval'
+DFLT_FSYNC_INTERVAL = 1.0
+DFLT_SNAPSHOT_EVERY = 10_000  # writes
+
+
+def _gen_of(path: str) -> int:
+    return int(os.path.basename(path).split('.')[1])
+
+
+def _files(rootdir: str, kind: str, ext: str):
+    """The (gen, path) pairs of the files of a kind, sorted by gen"""
+    paths = glob.glob(os.path.join(rootdir, f"{kind}.*.{ext}"))
+    return sorted((_gen_of(p), p) for p in paths)
+
+
+def _fsync_dir(path: str):
+    """Make the creations, renames and removals of files in a directory durable"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # (e.g. on Windows, where directories can't be opened)
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _journal_entries(path: str) -> Iterator[dict]:
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:  # (a partially written last line)
+                return
+
+
+def _apply(mall: dict, entry: dict):
+    user = entry['u']
+    if 'k' not in entry:  # a whole user
+        if 'd' in entry:
+            mall.pop(user, None)
+        else:
+            mall[user] = entry['s']
+    elif 'd' in entry:
+        mall.get(user, {}).pop(entry['k'], None)
+    else:
+        mall.setdefault(user, {})[entry['k']] = entry['v']
+
+
+def load_mall(rootdir: str) -> dict:
+    """Restore a mall from the last snapshot and the journals that follow it"""
+    snapshots = _files(rootdir, 'snapshot', 'json')
+    mall, snapshot_gen = {}, -1
+    if snapshots:
+        snapshot_gen, path = snapshots[-1]
+        with open(path) as f:
+            mall = json.load(f)
+    for gen, path in _files(rootdir, 'journal', 'jsonl'):
+        if gen >= snapshot_gen:
+            for entry in _journal_entries(path):
+                _apply(mall, entry)
+    return mall
+
+
+class _DurableStore(MutableMapping):
+    """The store of a user of a `DurableMall`"""
+
+    def __init__(self, mall: 'DurableMall', user):
+        self._mall = mall
+        self.user = user
+        self.store = mall._data[user]
+
+    def __getitem__(self, key):
+        return self.store[key]
+
+    def __setitem__(self, key, value):
+        line = _journal_line({'u': self.user, 'k': key, 'v': value})
+        with self._mall._lock:
+            self._mall._journal(line)
+            self.store[key] = value
+
+    def __delitem__(self, key):
+        line = _journal_line({'u': self.user, 'k': key, 'd': 1})
+        with self._mall._lock:
+            if key not in self.store:
+                raise KeyError(key)
+            self._mall._journal(line)
+            del self.store[key]
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, key):
+        return key in self.store
+
+
+def _journal_line(entry: dict) -> bytes:
+    return json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class DurableMall(MutableMapping):
+    """
+    A ``{user: {key: value}}`` mall kept in memory, journaled and snapshotted to
+    rootdir (restored from there, if it has files).
+
+    >>> import tempfile
+    >>> rootdir = tempfile.mkdtemp()
+    >>> mall = DurableMall(rootdir, initial={'alice': {'fruit': 1}})
+    >>> mall['alice']['planets'] = 2
+    >>> mall['bob'] = {'cars': 3}
+    >>> del mall['alice']['fruit']
+    >>> mall.close()
+    >>> restored = DurableMall(rootdir)
+    >>> restored.to_dict()
+    {'alice': {'planets': 2}, 'bob': {'cars': 3}}
+    >>> _ = restored.snapshot()  # compacts: the old journals are removed
+    >>> sorted(os.listdir(rootdir))
+    ['journal.2.jsonl', 'snapshot.2.json']
+    >>> restored.close()
+    """
+
+    def __init__(
+        self,
+        rootdir: str,
+        *,
+        fsync: FsyncPolicy = DFLT_FSYNC,
+        fsync_interval: float = DFLT_FSYNC_INTERVAL,
+        snapshot_every: Optional[int] = DFLT_SNAPSHOT_EVERY,
+        initial: Optional[dict] = None,
+    ):
+        if fsync not in ('always', 'interval', 'never'):
+            raise ValueError(
+                f"fsync should be 'always', 'interval' or 'never': {fsync}"
+            )
+        self.rootdir = rootdir
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        os.makedirs(rootdir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._snapshot_lock = threading.Lock()
+        self._data = load_mall(rootdir)
+        journals = _files(rootdir, 'journal', 'jsonl')
+        snapshots = _files(rootdir, 'snapshot', 'json')
+        last_gen = max([g for g, _ in journals + snapshots], default=-1)
+        self._gen = last_gen
+        self._journal_file = None
+        self._writes_since_snapshot = 0
+        self._dirty = False
+        self._open_next_journal()
+        if fsync == 'interval':
+            threading.Thread(target=self._fsync_loop, daemon=True).start()
+        if initial is not None and not self._data:
+            for user, store in initial.items():
+                self[user] = dict(store)
+
+    # ---------------------------------------------------------------------------------
+    # Journal
+
+    def _open_next_journal(self):
+        if self._journal_file is not None:
+            self._sync_journal()
+            self._journal_file.close()
+        self._gen += 1
+        path = os.path.join(self.rootdir, f"journal.{self._gen}.jsonl")
+        self._journal_file = open(path, 'ab')
+        if self.fsync == 'always':
+            _fsync_dir(self.rootdir)  # (so that the journal itself survives a crash)
+
+    def _sync_journal(self):
+        self._journal_file.flush()
+        if self.fsync != 'never':
+            os.fsync(self._journal_file.fileno())
+        self._dirty = False
+
+    def _fsync_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            with self._lock:
+                if self._journal_file is None:
+                    return
+                if self._dirty:
+                    self._sync_journal()
+
+    def _journal(self, line: bytes):
+        """Append a (`_journal_line`) line to the journal (the caller holds the lock)"""
+        self._journal_file.write(line)
+        if self.fsync == 'always':
+            self._sync_journal()
+        else:
+            self._journal_file.flush()
+            self._dirty = True
+        self._writes_since_snapshot += 1
+        if (
+            self.snapshot_every is not None
+            and self._writes_since_snapshot >= self.snapshot_every
+        ):
+            self._writes_since_snapshot = 0
+            threading.Thread(target=self.snapshot, daemon=True).start()
+
+    # ---------------------------------------------------------------------------------
+    # Snapshots
+
+    def snapshot(self) -> Optional[str]:
+        """
+        Write a snapshot of the mall, start a new journal, and remove the files the
+        snapshot makes obsolete. Returns the snapshot's path (None if a snapshot
+        was already being taken).
+        """
+        if not self._snapshot_lock.acquire(blocking=False):
+            return None
+        try:
+            with self._lock:  # (a consistent copy, and the journal it's the start of)
+                self._open_next_journal()
+                gen = self._gen
+                data = {user: dict(store) for user, store in self._data.items()}
+            path = os.path.join(self.rootdir, f"snapshot.{gen}.json")
+            fd, tmp_path = tempfile.mkstemp(dir=self.rootdir, prefix='.snapshot.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            # (the snapshot must be durable before the files it replaces are removed)
+            _fsync_dir(self.rootdir)
+            for kind, ext in [('snapshot', 'json'), ('journal', 'jsonl')]:
+                for old_gen, old_path in _files(self.rootdir, kind, ext):
+                    if old_gen < gen:
+                        os.remove(old_path)
+            return path
+        finally:
+            self._snapshot_lock.release()
+
+    def close(self):
+        with self._lock:
+            if self._journal_file is not None:
+                self._sync_journal()
+                self._journal_file.close()
+                self._journal_file = None
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {user: dict(store) for user, store in self._data.items()}
+
+    # ---------------------------------------------------------------------------------
+    # Mapping interface
+
+    def __getitem__(self, user) -> _DurableStore:
+        return _DurableStore(self, user)
+
+    def __setitem__(self, user, store: MutableMapping):
+        store = dict(store)
+        line = _journal_line({'u': user, 's': store})
+        with self._lock:
+            self._journal(line)
+            self._data[user] = store
+
+    def __delitem__(self, user):
+        line = _journal_line({'u': user, 'd': 1})
+        with self._lock:
+            if user not in self._data:
+                raise KeyError(user)
+            self._journal(line)
+            del self._data[user]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, user):
+        return user in self._data
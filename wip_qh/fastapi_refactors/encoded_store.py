@@ -0,0 +1,110 @@
+"""
+Stores that keep their values JSON-encoded, so that serving them costs no encoding.
+
+Values are encoded (once) when written, and read as `EncodedJSON` bytes, which the
+routes whose output is declared JSON (``"output": "json"`` in route specs, as
+``get_store_value``'s, in ``fastapi_refactor_03``) send as they are.
+Values that were written otherwise (not encoded) are encoded when read (reads never
+write to the store). Bytes values are taken for JSON, as they are, without being
+parsed: those written through the store are. For stores that also hold other bytes,
+say so (``bytes_are_json=False``): their bytes values are then encoded when read.
+
+To have the web services serve encoded values:
+
+    mall = JSONEncodedMall(fastapi_refactor_00.backend_mall)
+    fastapi_refactor_00.store_getter = mall.__getitem__
+
+"""
+
+import json
+from typing import MutableMapping
+
+from wip_qh.content_codecs import EncodedJSON, json_dumps_bytes
+from wip_qh.projection import project
+
+
+class JSONEncodedStore(MutableMapping):
+    """
+    A store whose values are kept, in `store`, as JSON bytes.
+
+    `bytes_are_json` says whether the bytes values of `store` are JSON (as the ones
+    written through this store are, even if the store gives them back as plain bytes).
+    If not, bytes values are encoded when read, as any other value (and only the
+    `EncodedJSON` values that the store keeps as such are taken for JSON).
+
+    >>> backend = {'fruit': {'apple': 1}}
+    >>> s = JSONEncodedStore(backend)
+    >>> s['planets'] = {'earth': 30}
+    >>> backend['planets']
+    b'{"earth":30}'
+    >>> s['fruit']  # (encoded when read)
+    b'{"apple":1}'
+    >>> backend['fruit']  # (but not written back)
+    {'apple': 1}
+    >>> s.decoded('fruit')
+    {'apple': 1}
+
+    >>> JSONEncodedStore({'json': b'[1, 2]'})['json']
+    b'[1, 2]'
+    >>> JSONEncodedStore({'raw': b'not json'}, bytes_are_json=False)['raw']
+    b'"not json"'
+    """
+
+    def __init__(self, store: MutableMapping, *, bytes_are_json: bool = True):
+        self.store = store
+        self.bytes_are_json = bytes_are_json
+
+    def __getitem__(self, key) -> EncodedJSON:
+        value = self.store[key]
+        if isinstance(value, EncodedJSON):
+            return value
+        if self.bytes_are_json and isinstance(value, (bytes, bytearray)):
+            return EncodedJSON(value)
+        return json_dumps_bytes(value)
+
+    def decoded(self, key):
+        """The (decoded) value of key"""
+        return json.loads(self[key])
+
+    def select(self, key, paths):
+        """The selected parts of the (decoded) value of key (see `wip_qh.projection`)"""
+        return project(self.decoded(key), paths)
+
+    def __setitem__(self, key, value):
+        self.store[key] = json_dumps_bytes(value)
+
+    def __delitem__(self, key):
+        del self.store[key]
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, key):
+        return key in self.store
+
+
+class JSONEncodedMall:
+    """
+    A ``{user: JSONEncodedStore}`` view of a ``{user: store}`` mall (see
+    `JSONEncodedStore` for `bytes_are_json`).
+
+    >>> mall = JSONEncodedMall({'alice': {'fruit': {'apple': 1}}})
+    >>> mall['alice']['fruit']
+    b'{"apple":1}'
+    """
+
+    def __init__(self, mall: MutableMapping, *, bytes_are_json: bool = True):
+        self.mall = mall
+        self.bytes_are_json = bytes_are_json
+
+    def __getitem__(self, user) -> JSONEncodedStore:
+        return JSONEncodedStore(self.mall[user], bytes_are_json=self.bytes_are_json)
+
+    def __iter__(self):
+        return iter(self.mall)
+
+    def __contains__(self, user):
+        return user in self.mall
@@ -1,5 +1,6 @@
 """A simple fastAPI app, to be refactored"""
 
+import inspect
 from typing import Callable, MutableMapping, Any
 from dataclasses import dataclass
 
@@ -102,9 +103,17 @@ def get_store_list(user: str):
     return list(store)
 
 
-def get_store_value(user: str, key: str):
+def get_store_value(user: str, key: str, select: str = None):
+    """
+    Get the value of key in the user's store, or, if `select` is given (e.g.
+    ``'earth,venus.moons'``; see `wip_qh.projection`), only the selected parts of it.
+    """
     store = store_getter(user)
-    return store[key]
+    if select is None:
+        return store[key]
+    from wip_qh.projection import select_from_store
+
+    return select_from_store(store, key, select)
 
 
 def set_store_value(user: str, key: str, value: Any):
@@ -114,6 +123,59 @@ def set_store_value(user: str, key: str, value: Any):
     return {"message": "Value set successfully"}
 
 
+# -------------------------------------------------------------------------------------
+# The async versions of the above (see `async_stores`)
+
+
+async def default_async_store_getter(user: str):
+    """
+    The async store (see `async_stores`) of the user's `store_getter` store.
+    Unless that's a lookup in the in-memory `backend_mall`, `store_getter` is called
+    in a worker thread, as getting a store may block (on IO, or on a lock).
+    """
+    from starlette.concurrency import run_in_threadpool
+    from wip_qh.fastapi_refactors.async_stores import to_async_store, _is_in_memory
+
+    if store_getter is get_user_data and _is_in_memory(backend_mall):
+        return to_async_store(store_getter(user))
+    return to_async_store(await run_in_threadpool(store_getter, user))
+
+
+async_store_getter = default_async_store_getter
+
+
+async def _async_store(user: str):
+    """The store of `async_store_getter`, which can be a sync or an async function"""
+    store = async_store_getter(user)
+    if inspect.isawaitable(store):
+        store = await store
+    return store
+
+
+async def aget_store_list(user: str):
+    store = await _async_store(user)
+    return [key async for key in store.aiter_keys()]
+
+
+async def aget_store_value(user: str, key: str, select: str = None):
+    """The async `get_store_value`"""
+    store = await _async_store(user)
+    if select is None:
+        return await store.aget(key)
+    from wip_qh.projection import parse_selection, project
+
+    aselect = getattr(store, 'aselect', None)
+    if aselect is not None:
+        return await aselect(key, parse_selection(select))
+    return project(await store.aget(key), select)
+
+
+async def aset_store_value(user: str, key: str, value: Any):
+    store = await _async_store(user)
+    await store.aset(key, value)
+    return {"message": "Value set successfully"}
+
+
 # -------------------------------------------------------------------------------------
 # Ignore for now
 
@@ -125,6 +187,16 @@ def test_uri_to_store(uri: str = DFLT_URI):
     return backend_mall
 
 
+# uri -> function making the MutableMapping for that uri (see StoreAccess.from_uri)
+uri_to_store_factory = {DFLT_URI: test_uri_to_store}
+
+
+def register_store_uri(uri: URI_TYPE, store_factory: StoreFactory):
+    """Register a store factory, so that `StoreAccess.from_uri(uri)` can use it"""
+    uri_to_store_factory[uri] = store_factory
+    return store_factory
+
+
 @dataclass
 class StoreAccess:
     """
@@ -145,11 +217,23 @@ class StoreAccess:
     @classmethod
     def from_uri(cls, uri: URI_TYPE = DFLT_URI):
         """code that makes a MutableMapping interface for the data pointed to by uri"""
-        if uri == DFLT_URI:
-            store = backend_mall
+        if uri in uri_to_store_factory:
+            store = uri_to_store_factory[uri](uri)
             return cls(store)
         else:
-            raise ValueError(f"Only one possible uri for now: {DFLT_URI}")
+            raise ValueError(
+                f"Unknown uri: {uri}. Register it with register_store_uri. "
+                f"Known uris: {list(uri_to_store_factory)}"
+            )
+
+    def with_write_behind(self, **write_behind_kwargs):
+        """
+        A StoreAccess whose writes update an in-memory layer and return immediately,
+        to be flushed to this store in the background (see `write_behind`).
+        """
+        from wip_qh.fastapi_refactors.write_behind import WriteBehindStore
+
+        return type(self)(WriteBehindStore(self.store, **write_behind_kwargs))
 
     def list(self):
         return list(self.store.keys())
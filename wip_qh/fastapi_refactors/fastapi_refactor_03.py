@@ -11,6 +11,7 @@ so as to have more control over the configuration of the route.
 from fastapi import Query, Body
 from typing import Any
 from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+from wip_qh.fastapi_refactors.blob_routes import DFLT_BLOB_PREFIX
 
 # get the resourcs we'll be dispatching to web services
 from wip_qh.fastapi_refactors.fastapi_refactor_00 import (
@@ -37,6 +38,7 @@ route_specs = {
     get_store_value: {
         "api_route_kwargs": {"methods": 'get', "path": "/store_get/{user}"},
         "defaults": {"key": Query()},
+        "output": "json",  # (store values are JSON-compatible: one-pass encoding)
     },
     set_store_value: {
         "api_route_kwargs": {"methods": 'post', "path": "/store_set/{user}"},
@@ -45,7 +47,7 @@ route_specs = {
 }
 
 
-app = fast_api_app(route_specs)
+app = fast_api_app(route_specs, blob_prefix=DFLT_BLOB_PREFIX)
 
 
 
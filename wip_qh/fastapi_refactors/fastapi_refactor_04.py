@@ -7,6 +7,7 @@ configurationof the FastAPI app more concise and less error-prone.
 from fastapi import Query, Body
 from typing import Any
 from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+from wip_qh.fastapi_refactors.websocket_rpc import DFLT_RPC_PATH
 
 # get the resourcs we'll be dispatching to web services
 from wip_qh.fastapi_refactors.fastapi_refactor_00 import (
@@ -82,7 +83,7 @@ def _resolve_value(
     return value
 
 
-app = fast_api_app(expected_route_specs)
+app = fast_api_app(expected_route_specs, rpc_path=DFLT_RPC_PATH)
 
 if __name__ == "__main__":
     import uvicorn
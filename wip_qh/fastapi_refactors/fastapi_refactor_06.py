@@ -0,0 +1,50 @@
+"""
+Here, we serve the same routes as in `fastapi_refactor_03`, but with the async
+versions of the store functions (see `async_stores`), so that FastAPI awaits them on
+the event loop instead of running them in its thread pool: a network-backed (async)
+store can then have thousands of calls in flight, without a thread for each.
+
+"""
+
+from fastapi import Query, Body
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+from wip_qh.fastapi_refactors.fastapi_refactor_00 import (
+    random_integer,
+    greeter,
+    aget_store_list,
+    aget_store_value,
+    aset_store_value,
+)
+
+route_specs = {
+    random_integer: {
+        "api_route_kwargs": dict(methods=['GET'], path="/random_integer"),
+        "defaults": {"smallest": Query(1), "highest": Query(10)},
+    },
+    greeter: {
+        "api_route_kwargs": dict(methods=['GET'], path="/greeter/{greeting}"),
+        "defaults": {"name": Query("world"), "n": Query(1)},
+    },
+    aget_store_list: {
+        "api_route_kwargs": {"methods": 'get', "path": "/store_list/{user}"}
+    },
+    aget_store_value: {
+        "api_route_kwargs": {"methods": 'get', "path": "/store_get/{user}"},
+        "defaults": {"key": Query()},
+        "output": "json",
+    },
+    aset_store_value: {
+        "api_route_kwargs": {"methods": 'post', "path": "/store_set/{user}"},
+        "defaults": {"key": Query(), "value": Body(embed=True)},
+    },
+}
+
+
+app = fast_api_app(route_specs)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app)
@@ -0,0 +1,95 @@
+"""
+The routes of the job API (see `wip_qh.jobs`) of a FastAPI app: long-running calls
+are submitted (``POST /jobs/{func_name}``), and their status and result fetched
+later, instead of being made in one (long) request.
+
+``fast_api_app(route_specs, jobs=JobRunner())`` serves all the route functions so.
+
+"""
+
+import json
+from typing import Mapping, Callable
+
+from fastapi import Request, Response
+from pydantic import ValidationError
+
+from wip_qh import jobs
+from wip_qh.jobs import JobRunner, DFLT_JOBS_PREFIX
+from wip_qh.content_codecs import JSON_MIMETYPE
+
+
+def _response(http_response: jobs.HttpResponse) -> Response:
+    status_code, body, headers = http_response
+    return Response(body, status_code, headers=headers, media_type=JSON_MIMETYPE)
+
+
+def _error(status_code: int, detail) -> Response:
+    return _response((status_code, json.dumps({'detail': detail}).encode(), {}))
+
+
+def _coerced_params(model, params: dict) -> dict:
+    """The params, validated and converted by model (the func's input model)"""
+    validated = model(**params)
+    return {name: getattr(validated, name) for name in validated.__fields_set__}
+
+
+def add_job_routes(
+    app,
+    runner: JobRunner,
+    funcs: Mapping[str, Callable] = None,
+    *,
+    prefix: str = DFLT_JOBS_PREFIX,
+):
+    """
+    Add the job routes, under prefix, for `funcs` (added to the runner's functions).
+    Submitted params (a JSON object) are validated, and converted, according to the
+    function's signature (400 if the body isn't JSON, 422 if the params are invalid).
+    """
+    from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import (
+        model_from_function,
+    )
+
+    runner.funcs.update(funcs or {})
+    models = {}
+    prefix = '/' + prefix.strip('/')
+
+    async def submit_job(func_name: str, request: Request):
+        body = await request.body()
+        try:
+            params = json.loads(body) if body else {}
+        except ValueError as e:
+            return _error(400, f"Invalid JSON: {e}")
+        if not isinstance(params, dict):
+            return _error(422, "The params should be a JSON object")
+        func = runner.funcs.get(func_name)
+        if func is not None:
+            if func_name not in models:
+                models[func_name] = model_from_function(func)
+            try:
+                params = _coerced_params(models[func_name], params)
+            except ValidationError as e:
+                return Response(e.json(), 422, media_type=JSON_MIMETYPE)
+        return _response(jobs.submit_response(runner, func_name, params, prefix=prefix))
+
+    def job_status(job_id: str):
+        return _response(jobs.status_response(runner, job_id))
+
+    def job_result(job_id: str):
+        return _response(jobs.result_response(runner, job_id))
+
+    def cancel_job(job_id: str):
+        return _response(jobs.cancel_response(runner, job_id))
+
+    app.add_api_route(
+        prefix + '/{func_name}', submit_job, methods=['POST'], name='submit_job'
+    )
+    app.add_api_route(
+        prefix + '/{job_id}', job_status, methods=['GET'], name='job_status'
+    )
+    app.add_api_route(
+        prefix + '/{job_id}/result', job_result, methods=['GET'], name='job_result'
+    )
+    app.add_api_route(
+        prefix + '/{job_id}', cancel_job, methods=['DELETE'], name='cancel_job'
+    )
+    return app
@@ -0,0 +1,375 @@
+"""
+Merkle digests of a mall (``{user: {key: value}}``), and delta sync between replicas.
+
+`MerkleDigests` keeps a three level hash tree: a digest per (user, key) value, a
+digest per user (of its key digests) and a root digest (of the user digests).
+As an observer of an `ObservedMall`, it's maintained incrementally: a write only
+rehashes the written value, and marks its user's digest, and the root, for
+recomputation (from the cached digests below them) when next asked for.
+
+Two replicas then compare root digests, and only descend into (and ship) the
+subtrees whose digests differ:
+
+    local = LocalReplica.of_mall(backend_mall)
+    report = sync(local, HttpReplica('http://other-host:8000'))
+
+where the other host serves the sync routes (see `add_sync_routes`).
+
+Values must be JSON values (they're hashed, and shipped, as JSON): writes of other
+values to the observed mall are rejected, before they're made. Users with no keys
+have no digest: a replica with an empty store for a user has the same digests as one
+without that user.
+
+"""
+
+import json
+import hashlib
+import threading
+from urllib.parse import quote
+from dataclasses import dataclass, field
+from typing import MutableMapping, Mapping, Iterable, Tuple, List, Dict, Any
+
+from wip_qh.fastapi_refactors.observed_mall import ObservedMall, DELETED
+
+DFLT_SYNC_PREFIX = '/sync'
+DIGEST_SIZE = 16
+
+
+def _hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def value_digest(value) -> str:
+    """
+    The digest of a JSON value, insensitive to the order of dict keys.
+
+    >>> value_digest({'a': 1, 'b': [1, 2]}) == value_digest({'b': [1, 2], 'a': 1})
+    True
+    >>> value_digest({'a': 1}) == value_digest({'a': 2})
+    False
+
+    Other values are rejected (rather than hashed through a lossy representation,
+    that could make different values look the same):
+
+    >>> value_digest({'a': {1, 2}})
+    Traceback (most recent call last):
+      ...
+    TypeError: Object of type set is not JSON serializable
+    """
+    data = json.dumps(value, sort_keys=True, separators=(',', ':'), allow_nan=False)
+    return _hash(data.encode('utf-8'))
+
+
+def combined_digest(digests: Mapping[str, str]) -> str:
+    """The digest of a ``{name: digest}`` mapping (of a node's children)"""
+    data = '\n'.join(f"{name}\0{digests[name]}" for name in sorted(digests, key=str))
+    return _hash(data.encode('utf-8'))
+
+
+class MerkleDigests:
+    """
+    Incrementally maintained digests of a mall.
+
+    >>> mall, digests = observed_with_digests({'alice': {'fruit': 1, 'planets': 2}})
+    >>> root = digests.root_digest()
+    >>> users = digests.user_digests()
+    >>> mall['alice']['fruit'] = 10
+    >>> digests.root_digest() != root, digests.user_digests() != users
+    (True, True)
+    >>> mall['alice']['fruit'] = 1  # back to what it was
+    >>> digests.root_digest() == root
+    True
+    >>> same = MerkleDigests({'alice': {'planets': 2, 'fruit': 1}})
+    >>> digests.root_digest() == same.root_digest()
+    True
+    >>> with_dave = MerkleDigests({'alice': {'planets': 2, 'fruit': 1}, 'dave': {}})
+    >>> with_dave.root_digest() == same.root_digest()  # (dave has no keys)
+    True
+    """
+
+    def __init__(self, mall: Mapping = None):
+        self._lock = threading.RLock()
+        self._validated = None  # (user, key, value, digest) of the last validate
+        self.rebuild(mall or {})
+
+    def rebuild(self, mall: Mapping):
+        """Recompute all the digests (of all the values) of the mall"""
+        with self._lock:
+            self._key_digests = {
+                user: {key: value_digest(value) for key, value in store.items()}
+                for user, store in mall.items()
+                if store  # (users without keys have no digests, as in __call__)
+            }
+            self._user_digests = {}  # (lazily computed) user -> digest
+            self._root = None
+
+    def validate(self, user, key, value):
+        """Reject (with a TypeError or ValueError) values that aren't JSON, before
+        they're written (the digest is kept, for the write's `__call__`)"""
+        digest = value_digest(value)
+        with self._lock:
+            self._validated = (user, key, value, digest)
+
+    def _digest(self, user, key, value):
+        with self._lock:
+            validated, self._validated = self._validated, None
+        if validated is not None:
+            v_user, v_key, v_value, digest = validated
+            if v_value is value and v_user == user and v_key == key:
+                return digest
+        return value_digest(value)
+
+    def __call__(self, user, key, value):
+        """Update the digests after a write (an `ObservedMall` observer)"""
+        try:
+            digest = None if value is DELETED else self._digest(user, key, value)
+        except (TypeError, ValueError):
+            self(user, key, DELETED)  # (not to keep the digest of the previous value)
+            raise
+        with self._lock:
+            key_digests = self._key_digests.setdefault(user, {})
+            if digest is None:
+                key_digests.pop(key, None)
+                if not key_digests:
+                    del self._key_digests[user]
+            else:
+                key_digests[key] = digest
+            self._user_digests.pop(user, None)
+            self._root = None
+
+    def key_digests(self, user) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._key_digests.get(user, {}))
+
+    def user_digest(self, user) -> str:
+        with self._lock:
+            digest = self._user_digests.get(user)
+            if digest is None:
+                digest = combined_digest(self._key_digests.get(user, {}))
+                self._user_digests[user] = digest
+            return digest
+
+    def user_digests(self) -> Dict[str, str]:
+        with self._lock:
+            return {user: self.user_digest(user) for user in self._key_digests}
+
+    def root_digest(self) -> str:
+        with self._lock:
+            if self._root is None:
+                self._root = combined_digest(self.user_digests())
+            return self._root
+
+
+def observed_with_digests(mall: MutableMapping) -> Tuple[ObservedMall, MerkleDigests]:
+    """Wrap mall so that writes keep its (returned) digests up to date"""
+    digests = MerkleDigests(mall)
+    return ObservedMall(mall, [digests]), digests
+
+
+# -------------------------------------------------------------------------------------
+# Replicas and sync
+
+
+@dataclass
+class LocalReplica:
+    """
+    A mall and its digests, with the interface `sync` needs of replicas:
+    ``root_digest()``, ``user_digests()``, ``key_digests(user)`` and
+    ``values(user, keys)``.
+    """
+
+    mall: MutableMapping  # (writes should go through it, to keep digests up to date)
+    digests: MerkleDigests
+
+    @classmethod
+    def of_mall(cls, mall: MutableMapping):
+        if isinstance(mall, ObservedMall):
+            digests = next(
+                (o for o in mall.observers if isinstance(o, MerkleDigests)), None
+            )
+            if digests is None:
+                digests = mall.add_observer(MerkleDigests(mall))
+            return cls(mall, digests)
+        return cls(*observed_with_digests(mall))
+
+    def root_digest(self) -> str:
+        return self.digests.root_digest()
+
+    def user_digests(self) -> Dict[str, str]:
+        return self.digests.user_digests()
+
+    def key_digests(self, user) -> Dict[str, str]:
+        return self.digests.key_digests(user)
+
+    def values(self, user, keys: Iterable) -> dict:
+        store = self.mall[user]
+        return {key: store[key] for key in keys if key in store}
+
+
+@dataclass
+class HttpReplica:
+    """
+    A remote replica, accessed through its sync routes (see `add_sync_routes`).
+    An (httpx) `client` can be given instead of a `base_url`.
+    """
+
+    base_url: str = None
+    prefix: str = DFLT_SYNC_PREFIX
+    timeout: float = 30.0
+    client: Any = None
+
+    def __post_init__(self):
+        if self.client is None:
+            import httpx
+
+            self.client = httpx.Client(base_url=self.base_url, timeout=self.timeout)
+
+    def _get(self, path):
+        response = self.client.get(self.prefix + path)
+        response.raise_for_status()
+        return response.json()
+
+    def root_digest(self) -> str:
+        return self._get('/root')['digest']
+
+    def user_digests(self) -> Dict[str, str]:
+        return self._get('/users')
+
+    def key_digests(self, user) -> Dict[str, str]:
+        return self._get(f"/users/{quote(user, safe='')}")
+
+    def values(self, user, keys: Iterable) -> dict:
+        path = f"{self.prefix}/values/{quote(user, safe='')}"
+        response = self.client.post(path, json={'keys': list(keys)})
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.client.close()
+
+
+@dataclass
+class SyncReport:
+    """What a sync did"""
+
+    users_compared: int = 0
+    set: List[Tuple[str, str]] = field(default_factory=list)
+    deleted: List[Tuple[str, str]] = field(default_factory=list)
+
+    def to_dict(self):
+        return {
+            'users_compared': self.users_compared,
+            'set': [list(x) for x in self.set],
+            'deleted': [list(x) for x in self.deleted],
+        }
+
+
+def diff_digests(local: Mapping[str, str], remote: Mapping[str, str]):
+    """
+    The names to fetch (new or different in remote) and to delete (not in remote).
+
+    >>> diff_digests({'a': '1', 'b': '2', 'c': '3'}, {'a': '1', 'b': '4', 'd': '5'})
+    (['b', 'd'], ['c'])
+    """
+    to_fetch = [name for name, digest in remote.items() if local.get(name) != digest]
+    to_delete = [name for name in local if name not in remote]
+    return to_fetch, to_delete
+
+
+def sync(local: LocalReplica, remote) -> SyncReport:
+    """
+    Make local a copy of remote, fetching only the values whose digests differ.
+
+    >>> a = LocalReplica.of_mall({'alice': {'fruit': 1, 'planets': 2}, 'bob': {'c': 3}})
+    >>> b = LocalReplica.of_mall({'alice': {'fruit': 1, 'planets': 20}, 'carol': {'x': 4}})
+    >>> report = sync(a, b)
+    >>> report.set, report.deleted
+    ([('alice', 'planets'), ('carol', 'x')], [('bob', 'c')])
+    >>> a.root_digest() == b.root_digest(), dict(a.mall.mall)
+    (True, {'alice': {'fruit': 1, 'planets': 20}, 'carol': {'x': 4}})
+    >>> sync(a, b).users_compared  # nothing to compare when the roots match
+    0
+    """
+    report = SyncReport()
+    if local.root_digest() == remote.root_digest():
+        return report
+    users_to_fetch, users_to_delete = diff_digests(
+        local.user_digests(), remote.user_digests()
+    )
+    for user in users_to_fetch:
+        report.users_compared += 1
+        keys_to_fetch, keys_to_delete = diff_digests(
+            local.key_digests(user), remote.key_digests(user)
+        )
+        if user not in local.mall:
+            local.mall[user] = {}
+        store = local.mall[user]
+        for key, value in remote.values(user, keys_to_fetch).items():
+            store[key] = value
+            report.set.append((user, key))
+        for key in keys_to_delete:
+            del store[key]
+            report.deleted.append((user, key))
+    for user in users_to_delete:
+        report.deleted.extend((user, key) for key in local.mall[user])
+        del local.mall[user]
+    return report
+
+
+# -------------------------------------------------------------------------------------
+# Routes
+
+
+def add_sync_routes(
+    app,
+    replica: LocalReplica,
+    *,
+    prefix: str = DFLT_SYNC_PREFIX,
+    peers: Iterable[str] = (),
+):
+    """
+    Add the routes that serve replica's digests and values, so that other replicas
+    can sync from it:
+
+    - ``GET {prefix}/root``: ``{"digest": root_digest}``
+    - ``GET {prefix}/users``: ``{user: digest, ...}``
+    - ``GET {prefix}/users/{user}``: ``{key: digest, ...}``
+    - ``POST {prefix}/values/{user}``, with ``{"keys": [...]}``: ``{key: value, ...}``
+
+    If `peers` (base urls of other replicas) are given, a ``POST {prefix}/pull``
+    route is also added, that syncs replica from the peer at the ``{"url": ...}`` of
+    its body. Only those urls are accepted (403 for others): the server would
+    otherwise make requests to any url a client gives it.
+    """
+    from fastapi import Body, HTTPException
+
+    peers = {url.rstrip('/') for url in peers}
+
+    def sync_root():
+        return {'digest': replica.root_digest()}
+
+    def sync_users():
+        return replica.user_digests()
+
+    def sync_user(user: str):
+        return replica.key_digests(user)
+
+    def sync_values(user: str, keys: List[str] = Body(..., embed=True)):
+        return replica.values(user, keys)
+
+    def sync_pull(url: str = Body(..., embed=True)):
+        if url.rstrip('/') not in peers:
+            raise HTTPException(403, f"Not a peer of this replica: {url}")
+        remote = HttpReplica(url, prefix=prefix)
+        try:
+            return sync(replica, remote).to_dict()
+        finally:
+            remote.close()
+
+    app.add_api_route(f"{prefix}/root", sync_root, methods=['GET'])
+    app.add_api_route(f"{prefix}/users", sync_users, methods=['GET'])
+    app.add_api_route(f"{prefix}/users/{{user}}", sync_user, methods=['GET'])
+    app.add_api_route(f"{prefix}/values/{{user}}", sync_values, methods=['POST'])
+    if peers:
+        app.add_api_route(f"{prefix}/pull", sync_pull, methods=['POST'])
+    return app
@@ -0,0 +1,165 @@
+"""
+A mall (a ``{user: store}`` mapping, shaped like `fastapi_refactor_00.backend_mall`)
+that tells observers about the writes made to its stores.
+
+Observers are callables called as ``observer(user, key, value)`` after each write
+(``mall[user][key] = value``), and with ``value=DELETED`` after each deletion.
+They're used to maintain derived data (digests, indexes, change feeds...)
+incrementally, instead of rescanning the mall.
+
+Observers that can't take some values (such as `merkle_sync.MerkleDigests`, which only
+takes JSON values) have a ``validate(user, key, value)`` method, called before the
+write, that raises to reject it: the value is then neither written nor notified.
+
+A write and its notification happen under the mall's (reentrant) lock, so that
+observers are told about concurrent writes in the order they were made (two threads
+writing the same key can't leave an index describing the value that was overwritten).
+All the observers are told about a write, even if some of them fail: the first error
+is raised once they all were.
+
+To have the web services' writes observed, point `store_getter` to the observed mall:
+
+    from wip_qh.fastapi_refactors import fastapi_refactor_00
+    mall = ObservedMall(fastapi_refactor_00.backend_mall)
+    fastapi_refactor_00.store_getter = mall.__getitem__
+
+"""
+
+import threading
+from typing import Callable, MutableMapping, Any, Iterable
+
+Observer = Callable[[str, Any, Any], Any]
+
+
+class _Deleted:
+    def __repr__(self):
+        return 'DELETED'
+
+
+DELETED = _Deleted()  # the value observers get for deletions
+
+
+class ObservedStore(MutableMapping):
+    """A view of the store of one user, notifying the mall's observers of writes"""
+
+    def __init__(
+        self,
+        store: MutableMapping,
+        user: str,
+        notify: Observer,
+        lock: threading.RLock,
+        validate: Observer = None,
+    ):
+        self.store = store
+        self.user = user
+        self._notify = notify
+        self._lock = lock
+        self._validate = validate
+
+    def __getitem__(self, key):
+        return self.store[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if self._validate is not None:
+                self._validate(self.user, key, value)
+            self.store[key] = value
+            self._notify(self.user, key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self.store[key]
+            self._notify(self.user, key, DELETED)
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, key):
+        return key in self.store
+
+
+class ObservedMall(MutableMapping):
+    """
+    A mall whose user stores notify observers of their writes.
+
+    >>> events = []
+    >>> mall = ObservedMall({'alice': {'fruit': 1}}, [lambda *e: events.append(e)])
+    >>> mall['alice']['planets'] = 2
+    >>> del mall['alice']['fruit']
+    >>> mall['bob'] = {'cars': 3}
+    >>> events
+    [('alice', 'planets', 2), ('alice', 'fruit', DELETED), ('bob', 'cars', 3)]
+    >>> dict(mall['alice']), list(mall)
+    ({'planets': 2}, ['alice', 'bob'])
+    """
+
+    def __init__(self, mall: MutableMapping, observers: Iterable[Observer] = ()):
+        self.mall = mall
+        self.observers = list(observers)
+        self._lock = threading.RLock()
+
+    def add_observer(self, observer: Observer) -> Observer:
+        self.observers.append(observer)
+        return observer
+
+    def remove_observer(self, observer: Observer):
+        self.observers.remove(observer)
+
+    def validate(self, user, key, value):
+        """Have the observers that validate values reject value, if they do"""
+        for observer in self.observers:
+            validate = getattr(observer, 'validate', None)
+            if validate is not None:
+                validate(user, key, value)
+
+    def notify(self, user, key, value):
+        """Notify all the observers, even if some fail (re-raising the first error)"""
+        self._notify_all([(user, key, value)])
+
+    def _notify_all(self, events):
+        # (an observer's failure mustn't keep the others from hearing about a write
+        # that was made: they'd drift from the data for good)
+        first_error = None
+        for user, key, value in events:
+            for observer in self.observers:
+                try:
+                    observer(user, key, value)
+                except Exception as e:
+                    if first_error is None:
+                        first_error = e
+        if first_error is not None:
+            raise first_error
+
+    def __getitem__(self, user) -> ObservedStore:
+        return ObservedStore(
+            self.mall[user], user, self.notify, self._lock, self.validate
+        )
+
+    def __setitem__(self, user, store: MutableMapping):
+        """Set the store of a user (notifying the deletion of the keys it replaces)"""
+        with self._lock:
+            for key, value in store.items():
+                self.validate(user, key, value)
+            old_keys = set(self.mall[user]) if user in self.mall else set()
+            self.mall[user] = store
+            deleted = [(user, key, DELETED) for key in old_keys - set(store)]
+            written = [(user, key, value) for key, value in store.items()]
+            self._notify_all(deleted + written)
+
+    def __delitem__(self, user):
+        with self._lock:
+            keys = list(self.mall[user])
+            del self.mall[user]
+            self._notify_all([(user, key, DELETED) for key in keys])
+
+    def __iter__(self):
+        return iter(self.mall)
+
+    def __len__(self):
+        return len(self.mall)
+
+    def __contains__(self, user):
+        return user in self.mall
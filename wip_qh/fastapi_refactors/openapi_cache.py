@@ -0,0 +1,215 @@
+"""
+A precomputed OpenAPI schema, served as pre-encoded bytes.
+
+FastAPI generates the schema of an app on the first ``/openapi.json`` (or ``/docs``)
+request, which, with many routes and models, makes that request very slow (and it
+re-encodes the schema on every request after that).
+
+`serve_precomputed_openapi` makes the ``/openapi.json`` route serve bytes that are
+computed once: when the app starts (on the lifespan startup event), or, if a request
+comes first, then. With a `cache_dir`, the schema is also written to (and, on the next
+starts, read from) a file whose name is a key of the app's routes
+(`openapi_cache_key`), so that instances of the same build don't generate it at all.
+
+`fast_api_app` does this for the apps it makes (see its `openapi_cache_dir`).
+
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+from typing import Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+from wip_qh.content_codecs import json_dumps_bytes, JSON_MIMETYPE
+
+
+def _type_key(type_):
+    """The JSON schema of type_ (with the fields of the models it's made of), or, if
+    it has none, its repr"""
+    from pydantic import schema_of
+
+    try:
+        return schema_of(type_)
+    except Exception:
+        return repr(type_)
+
+
+def _field_key(field):
+    return [
+        field.name,
+        field.alias,
+        _type_key(field.outer_type_),
+        field.required,
+        repr(field.default),
+        repr(field.field_info),  # (description, examples, constraints...)
+    ]
+
+
+def _api_route_key(route) -> list:
+    """What the schema of an `APIRoute` is made of: the parameters and models of its
+    endpoint, and the operation attributes (docstring, tags, responses...)"""
+    from fastapi.dependencies.utils import get_flat_dependant
+
+    dependant = get_flat_dependant(route.dependant)
+    params = [
+        dependant.path_params,
+        dependant.query_params,
+        dependant.header_params,
+        dependant.cookie_params,
+    ]
+    return [
+        [[_field_key(field) for field in fields] for fields in params],
+        _field_key(route.body_field) if route.body_field is not None else None,
+        [repr(r.security_scheme.model) for r in dependant.security_requirements],
+        _type_key(route.response_model) if route.response_model is not None else None,
+        {
+            str(status): {
+                k: _type_key(v) if k == 'model' else v for k, v in response.items()
+            }
+            for status, response in route.responses.items()
+        },
+        route.summary,
+        route.description,
+        route.response_description,
+        route.tags,
+        route.deprecated,
+        route.operation_id,
+        route.status_code,
+        route.openapi_extra,
+        getattr(route.response_class, 'media_type', None),
+        [_api_route_key(callback) for callback in route.callbacks or ()],
+    ]
+
+
+def _route_key(route) -> list:
+    from fastapi.routing import APIRoute
+
+    key = [
+        getattr(route, 'path', ''),
+        sorted(getattr(route, 'methods', None) or ()),
+        getattr(route, 'name', ''),
+        getattr(route, 'include_in_schema', True),
+    ]
+    if isinstance(route, APIRoute):
+        key.append(_api_route_key(route))
+    return key
+
+
+def openapi_cache_key(app) -> str:
+    """
+    A key of what the app's schema is made of (its routes' paths and methods, their
+    parameters, bodies and response models, with the fields of their pydantic models,
+    their docstrings, tags, responses and other operation attributes, the app's
+    metadata, and the versions of FastAPI and pydantic), computed without generating
+    the schema.
+    """
+    import fastapi
+    import pydantic
+
+    routes = [_route_key(route) for route in app.routes]
+    webhooks = [_route_key(route) for route in app.webhooks.routes]
+    meta = [
+        getattr(app, name, None)
+        for name in (
+            'title',
+            'summary',
+            'version',
+            'description',
+            'openapi_version',
+            'terms_of_service',
+            'contact',
+            'license_info',
+            'openapi_tags',
+            'servers',
+        )
+    ]
+    versions = [fastapi.__version__, pydantic.VERSION]
+    data = json.dumps([versions, meta, routes, webhooks], default=repr)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _write_atomically(path: str, data: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.openapi.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def precompute_openapi(app, *, cache_dir: Optional[str] = None) -> bytes:
+    """
+    Compute (or load, from cache_dir) the app's schema, set it as the app's
+    ``openapi_schema`` (which FastAPI's ``app.openapi()`` then returns), and return
+    its JSON bytes.
+    """
+    path = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, f"openapi.{openapi_cache_key(app)}.json")
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                encoded = f.read()
+            app.openapi_schema = json.loads(encoded)
+            return encoded
+    app.openapi_schema = None  # (so that it's generated now)
+    encoded = bytes(json_dumps_bytes(app.openapi()))
+    if path is not None:
+        _write_atomically(path, encoded)
+    return encoded
+
+
+def _with_server(encoded: bytes, url: str) -> bytes:
+    """The encoded schema, with url first in its ``servers`` (if it's not there)"""
+    schema = json.loads(encoded)
+    servers = schema.get('servers', [])
+    if url not in {server.get('url') for server in servers}:
+        schema['servers'] = [{'url': url}, *servers]
+    return bytes(json_dumps_bytes(schema))
+
+
+_MAX_ROOT_PATHS = 16  # (of schemas kept, with the servers of the requests' root_path)
+
+
+def serve_precomputed_openapi(app, *, cache_dir: Optional[str] = None):
+    """
+    Serve the app's schema (at ``app.openapi_url``) as bytes computed once, when the
+    app starts (or at the first request, if it comes before).
+
+    As FastAPI does, the ``root_path`` a request is served under (behind a proxy) is
+    added to the schema's ``servers`` (unless ``app.root_path_in_servers`` is false).
+    """
+    if app.openapi_url is None:
+        return app
+    encoded = None
+    encoded_by_root_path = {}
+
+    def compute():
+        nonlocal encoded
+        if encoded is None:
+            encoded = precompute_openapi(app, cache_dir=cache_dir)
+        return encoded
+
+    def for_root_path(root_path: str) -> bytes:
+        if not root_path or not app.root_path_in_servers:
+            return compute()
+        body = encoded_by_root_path.get(root_path)
+        if body is None:
+            body = _with_server(compute(), root_path)
+            if len(encoded_by_root_path) < _MAX_ROOT_PATHS:
+                encoded_by_root_path[root_path] = body
+        return body
+
+    async def openapi(request: Request) -> Response:
+        root_path = request.scope.get('root_path', '').rstrip('/')
+        return Response(for_root_path(root_path), media_type=JSON_MIMETYPE)
+
+    # (first, so that it's matched before the route FastAPI added)
+    app.router.routes.insert(
+        0, Route(app.openapi_url, openapi, include_in_schema=False)
+    )
+    app.add_event_handler('startup', compute)
+    return app
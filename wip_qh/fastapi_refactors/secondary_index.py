@@ -0,0 +1,139 @@
+"""
+Secondary (inverted) indexes of a mall's values: ``{term: {(user, key), ...}}``,
+where the terms of a value are extracted from it (by default, the names of its inner
+keys, like ``'apple'`` in ``backend_mall['alice']['fruit']``).
+
+As an observer of an `ObservedMall`, an `InvertedIndex` is maintained incrementally:
+a write only re-extracts the terms of the written value. So, to have the writes of
+the web services (`set_store_value`), and of ``StoreAccess(mall)``, indexed:
+
+    mall, index = observed_with_index(fastapi_refactor_00.backend_mall)
+    fastapi_refactor_00.store_getter = mall.__getitem__
+    app = fast_api_app({**route_specs, **index_route_specs(index)})
+
+and "which users have apples" is a ``GET /index/apple?users_only=true``, instead of
+a scan of all the users' data.
+
+"""
+
+import threading
+from typing import MutableMapping, Mapping, Callable, Iterable, Tuple, List
+
+from wip_qh.fastapi_refactors.observed_mall import ObservedMall, DELETED
+
+DFLT_INDEX_PATH = '/index/{term}'
+
+
+def inner_keys(value) -> Iterable[str]:
+    """
+    The keys of the dicts nested in value (the default terms of an `InvertedIndex`).
+
+    >>> sorted(inner_keys({'apple': 1, 'basket': {'banana': 2}, 'list': [{'kiwi': 0}]}))
+    ['apple', 'banana', 'basket', 'kiwi', 'list']
+    """
+    if isinstance(value, Mapping):
+        for k, v in value.items():
+            yield str(k)
+            yield from inner_keys(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from inner_keys(v)
+
+
+class InvertedIndex:
+    """
+    An incrementally maintained ``{term: {(user, key), ...}}`` index of a mall.
+
+    >>> mall, index = observed_with_index(
+    ...     {'alice': {'fruit': {'apple': 1}}, 'bob': {'food': {'apple': 1, 'kiwi': 2}}}
+    ... )
+    >>> index.lookup('apple')
+    [('alice', 'fruit'), ('bob', 'food')]
+    >>> mall['bob']['food'] = {'kiwi': 3}
+    >>> index.users_with('apple'), index.users_with('kiwi')
+    (['alice'], ['bob'])
+    >>> del mall['alice']
+    >>> index.lookup('apple')
+    []
+    """
+
+    def __init__(
+        self, mall: Mapping = None, *, extract: Callable[..., Iterable] = inner_keys
+    ):
+        self.extract = extract
+        self._lock = threading.RLock()
+        self.rebuild(mall or {})
+
+    def rebuild(self, mall: Mapping):
+        """Index all the values of the mall (from scratch)"""
+        with self._lock:
+            self._postings = {}  # term -> {(user, key): None}
+            self._terms = {}  # (user, key) -> terms of its value
+            for user, store in mall.items():
+                for key, value in store.items():
+                    self._add(user, key, value)
+
+    def _add(self, user, key, value):
+        terms = frozenset(self.extract(value))
+        self._terms[(user, key)] = terms
+        for term in terms:
+            self._postings.setdefault(term, {})[(user, key)] = None
+
+    def _remove(self, user, key):
+        for term in self._terms.pop((user, key), ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop((user, key), None)
+                if not postings:
+                    del self._postings[term]
+
+    def __call__(self, user, key, value):
+        """Update the index after a write (an `ObservedMall` observer)"""
+        with self._lock:
+            self._remove(user, key)
+            if value is not DELETED:
+                self._add(user, key, value)
+
+    def lookup(self, term) -> List[Tuple[str, str]]:
+        """The (user, key) pairs whose values have term"""
+        with self._lock:
+            return sorted(self._postings.get(term, ()), key=str)
+
+    def users_with(self, term) -> List[str]:
+        """The users having a value that has term"""
+        return sorted({user for user, _ in self.lookup(term)}, key=str)
+
+    def __len__(self):
+        """The number of terms"""
+        return len(self._postings)
+
+
+def observed_with_index(
+    mall: MutableMapping, *, extract: Callable[..., Iterable] = inner_keys
+) -> Tuple[ObservedMall, InvertedIndex]:
+    """Wrap mall so that writes keep its (returned) inverted index up to date"""
+    index = InvertedIndex(mall, extract=extract)
+    return ObservedMall(mall, [index]), index
+
+
+def index_route_specs(
+    index: InvertedIndex, *, name: str = 'index_lookup', path: str = DFLT_INDEX_PATH
+) -> dict:
+    """
+    The route_specs (see `utils_for_fastapi_refactor_03.fast_api_app`) of a route
+    looking up a term in index: the ``{"user": ..., "key": ...}`` of the values
+    having it, or, with ``users_only=true``, the users.
+    """
+
+    def index_lookup(term: str, users_only: bool = False):
+        if users_only:
+            return index.users_with(term)
+        return [{'user': user, 'key': key} for user, key in index.lookup(term)]
+
+    index_lookup.__name__ = index_lookup.__qualname__ = name
+    return {
+        index_lookup: {
+            "api_route_kwargs": {"methods": 'get', "path": path, "name": name},
+            "output": "json",
+        }
+    }
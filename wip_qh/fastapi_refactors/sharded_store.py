@@ -0,0 +1,205 @@
+"""
+A sharded store: a MutableMapping that routes each key (user) to one of several
+backend MutableMappings (shards), by consistent hashing.
+
+With consistent hashing, adding (or removing) a shard only moves the keys that the
+new shard takes over (about 1/N of them), instead of reshuffling everything, as
+``hash(key) % N`` would.
+
+Listing (iterating over, or counting) the keys fans out to the shards in parallel.
+
+To use it as the store of the web services, either point `store_getter` to it:
+
+    from wip_qh.fastapi_refactors import fastapi_refactor_00
+    sharded = ShardedStore({'s0': shard_0, 's1': shard_1})
+    fastapi_refactor_00.store_getter = sharded.__getitem__
+
+or register a uri for `StoreAccess.from_uri`:
+
+    register_store_uri('sharded://mall', lambda uri: sharded)
+
+"""
+
+import hashlib
+from bisect import bisect, insort
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Mapping, MutableMapping, Callable, Hashable, Optional
+
+DFLT_REPLICAS = 128
+
+
+def stable_hash(key) -> int:
+    """A hash that is the same across processes (unlike `hash`, for strings)"""
+    digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class HashRing:
+    """
+    A consistent hashing ring: each node is placed at `replicas` points of the ring,
+    and a key belongs to the first node found clockwise from the key's hash.
+
+    >>> ring = HashRing(['a', 'b', 'c'])
+    >>> ring.node_for('alice') in {'a', 'b', 'c'}
+    True
+    >>> keys = [f"user_{i}" for i in range(1000)]
+    >>> before = {k: ring.node_for(k) for k in keys}
+    >>> ring.add('d')
+    >>> moved = [k for k in keys if ring.node_for(k) != before[k]]
+    >>> all(ring.node_for(k) == 'd' for k in moved)  # keys only move to the new node
+    True
+    >>> 150 < len(moved) < 350  # about a quarter of them
+    True
+    """
+
+    def __init__(
+        self,
+        nodes=(),
+        *,
+        replicas: int = DFLT_REPLICAS,
+        hash: Callable[[str], int] = stable_hash,
+    ):
+        self.replicas = replicas
+        self.hash = hash
+        self._points = []  # sorted (point, node) pairs
+        self.nodes = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: Hashable):
+        if node in self.nodes:
+            raise ValueError(f"Node already in ring: {node}")
+        self.nodes.append(node)
+        for i in range(self.replicas):
+            insort(self._points, (self.hash(f"{node}#{i}"), str(node), node))
+
+    def remove(self, node: Hashable):
+        self.nodes.remove(node)
+        self._points = [p for p in self._points if p[2] != node]
+
+    def node_for(self, key) -> Hashable:
+        if not self._points:
+            raise KeyError("The ring has no nodes")
+        i = bisect(self._points, (self.hash(key),))
+        return self._points[i % len(self._points)][2]
+
+
+class ShardedStore(MutableMapping):
+    """
+    A MutableMapping whose keys are spread over `shards` (a ``{name: mapping}`` dict)
+    by consistent hashing.
+
+    >>> store = ShardedStore({'s0': {}, 's1': {}})
+    >>> for i in range(100):
+    ...     store[f"user_{i}"] = {'i': i}
+    >>> len(store), store['user_42']
+    (100, {'i': 42})
+    >>> sorted(map(len, store.shards.values())) != [0, 100]  # spread over shards
+    True
+    >>> moved = store.add_shard('s2', {})
+    >>> 0 < moved < 60, len(store), store['user_42']
+    (True, 100, {'i': 42})
+    >>> _ = store.remove_shard('s0')
+    >>> len(store), sorted(store.shards)
+    (100, ['s1', 's2'])
+    """
+
+    def __init__(
+        self,
+        shards: Mapping[str, MutableMapping],
+        *,
+        replicas: int = DFLT_REPLICAS,
+        max_workers: Optional[int] = None,
+    ):
+        self.shards = dict(shards)
+        self.ring = HashRing(self.shards, replicas=replicas)
+        self.max_workers = max_workers
+
+    def shard_name_for(self, key) -> str:
+        return self.ring.node_for(key)
+
+    def shard_for(self, key) -> MutableMapping:
+        return self.shards[self.ring.node_for(key)]
+
+    def __getitem__(self, key):
+        return self.shard_for(key)[key]
+
+    def __setitem__(self, key, value):
+        self.shard_for(key)[key] = value
+
+    def __delitem__(self, key):
+        del self.shard_for(key)[key]
+
+    def __contains__(self, key):
+        return key in self.shard_for(key)
+
+    def _map_shards(self, func: Callable, shards=None):
+        """Apply func to each shard, in parallel"""
+        shards = list(self.shards.values() if shards is None else shards)
+        if len(shards) <= 1:
+            return list(map(func, shards))
+        with ThreadPoolExecutor(self.max_workers or len(shards)) as executor:
+            return list(executor.map(func, shards))
+
+    def __iter__(self):
+        return chain.from_iterable(self._map_shards(list))
+
+    def __len__(self):
+        return sum(self._map_shards(len))
+
+    def _move_misplaced_keys(self, shard_names) -> int:
+        """
+        Move the keys of the given shards that now belong elsewhere.
+
+        This is done sequentially: several source shards may be writing to the same
+        target shard, and the backends aren't assumed to be thread-safe.
+        """
+        n_moved = 0
+        for name in shard_names:
+            shard = self.shards[name]
+            for key in list(shard):
+                target = self.ring.node_for(key)
+                if target != name:
+                    self.shards[target][key] = shard[key]
+                    del shard[key]
+                    n_moved += 1
+        return n_moved
+
+    def add_shard(self, name: str, shard: MutableMapping) -> int:
+        """
+        Add a shard, moving to it the keys it now owns (and only those).
+        Returns the number of keys moved.
+        """
+        if name in self.shards:
+            raise ValueError(f"There's already a shard named {name}")
+        old_names = list(self.shards)
+        self.shards[name] = shard
+        self.ring.add(name)
+        return self._move_misplaced_keys(old_names)
+
+    def remove_shard(self, name: str) -> MutableMapping:
+        """
+        Remove a shard, moving its keys to the shards that now own them.
+
+        >>> store = ShardedStore({'s0': {'alice': 1}})
+        >>> store.remove_shard('s0')
+        Traceback (most recent call last):
+          ...
+        ValueError: Can't remove s0: it's the only shard, and it has keys
+        """
+        if name not in self.shards:
+            raise KeyError(f"No such shard: {name}")
+        shard = self.shards[name]
+        if len(self.shards) == 1 and len(shard) > 0:
+            raise ValueError(
+                f"Can't remove {name}: it's the only shard, and it has keys"
+            )
+        self.ring.remove(name)
+        self._move_misplaced_keys([name])
+        if len(shard) != 0:
+            self.ring.add(name)
+            raise RuntimeError(
+                f"{len(shard)} keys of {name} couldn't be moved: the shard was kept"
+            )
+        return self.shards.pop(name)
@@ -0,0 +1,447 @@
+"""
+A store living in shared memory, so that all the (uvicorn worker) processes of a host
+share one copy of the data, and see each other's writes.
+
+The data is a log of records, appended to an arena of (POSIX) shared memory:
+
+    header: magic | epoch (uint32) | ready (uint32) | capacity (uint64) | end (uint64)
+    record: op (uint8: set or delete) | key length | value length | key | value
+
+(keys and values are JSON-encoded). Each process keeps its own index of the log
+(``{key: (offset, length)}`` of the current values), and catches up with the records
+appended since it last looked before every operation, so a read costs a header read,
+a dict lookup and the decoding of the value, and a write, an append.
+
+When the arena is full, the live records are compacted (rewritten at its start), and
+the epoch is incremented, which tells the other processes to rebuild their index.
+The ready flag is set once the initial contents are written (see `fill`): they're
+written while holding the exclusive lock, so other processes wait for them, and if the
+process writing them dies before it's done, the next one to attach starts over.
+
+Processes synchronize with ``fcntl.flock`` locks on a lock file (shared ones for
+reads, exclusive ones for writes), and the threads of a process, with a lock.
+
+To have the web services' workers share their mall:
+
+    mall = SharedMemoryMall('wip_qh_mall', size=256 * 2**20, initial=backend_mall)
+    fastapi_refactor_00.store_getter = mall.__getitem__
+
+(the first process to get there creates it, the others attach to it), and for
+`StoreAccess`, ``register_store_uri('shm://wip_qh_mall', shared_memory_mall_of_uri)``.
+
+"""
+
+import os
+import json
+import fcntl
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from functools import partial
+from multiprocessing import shared_memory
+from typing import Callable, MutableMapping, Optional, Iterator
+
+DFLT_SIZE = 64 * 2**20
+
+_MAGIC = b'WIPQHSHM'
+_header = struct.Struct('<8sIIQQ')  # magic, epoch, ready, capacity, end
+_READY_OFFSET = 12
+_record = struct.Struct('<BII')  # op, key length, value length
+_SET, _DELETE = 1, 2
+
+
+class SharedMemoryFull(MemoryError):
+    """Raised when a write doesn't fit in the arena, even once compacted"""
+
+
+def _encode_key(key) -> bytes:
+    return json.dumps(key, separators=(',', ':')).encode('utf-8')
+
+
+def _decode_key(key_bytes: bytes):
+    key = json.loads(key_bytes)
+    return tuple(key) if isinstance(key, list) else key
+
+
+def _encode_value(value) -> bytes:
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def _dflt_lock_path(name: str) -> str:
+    rootdir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(rootdir, f"{name}.lock")
+
+
+def _attach(name: str, size: int):
+    """Create the shared memory segment, or attach to it. Returns (shm, created)."""
+    try:
+        shm, created = shared_memory.SharedMemory(name, create=True, size=size), True
+    except FileExistsError:
+        shm, created = shared_memory.SharedMemory(name), False
+    # The segment outlives the processes using it (until `unlink`): don't let the
+    # resource tracker remove it when the process that created it exits.
+    _resource_tracking(shm, 'unregister')
+    return shm, created
+
+
+def _resource_tracking(shm, method: str):
+    try:
+        from multiprocessing import resource_tracker
+
+        getattr(resource_tracker, method)(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+class SharedMemoryStore(MutableMapping):
+    """
+    A MutableMapping whose (JSON-compatible) keys and values are kept in the shared
+    memory segment `name` (created, of `size` bytes, if it doesn't exist yet).
+    Tuple keys are grouped by their first element (see `keys_of`).
+
+    If given, ``fill(store)`` writes the initial contents of the store, unless they
+    were already written (by this process or another one). It's called holding the
+    exclusive lock, so other processes don't see the store before it's filled.
+
+    >>> import uuid
+    >>> name = 'wip_qh_' + uuid.uuid4().hex[:8]
+    >>> s = SharedMemoryStore(name, size=2**16)
+    >>> s['fruit'] = {'apple': 1}
+    >>> other = SharedMemoryStore(name)  # (as another process would)
+    >>> other['fruit']
+    {'apple': 1}
+    >>> other['planets'] = [10, 20]
+    >>> del other['fruit']
+    >>> dict(s)
+    {'planets': [10, 20]}
+    >>> other.close(); s.unlink()
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        size: int = DFLT_SIZE,
+        lock_path: Optional[str] = None,
+        fill: Optional[Callable[['SharedMemoryStore'], None]] = None,
+    ):
+        self.name = name
+        self.lock_path = lock_path or _dflt_lock_path(name)
+        self._lock_file = open(self.lock_path, 'a+b')
+        self._tlock = threading.RLock()
+        self._locked = False
+        self._epoch = None
+        self._seen_end = _header.size
+        self._index = {}  # key -> (value offset, value length)
+        self._groups = {}  # first element of tuple keys -> {key: None}
+        with self._file_lock(fcntl.LOCK_EX):
+            self._shm, self.created = _attach(name, size)
+            self._buf = self._shm.buf
+            magic, *_ = _header.unpack_from(self._buf, 0)
+            if magic != _MAGIC:  # (a new segment)
+                capacity = self._shm.size
+                _header.pack_into(self._buf, 0, _MAGIC, 0, 0, capacity, _header.size)
+                self.created = True
+            if fill is not None and not self._is_ready():
+                self._clear()  # (of what an unfinished fill may have left)
+                fill(self)
+                struct.pack_into('<I', self._buf, _READY_OFFSET, 1)
+
+    # ---------------------------------------------------------------------------------
+    # Locking, and catching up with the log
+
+    @contextmanager
+    def _file_lock(self, op):
+        # (nested uses keep the outer lock: only `locked` and `fill` nest, holding the
+        # exclusive one)
+        with self._tlock:
+            outermost = not self._locked
+            if outermost:
+                fcntl.flock(self._lock_file.fileno(), op)
+                self._locked = True
+            try:
+                yield
+            finally:
+                if outermost:
+                    self._locked = False
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def locked(self):
+        """Hold the exclusive lock (to make several operations atomic)"""
+        return self._file_lock(fcntl.LOCK_EX)
+
+    def _read_header(self):
+        _, epoch, _, capacity, end = _header.unpack_from(self._buf, 0)
+        return epoch, capacity, end
+
+    def _is_ready(self) -> bool:
+        return bool(struct.unpack_from('<I', self._buf, _READY_OFFSET)[0])
+
+    def _clear(self):
+        """Drop all records (the caller holds the exclusive lock)"""
+        epoch, capacity, _ = self._read_header()
+        _header.pack_into(self._buf, 0, _MAGIC, epoch + 1, 0, capacity, _header.size)
+        self._catch_up()
+
+    def _forget(self, key):
+        if self._index.pop(key, None) is not None and isinstance(key, tuple):
+            group = self._groups.get(key[0])
+            if group is not None:
+                group.pop(key, None)
+                if not group:
+                    del self._groups[key[0]]
+
+    def _catch_up(self):
+        """Update the index with the records appended since (the caller holds a lock)"""
+        epoch, _, end = self._read_header()
+        if epoch != self._epoch:  # (compacted since: start over)
+            self._epoch, self._seen_end = epoch, _header.size
+            self._index, self._groups = {}, {}
+        buf, offset = self._buf, self._seen_end
+        while offset < end:
+            op, key_len, value_len = _record.unpack_from(buf, offset)
+            key_offset = offset + _record.size
+            key = _decode_key(bytes(buf[key_offset : key_offset + key_len]))
+            if op == _SET:
+                self._index[key] = (key_offset + key_len, value_len)
+                if isinstance(key, tuple):
+                    self._groups.setdefault(key[0], {})[key] = None
+            else:
+                self._forget(key)
+            offset = key_offset + key_len + value_len
+        self._seen_end = end
+
+    # ---------------------------------------------------------------------------------
+    # Writing
+
+    def _append(self, op, key_bytes: bytes, value_bytes: bytes = b''):
+        """Append a record (the caller holds the exclusive lock, and caught up)"""
+        _, capacity, end = self._read_header()
+        size = _record.size + len(key_bytes) + len(value_bytes)
+        if end + size > capacity:
+            end = self._compact(capacity, size)
+        _record.pack_into(self._buf, end, op, len(key_bytes), len(value_bytes))
+        start = end + _record.size
+        self._buf[start : start + len(key_bytes)] = key_bytes
+        start += len(key_bytes)
+        self._buf[start : start + len(value_bytes)] = value_bytes
+        # (the end is moved last, so that readers never see a partial record)
+        struct.pack_into('<Q', self._buf, _header.size - 8, end + size)
+
+    def _compact(self, capacity: int, room_for: int) -> int:
+        """Rewrite the live records at the start of the arena. Returns the new end."""
+        chunks = []
+        for key, (offset, length) in self._index.items():
+            key_bytes = _encode_key(key)
+            chunks.append(_record.pack(_SET, len(key_bytes), length))
+            chunks.append(key_bytes)
+            chunks.append(bytes(self._buf[offset : offset + length]))
+        live = b''.join(chunks)
+        if _header.size + len(live) + room_for > capacity:
+            raise SharedMemoryFull(
+                f"{len(live) + room_for} bytes don't fit in the {capacity} bytes "
+                f"of shared memory {self.name!r}"
+            )
+        epoch, _, _ = self._read_header()
+        end = _header.size + len(live)
+        self._buf[_header.size : end] = live
+        ready = int(self._is_ready())
+        _header.pack_into(self._buf, 0, _MAGIC, epoch + 1, ready, capacity, end)
+        self._catch_up()
+        return end
+
+    def __setitem__(self, key, value):
+        key_bytes, value_bytes = _encode_key(key), _encode_value(value)
+        with self._file_lock(fcntl.LOCK_EX):
+            self._catch_up()
+            self._append(_SET, key_bytes, value_bytes)
+            self._catch_up()
+
+    def __delitem__(self, key):
+        with self._file_lock(fcntl.LOCK_EX):
+            self._catch_up()
+            if key not in self._index:
+                raise KeyError(key)
+            self._append(_DELETE, _encode_key(key))
+            self._catch_up()
+
+    # ---------------------------------------------------------------------------------
+    # Reading
+
+    def __getitem__(self, key):
+        with self._file_lock(fcntl.LOCK_SH):
+            self._catch_up()
+            offset, length = self._index[key]
+            return json.loads(bytes(self._buf[offset : offset + length]))
+
+    def __contains__(self, key):
+        with self._file_lock(fcntl.LOCK_SH):
+            self._catch_up()
+            return key in self._index
+
+    def __iter__(self) -> Iterator:
+        with self._file_lock(fcntl.LOCK_SH):
+            self._catch_up()
+            return iter(list(self._index))
+
+    def __len__(self):
+        with self._file_lock(fcntl.LOCK_SH):
+            self._catch_up()
+            return len(self._index)
+
+    def keys_of(self, first) -> list:
+        """The tuple keys whose first element is `first`"""
+        with self._file_lock(fcntl.LOCK_SH):
+            self._catch_up()
+            return list(self._groups.get(first, ()))
+
+    def firsts(self) -> list:
+        """The first elements of the tuple keys"""
+        with self._file_lock(fcntl.LOCK_SH):
+            self._catch_up()
+            return list(self._groups)
+
+    def usage(self) -> dict:
+        with self._file_lock(fcntl.LOCK_SH):
+            epoch, capacity, end = self._read_header()
+            return {'epoch': epoch, 'capacity': capacity, 'used': end}
+
+    # ---------------------------------------------------------------------------------
+    # Life cycle
+
+    def close(self):
+        """Detach from the shared memory (which stays, for the other processes)"""
+        self._buf = None
+        self._shm.close()
+        self._lock_file.close()
+
+    def unlink(self):
+        """Detach from, and remove, the shared memory (when no process needs it)"""
+        self.close()
+        _resource_tracking(self._shm, 'register')  # (as unlink unregisters it)
+        self._shm.unlink()
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+
+# -------------------------------------------------------------------------------------
+# Malls
+
+
+class _SharedMemoryUserStore(MutableMapping):
+    def __init__(self, store: SharedMemoryStore, user):
+        self._store = store
+        self.user = user
+
+    def __getitem__(self, key):
+        return self._store[(self.user, key)]
+
+    def __setitem__(self, key, value):
+        # (checking the user still exists in the same lock, so that a store held on to
+        # doesn't resurrect keys of a deleted user)
+        with self._store.locked():
+            if (self.user, None) not in self._store:
+                raise KeyError(f"User {self.user!r} was deleted")
+            self._store[(self.user, key)] = value
+
+    def __delitem__(self, key):
+        del self._store[(self.user, key)]
+
+    def __iter__(self):
+        return (k for _, k in self._store.keys_of(self.user) if k is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        return (self.user, key) in self._store
+
+
+class SharedMemoryMall(MutableMapping):
+    """
+    A ``{user: store}`` mall, kept in a `SharedMemoryStore` (under ``(user, key)``
+    keys, and a ``(user, None)`` marker per user, so that empty users exist too).
+    The shared memory is filled with `initial`, unless it was already (by the process
+    that created it, which other processes wait for).
+
+    >>> import uuid
+    >>> name = 'wip_qh_' + uuid.uuid4().hex[:8]
+    >>> mall = SharedMemoryMall(name, size=2**16, initial={'alice': {'fruit': 1}})
+    >>> mall['alice']['planets'] = 2
+    >>> mall['bob'] = {}
+    >>> other = SharedMemoryMall(name, initial={'ignored': {}})  # (attached)
+    >>> sorted(other), dict(other['alice'])
+    (['alice', 'bob'], {'fruit': 1, 'planets': 2})
+    >>> other.close(); mall.unlink()
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        size: int = DFLT_SIZE,
+        initial: Optional[MutableMapping] = None,
+        lock_path: Optional[str] = None,
+    ):
+        fill = None if initial is None else partial(_fill_mall, initial=initial)
+        self.store = SharedMemoryStore(name, size=size, lock_path=lock_path, fill=fill)
+
+    def __getitem__(self, user) -> _SharedMemoryUserStore:
+        if (user, None) not in self.store:
+            raise KeyError(user)
+        return _SharedMemoryUserStore(self.store, user)
+
+    def __setitem__(self, user, user_store: MutableMapping):
+        user_store = dict(user_store)
+        with self.store.locked():
+            for key in self.store.keys_of(user):
+                if key[1] is not None and key[1] not in user_store:
+                    del self.store[key]
+            _fill_mall(self.store, {user: user_store})
+
+    def __delitem__(self, user):
+        with self.store.locked():
+            if (user, None) not in self.store:
+                raise KeyError(user)
+            for key in self.store.keys_of(user):
+                del self.store[key]
+
+    def __iter__(self):
+        return iter(self.store.firsts())
+
+    def __len__(self):
+        return len(self.store.firsts())
+
+    def __contains__(self, user):
+        return (user, None) in self.store
+
+    def close(self):
+        self.store.close()
+
+    def unlink(self):
+        self.store.unlink()
+
+
+def _fill_mall(store: SharedMemoryStore, initial: MutableMapping):
+    for user, user_store in initial.items():
+        store[(user, None)] = True
+        for key, value in user_store.items():
+            store[(user, key)] = value
+
+
+def shared_memory_mall_of_uri(uri: str, **kwargs) -> SharedMemoryMall:
+    """
+    The mall of a ``shm://<name>`` uri (a store factory for `register_store_uri`).
+
+    >>> shared_memory_mall_of_uri('file://nope')
+    Traceback (most recent call last):
+      ...
+    ValueError: Not a shared memory uri: file://nope
+    """
+    prefix = 'shm://'
+    if not uri.startswith(prefix):
+        raise ValueError(f"Not a shared memory uri: {uri}")
+    return SharedMemoryMall(uri[len(prefix) :], **kwargs)
@@ -0,0 +1,95 @@
+"""
+Test that the async routes (``fastapi_refactor_06``) await async stores natively.
+"""
+
+import asyncio
+import threading
+
+import httpx
+
+from wip_qh.fastapi_refactors import fastapi_refactor_00
+from wip_qh.fastapi_refactors.fastapi_refactor_06 import app
+
+
+class SlowAsyncStore:
+    """An async store with the latency of a network call (and no thread)"""
+
+    def __init__(self, data, latency=0.2):
+        self.data, self.latency = data, latency
+        self.in_flight = self.max_in_flight = 0
+
+    async def aget(self, key):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        return self.data[key]
+
+    async def aset(self, key, value):
+        await asyncio.sleep(self.latency)
+        self.data[key] = value
+
+    async def adelete(self, key):
+        await asyncio.sleep(self.latency)
+        del self.data[key]
+
+    async def aiter_keys(self):
+        await asyncio.sleep(self.latency)
+        for key in list(self.data):
+            yield key
+
+
+def test_concurrent_async_store_calls(monkeypatch):
+    store = SlowAsyncStore({'planets': {'earth': 30, 'venus': 20}})
+    monkeypatch.setattr(fastapi_refactor_00, 'async_store_getter', lambda u: store)
+
+    async def calls(n):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://t') as c:
+            gets = [
+                c.get('/store_get/alice', params={'key': 'planets', 'select': 'earth'})
+                for _ in range(n)
+            ]
+            return await asyncio.gather(*gets)
+
+    responses = asyncio.run(calls(300))
+    assert all(r.json() == {'earth': 30} for r in responses)
+    # (through a thread pool, there would be no more than its 40 threads' calls)
+    assert store.max_in_flight > 40, store.max_in_flight
+
+
+def _threads_getting_stores(monkeypatch, getter, *, is_default=False):
+    """The threads getter is called in, as the store_getter of the async routes,
+    and the thread of their loop"""
+    threads = []
+
+    def recording_getter(user):
+        threads.append(threading.get_ident())
+        return getter(user)
+
+    monkeypatch.setattr(fastapi_refactor_00, 'store_getter', recording_getter)
+    if is_default:
+        monkeypatch.setattr(fastapi_refactor_00, 'get_user_data', recording_getter)
+
+    async def call():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://t') as c:
+            assert (await c.get('/store_list/alice')).status_code == 200
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(call())
+    return threads, loop_thread
+
+
+def test_sync_store_getters_are_called_off_the_loop(monkeypatch):
+    getter = lambda user: {'planets': 1}
+    threads, loop_thread = _threads_getting_stores(monkeypatch, getter)
+    assert threads and loop_thread not in threads
+
+
+def test_in_memory_stores_are_got_on_the_loop(monkeypatch):
+    getter = fastapi_refactor_00.get_user_data  # (a backend_mall lookup)
+    threads, loop_thread = _threads_getting_stores(monkeypatch, getter, is_default=True)
+    assert threads == [loop_thread]
@@ -0,0 +1,73 @@
+"""
+Test the blob routes (`blob_routes`): streamed uploads and Range-aware downloads.
+"""
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from wip_qh.fastapi_refactors.blob_routes import add_blob_routes, FilesBlobStore
+
+
+def mk_client(stores: dict):
+    app = add_blob_routes(FastAPI(), store_getter=stores.__getitem__)
+    return TestClient(app)
+
+
+def test_streamed_upload_and_ranges(tmp_path):
+    client = mk_client({'alice': FilesBlobStore(str(tmp_path))})
+    data = bytes(range(256)) * 40
+
+    def chunks():  # (a streamed, chunked, request body)
+        for i in range(0, len(data), 1000):
+            yield data[i : i + 1000]
+
+    resp = client.post('/blob/store_set/alice', params={'key': 'b'}, content=chunks())
+    assert resp.json()['size'] == len(data)
+    assert (tmp_path / 'b').read_bytes() == data
+
+    url, params = '/blob/store_get/alice', {'key': 'b'}
+    resp = client.get(url, params=params)
+    assert resp.status_code == 200 and resp.content == data
+    assert resp.headers['accept-ranges'] == 'bytes'
+
+    resp = client.get(url, params=params, headers={'range': 'bytes=10-19'})
+    assert resp.status_code == 206 and resp.content == data[10:20]
+    assert resp.headers['content-range'] == f"bytes 10-19/{len(data)}"
+    resp = client.get(url, params=params, headers={'range': 'bytes=-5'})
+    assert resp.content == data[-5:]
+
+    resp = client.get(url, params=params, headers={'range': f'bytes={len(data)}-'})
+    assert resp.status_code == 416
+    assert resp.headers['content-range'] == f"bytes */{len(data)}"
+
+
+def test_errors(tmp_path):
+    client = mk_client({'alice': FilesBlobStore(str(tmp_path)), 'bob': {}})
+    assert client.get('/blob/store_get/nobody', params={'key': 'b'}).status_code == 404
+    assert client.post('/blob/store_set/nobody', params={'key': 'b'}).status_code == 404
+    assert client.get('/blob/store_get/alice', params={'key': 'b'}).status_code == 404
+    bad = {'key': '.hidden'}
+    assert client.post('/blob/store_set/alice', params=bad).status_code == 400
+    assert client.get('/blob/store_get/alice', params=bad).status_code == 400
+
+
+def test_mapping_stores():
+    stores = {'bob': {'fruit': {'apple': 1}}}
+    client = mk_client(stores)
+    client.post('/blob/store_set/bob', params={'key': 'k'}, content=b'raw bytes')
+    assert stores['bob']['k'] == b'raw bytes'
+    resp = client.get('/blob/store_get/bob', params={'key': 'fruit'})
+    assert resp.content == b'{"apple":1}'  # (JSON values are read as JSON)
+
+
+def test_blob_routes_are_served():
+    from wip_qh.fastapi_refactors.fastapi_refactor_00 import (
+        backend_mall,
+        reset_backend_mall,
+    )
+    from wip_qh.fastapi_refactors.fastapi_refactor_03 import app
+
+    reset_backend_mall(backend_mall)
+    client = TestClient(app)
+    resp = client.get('/blob/store_get/alice', params={'key': 'fruit'})
+    assert resp.status_code == 200
@@ -0,0 +1,69 @@
+"""
+Test the SSE change feed of the writes made through an observed mall.
+"""
+
+import asyncio
+import threading
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from wip_qh.fastapi_refactors.observed_mall import ObservedMall
+from wip_qh.fastapi_refactors.change_feed import ChangeFeed, add_change_feed_route
+
+
+def test_change_feed_resumes_from_last_event_id():
+    mall = ObservedMall({'alice': {}, 'bob': {}})
+    feed = mall.add_observer(ChangeFeed())
+    client = TestClient(add_change_feed_route(FastAPI(), feed))
+
+    mall['alice']['fruit'] = {'apple': 1}
+    mall['bob']['cars'] = 1
+    mall['alice']['planets'] = 2
+    del mall['alice']['fruit']
+
+    response = client.get('/changes/alice?limit=2', headers={'Last-Event-ID': '1'})
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert response.text == (
+        'id: 3\nevent: set\n'
+        'data: {"seq": 3, "user": "alice", "key": "planets", "value": 2}\n\n'
+        'id: 4\nevent: delete\n'
+        'data: {"seq": 4, "user": "alice", "key": "fruit"}\n\n'
+    )
+    # unknown event ids get a gap event (the client should reload its data)
+    response = client.get('/changes/alice?last_event_id=99')
+    assert response.text.startswith('event: gap\n')
+
+
+def test_change_feed_delivers_live_writes_from_other_threads():
+    mall = ObservedMall({'alice': {}})
+    feed = mall.add_observer(ChangeFeed())
+
+    async def first_two_events():
+        stream = feed.sse_stream('alice', prefix='pl', limit=2)
+        first = asyncio.ensure_future(stream.__anext__())
+        while not feed._subscribers:  # (wait for the stream to subscribe)
+            await asyncio.sleep(0)
+
+        def write():
+            mall['alice']['fruit'] = 1  # (filtered out by the prefix)
+            mall['alice']['planets'] = 2
+            mall['alice']['plums'] = 3
+
+        threading.Thread(target=write).start()
+        return [await first, await stream.__anext__()]
+
+    events = asyncio.run(first_two_events())
+    assert [e.split('\n')[0] for e in events] == ['id: 2', 'id: 3']
+
+
+def test_subscribers_of_closed_loops_are_dropped():
+    mall = ObservedMall({'alice': {}})
+    feed = mall.add_observer(ChangeFeed())
+
+    async def subscribe():
+        feed.subscribe('alice')  # (and never unsubscribe)
+
+    asyncio.run(subscribe())  # (closes the loop)
+    mall['alice']['fruit'] = 1  # doesn't fail on the closed loop
+    assert not feed._subscribers
+    assert [e.seq for e in feed.events_since(0)] == [1]
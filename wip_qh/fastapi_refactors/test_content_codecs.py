@@ -0,0 +1,90 @@
+"""
+Test the content codecs (`wip_qh.content_codecs`) and the Accept-negotiated routes of
+`fast_api_app(..., codecs=...)`.
+"""
+
+import asyncio
+import datetime
+
+import numpy as np
+from fastapi import Body
+from fastapi.testclient import TestClient
+
+from wip_qh.content_codecs import (
+    codecs,
+    json_codec,
+    ndarray_codec,
+    negotiate,
+    JSON_MIMETYPE,
+    NDARRAY_MIMETYPE,
+)
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import (
+    fast_api_app,
+    BuffersResponse,
+)
+
+
+def test_codec_round_trips():
+    value = {'apple': [1, 2.5, None], 'nested': {'a': 'é'}}
+    assert json_codec.decode(json_codec.encode(value)) == value
+
+    for arr in [np.arange(12, dtype='float32').reshape(3, 4), np.array([1, -2, 3])]:
+        chunks = ndarray_codec.encode_chunks(arr)
+        assert isinstance(chunks[1], memoryview)  # (the array's memory, not a copy)
+        decoded = ndarray_codec.decode(ndarray_codec.encode(arr))
+        assert decoded.dtype == arr.dtype and np.array_equal(decoded, arr)
+
+    assert negotiate(NDARRAY_MIMETYPE, np.arange(3)) is ndarray_codec
+    assert negotiate(f'{NDARRAY_MIMETYPE};q=0.5, {JSON_MIMETYPE}', np.arange(3)) is (
+        json_codec
+    )
+
+
+def arange(n: int):
+    return np.arange(n, dtype='int64')
+
+
+def total(arr=Body()):
+    return float(np.sum(arr))
+
+
+def today():
+    return {'date': datetime.date(2024, 1, 2)}
+
+
+route_specs = {
+    arange: {'api_route_kwargs': {'methods': 'get'}},
+    total: {'api_route_kwargs': {'methods': 'post'}, 'defaults': {'arr': Body()}},
+    today: {'api_route_kwargs': {'methods': 'get'}},
+}
+
+
+def test_ndarray_routes():
+    client = TestClient(fast_api_app(route_specs, codecs=codecs))
+
+    resp = client.get('/arange', params={'n': 5}, headers={'accept': NDARRAY_MIMETYPE})
+    assert resp.headers['content-type'] == NDARRAY_MIMETYPE
+    assert resp.headers['content-length'] == str(len(resp.content))
+    assert np.array_equal(ndarray_codec.decode(resp.content), np.arange(5))
+    assert client.get('/arange', params={'n': 3}).json() == [0, 1, 2]
+
+    body = ndarray_codec.encode(np.arange(4.0))
+    headers = {'content-type': NDARRAY_MIMETYPE}
+    assert client.post('/total', content=body, headers=headers).json() == 6.0
+    assert client.post('/total', json=[1, 2]).json() == 3.0
+
+    # outputs json.dumps can't encode itself are encoded as FastAPI would
+    assert client.get('/today').json() == {'date': '2024-01-02'}
+
+
+def test_buffers_response_sends_bytes():
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    response = BuffersResponse(ndarray_codec.encode_chunks(np.arange(3)))
+    asyncio.run(response({'type': 'http'}, None, send))
+    bodies = [m['body'] for m in messages if m['type'] == 'http.response.body']
+    assert all(type(body) is bytes for body in bodies)
+    assert np.array_equal(ndarray_codec.decode(b''.join(bodies)), np.arange(3))
@@ -0,0 +1,84 @@
+"""
+Test the per-route deadlines (``"deadline"`` in route specs).
+"""
+
+import time
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from wip_qh import deadlines
+from wip_qh.deadlines import call_with_deadline
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+cancelled = []
+
+
+async def slow_async(secs: float = 1.0):
+    try:
+        await asyncio.sleep(secs)
+    except asyncio.CancelledError:
+        cancelled.append(secs)
+        raise
+    return 'done'
+
+
+def slow_sync(secs: float = 1.0):
+    time.sleep(secs)
+    return 'done'
+
+
+def no_deadline(secs: float = 1.0):
+    time.sleep(secs)
+    return 'done'
+
+
+def mk_app():
+    return fast_api_app(
+        {
+            slow_async: {'deadline': 0.1},
+            slow_sync: {'deadline': 5},
+            no_deadline: {'deadline': None},
+        }
+    )
+
+
+def test_deadlines():
+    client = TestClient(mk_app())
+
+    assert client.get('/slow_async?secs=0.01').json() == 'done'
+    tic = time.perf_counter()
+    resp = client.get('/slow_async?secs=2')
+    assert resp.status_code == 504
+    assert time.perf_counter() - tic < 1
+    assert cancelled == [2.0]  # async functions are really cancelled
+
+    # the client asks for a shorter deadline
+    assert client.get('/slow_sync?secs=0.3').json() == 'done'
+    tic = time.perf_counter()
+    resp = client.get('/slow_sync?secs=2', headers={'x-deadline-ms': '100'})
+    assert resp.status_code == 504
+    assert time.perf_counter() - tic < 1
+
+    # routes without a deadline ignore the header
+    resp = client.get('/no_deadline?secs=0.2', headers={'x-deadline-ms': '10'})
+    assert resp.json() == 'done'
+
+
+def test_deadline_pool_full(monkeypatch):
+    monkeypatch.setattr(deadlines, '_free_threads', threading.BoundedSemaphore(1))
+    deadlines._free_threads.acquire()  # (the only thread is taken)
+    resp = TestClient(mk_app()).get('/slow_sync?secs=0')
+    assert resp.status_code == 503
+    with pytest.raises(deadlines.DeadlinePoolFull):
+        call_with_deadline(slow_sync, {'secs': 0}, timeout=1)
+
+
+def test_call_with_deadline_in_a_running_loop():
+    async def main():
+        # (a sync function calling call_with_deadline, from an event loop's thread)
+        return call_with_deadline(slow_async, {'secs': 0}, timeout=1)
+
+    assert asyncio.run(main()) == 'done'
@@ -0,0 +1,57 @@
+"""
+Test restoring a durable mall after a crash (no close, torn last journal line).
+"""
+
+import os
+import glob
+
+import pytest
+
+from wip_qh.fastapi_refactors.durable_mall import DurableMall
+
+
+def test_restore_after_crash(tmp_path):
+    rootdir = str(tmp_path)
+    mall = DurableMall(rootdir, fsync='always', snapshot_every=None)
+    mall['alice'] = {'fruit': 1}
+    mall['alice']['planets'] = 2
+    mall['alice']['fruit'] = 10
+    mall.snapshot()
+    mall['bob'] = {'cars': 3}
+    del mall['alice']['planets']
+
+    # the process dies mid-write, leaving a torn line at the end of the journal
+    last_journal = sorted(glob.glob(os.path.join(rootdir, 'journal.*.jsonl')))[-1]
+    with open(last_journal, 'ab') as f:
+        f.write(b'{"u":"bob","k":"ca')
+
+    restored = DurableMall(rootdir)
+    assert restored.to_dict() == {'alice': {'fruit': 10}, 'bob': {'cars': 3}}
+    assert len(glob.glob(os.path.join(rootdir, 'snapshot.*.json'))) == 1
+    restored.close()
+
+
+def test_unjournalable_writes_leave_the_mall_unchanged(tmp_path):
+    rootdir = str(tmp_path)
+    mall = DurableMall(rootdir, fsync='never', initial={'alice': {'fruit': 1}})
+    with pytest.raises(TypeError):
+        mall['alice']['fruit'] = {1, 2}  # (not JSON)
+    with pytest.raises(TypeError):
+        mall['bob'] = {'cars': object()}
+    with pytest.raises(KeyError):
+        del mall['alice']['planets']
+    assert mall.to_dict() == {'alice': {'fruit': 1}}
+    mall.close()
+    assert DurableMall(rootdir).to_dict() == {'alice': {'fruit': 1}}
+
+
+def test_new_files_are_synced_with_their_directory(tmp_path, monkeypatch):
+    from wip_qh.fastapi_refactors import durable_mall
+
+    synced_dirs = []
+    monkeypatch.setattr(durable_mall, '_fsync_dir', synced_dirs.append)
+    mall = DurableMall(str(tmp_path), fsync='always', snapshot_every=None)
+    assert synced_dirs == [str(tmp_path)]  # (the new journal)
+    mall.snapshot()  # (a new journal, then the snapshot's rename)
+    assert synced_dirs == [str(tmp_path)] * 3
+    mall.close()
@@ -0,0 +1,93 @@
+"""
+Test the routes whose output is declared JSON (``"output"`` in route specs).
+"""
+
+import pytest
+from fastapi import routing
+from fastapi.testclient import TestClient
+
+from wip_qh.fastapi_refactors import fastapi_refactor_00
+from wip_qh.fastapi_refactors.fastapi_refactor_00 import (
+    backend_mall,
+    reset_backend_mall,
+    get_store_value,
+    set_store_value,
+)
+from wip_qh.fastapi_refactors.fastapi_refactor_03 import route_specs
+from wip_qh.fastapi_refactors.encoded_store import JSONEncodedMall
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+
+def store_value_bytes(user: str, key: str):
+    return b'{"raw":true}'
+
+
+def test_encoded_output(monkeypatch):
+    reset_backend_mall(backend_mall)
+    specs = {**route_specs, store_value_bytes: {'output': 'encoded'}}
+    client = TestClient(fast_api_app(specs))
+
+    encoder_calls = []
+    encoder = routing.jsonable_encoder
+    monkeypatch.setattr(
+        routing,
+        'jsonable_encoder',
+        lambda *a, **k: encoder_calls.append(a) or encoder(*a, **k),
+    )
+    resp = client.get('/store_get/alice?key=fruit')
+    assert resp.json() == backend_mall['alice']['fruit']
+    assert resp.headers['content-type'] == 'application/json'
+    assert client.get('/store_value_bytes?user=a&key=b').json() == {'raw': True}
+    assert encoder_calls == []  # (FastAPI's encoding was skipped)
+
+    # with a mall keeping its values encoded
+    mall = JSONEncodedMall(backend_mall)
+    monkeypatch.setattr(fastapi_refactor_00, 'store_getter', mall.__getitem__)
+    resp = client.post('/store_set/bob?key=nested', json={'value': {'a': [1, {}]}})
+    assert resp.status_code == 200
+    assert backend_mall['bob']['nested'] == b'{"a":[1,{}]}'
+    assert client.get('/store_get/bob?key=nested').json() == {'a': [1, {}]}
+    reset_backend_mall(backend_mall)
+
+
+def test_declared_output_still_negotiates():
+    import numpy as np
+    from wip_qh.content_codecs import codecs, ndarray_codec, NDARRAY_MIMETYPE
+
+    def arange(n: int):
+        return np.arange(n)
+
+    specs = {arange: {'output': 'json'}, store_value_bytes: {'output': 'encoded'}}
+    client = TestClient(fast_api_app(specs, codecs=codecs))
+    resp = client.get('/arange?n=3', headers={'accept': NDARRAY_MIMETYPE})
+    assert resp.headers['content-type'] == NDARRAY_MIMETYPE
+    assert ndarray_codec.decode(resp.content).tolist() == [0, 1, 2]
+    resp = client.get('/arange?n=3')
+    assert resp.headers['content-type'] == 'application/json'
+    assert resp.json() == [0, 1, 2]
+    assert client.get('/store_value_bytes?user=a&key=b').content == b'{"raw":true}'
+
+
+def test_encoded_store_reads_do_not_write_nor_parse(monkeypatch):
+    from wip_qh.fastapi_refactors import encoded_store
+    from wip_qh.fastapi_refactors.encoded_store import JSONEncodedStore
+
+    backend = {'fruit': {'apple': 1}, 'json': b'[1, 2]', 'raw': b'\xff\x00raw'}
+    store = JSONEncodedStore(backend)
+    assert store['fruit'] == b'{"apple":1}' and backend['fruit'] == {'apple': 1}
+    store['planets'] = {'earth': 30}
+    backend['planets'] = bytes(backend['planets'])  # (as a persistent store gives)
+
+    def no_parsing(*args, **kwargs):
+        raise AssertionError("Parsed on the read path")
+
+    monkeypatch.setattr(encoded_store.json, 'loads', no_parsing)
+    assert store['planets'] == b'{"earth":30}'
+    assert store['json'] == b'[1, 2]'
+    monkeypatch.undo()
+    assert store.decoded('json') == [1, 2]
+
+    # stores that also hold other bytes say so
+    raw_store = JSONEncodedStore(backend, bytes_are_json=False)
+    with pytest.raises(TypeError):  # (not taken for JSON, and not encodable)
+        raw_store['raw']
@@ -0,0 +1,90 @@
+"""
+Test the job routes of `fast_api_app(..., jobs=runner)`: submit, poll, fetch, cancel.
+"""
+
+import time
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from wip_qh.jobs import JobRunner, SQLiteJobStore
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+
+def add(x: int, y: int = 1):
+    return x + y
+
+
+async def nap(secs: float):
+    await asyncio.sleep(secs)
+    return 'rested'
+
+
+route_specs = {
+    add: {"api_route_kwargs": {"methods": 'post', "path": '/add'}},
+    nap: {"api_route_kwargs": {"methods": 'post', "path": '/nap'}},
+}
+
+
+def _poll_result(client, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        resp = client.get(f'/jobs/{job_id}/result')
+        if resp.status_code != 202 or time.monotonic() > deadline:
+            return resp
+        time.sleep(0.01)
+
+
+def test_job_routes(tmp_path):
+    runner = JobRunner(store=SQLiteJobStore(str(tmp_path / 'jobs.db')))
+    client = TestClient(fast_api_app(route_specs, jobs=runner))
+
+    resp = client.post('/jobs/add', json={'x': 2, 'y': 3})
+    assert resp.status_code == 202
+    job = resp.json()
+    assert resp.headers['location'] == f"/jobs/{job['id']}"
+    assert job['status'] in ('queued', 'running', 'succeeded')
+    assert _poll_result(client, job['id']).json() == 5
+    assert client.get(f"/jobs/{job['id']}").json()['status'] == 'succeeded'
+    assert client.delete(f"/jobs/{job['id']}").status_code == 409  # (finished)
+
+    resp = client.post('/jobs/add', json={'x': '2'})  # (converted, as in routes)
+    assert _poll_result(client, resp.json()['id']).json() == 3
+    assert client.post('/jobs/add', json={'y': 3}).status_code == 422
+    assert client.post('/jobs/add', json=[1]).status_code == 422
+    assert client.post('/jobs/add', content=b'{"x": ').status_code == 400
+    assert client.post('/jobs/nope', json={}).status_code == 404
+    assert client.get('/jobs/nope').status_code == 404
+
+    job_id = client.post('/jobs/nap', json={'secs': 10}).json()['id']
+    tic = time.perf_counter()
+    assert client.delete(f'/jobs/{job_id}').status_code == 200
+    assert _poll_result(client, job_id).status_code == 410
+    runner.shutdown()  # (the async job was cancelled, so this doesn't wait for it)
+    assert time.perf_counter() - tic < 2
+
+
+def test_max_pending_jobs():
+    runner = JobRunner(max_pending=1)
+    client = TestClient(fast_api_app(route_specs, jobs=runner))
+    job_id = client.post('/jobs/nap', json={'secs': 10}).json()['id']
+    resp = client.post('/jobs/nap', json={'secs': 0})
+    assert resp.status_code == 429
+    client.delete(f'/jobs/{job_id}')
+    deadline = time.monotonic() + 5  # (until the cancelled job's worker is freed)
+    while resp.status_code == 429 and time.monotonic() < deadline:
+        time.sleep(0.01)
+        resp = client.post('/jobs/nap', json={'secs': 0})
+    assert resp.status_code == 202
+    runner.shutdown()
+
+
+def test_job_retention():
+    runner = JobRunner({'add': add}, max_jobs=2)
+    for i in range(4):
+        runner.wait(runner.submit('add', {'x': i}).id)
+    assert len(runner.store) == 3  # (purged at submission: the last 2, and the new)
+    runner.retention = 0
+    assert runner.purge() == 3
+    assert len(runner.store) == 0
+    runner.shutdown()
@@ -0,0 +1,105 @@
+"""
+Test the lean ASGI engine (`utils_for_fastapi_refactor_05`) and its FastAPI fallback.
+"""
+
+import time
+import datetime
+
+from fastapi import Body, Header, Query
+from fastapi.testclient import TestClient
+
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_05 import (
+    asgi_app,
+    LeanASGIApp,
+)
+
+
+def add(a: int, b: int = 2):
+    return a + b
+
+
+def greet(greeting: str, name: str = 'world'):
+    return f"{greeting}, {name}!"
+
+
+def echo(payload=None):
+    return payload
+
+
+def today():
+    return datetime.date(2024, 1, 2)
+
+
+def agent(user_agent: str = None):  # (needs a Header: served by FastAPI)
+    return user_agent
+
+
+def remove(key: str):  # (same path as greet, another method)
+    return f"removed {key}"
+
+
+def replace(key: str, user_agent: str = None):  # (same path, served by FastAPI)
+    return f"replaced {key}"
+
+
+route_specs = {
+    add: {'defaults': {'b': Query(2)}},
+    greet: {'api_route_kwargs': {'methods': 'get', 'path': '/greeter/{greeting}'}},
+    echo: {'api_route_kwargs': {'methods': 'post'}, 'defaults': {'payload': Body()}},
+    today: {'api_route_kwargs': {'methods': 'get'}},
+    agent: {
+        'api_route_kwargs': {'methods': 'get'},
+        'defaults': {'user_agent': Header(None)},
+    },
+    remove: {'api_route_kwargs': {'methods': 'delete', 'path': '/greeter/{key}'}},
+    replace: {
+        'api_route_kwargs': {'methods': 'put', 'path': '/greeter/{key}'},
+        'defaults': {'user_agent': Header(None)},
+    },
+}
+
+
+def test_lean_routes():
+    app = asgi_app(route_specs)
+    assert isinstance(app, LeanASGIApp)
+    assert {r.func for r in app.routes} == {add, greet, echo, today, remove}
+    client = TestClient(app)
+
+    assert client.get('/add', params={'a': 1, 'b': 3}).json() == 4
+    assert client.post('/add', params={'a': 1}).json() == 3
+    assert client.get('/greeter/Hi', params={'name': 'you'}).json() == 'Hi, you!'
+    assert client.post('/echo', json={'a': [1, 2]}).json() == {'a': [1, 2]}
+    assert client.get('/today').json() == '2024-01-02'  # (encoded as FastAPI would)
+
+    resp = client.get('/add', params={'a': 'one'})
+    assert resp.status_code == 422
+    assert resp.json()['detail'][0]['loc'] == ['query', 'a']
+    assert client.post('/echo', content=b'{"a": ').status_code == 422
+
+
+def test_fallback():
+    client = TestClient(asgi_app(route_specs))
+    assert client.get('/agent', headers={'user-agent': 'me'}).json() == 'me'
+    assert client.delete('/greeter/apple').json() == 'removed apple'
+    assert client.put('/greeter/apple').json() == 'replaced apple'
+    assert client.get('/nope').status_code == 404
+
+
+def test_without_fallback():
+    client = TestClient(asgi_app({add: {}}))
+    assert client.get('/nope').status_code == 404
+    assert client.delete('/add').status_code == 405
+
+
+def slow(seconds: float = 0.5):
+    time.sleep(seconds)
+    return seconds
+
+
+def test_specs_the_lean_engine_does_not_implement_fall_back():
+    app = asgi_app({slow: {'deadline': 0.1, 'cache': 60}, add: {'output': 'json'}})
+    assert [r.func for r in app.routes] == [add]  # (slow is served by FastAPI)
+    client = TestClient(app)
+    assert client.get('/slow').status_code == 504
+    assert client.get('/slow', params={'seconds': 0.01}).json() == 0.01
+    assert client.get('/add', params={'a': 1}).json() == 3
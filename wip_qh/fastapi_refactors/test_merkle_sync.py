@@ -0,0 +1,72 @@
+"""
+Test syncing a mall from a remote replica, through the sync routes.
+"""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from wip_qh.fastapi_refactors.merkle_sync import (
+    LocalReplica,
+    HttpReplica,
+    add_sync_routes,
+    sync,
+)
+
+
+def test_sync_over_http_only_ships_differences():
+    remote = LocalReplica.of_mall(
+        {'alice': {'fruit': {'apple': 1}, 'planets': [1, 2]}, 'bob': {'cars': 3}}
+    )
+    client = TestClient(add_sync_routes(FastAPI(), remote))
+    local = LocalReplica.of_mall(
+        {'alice': {'fruit': {'apple': 1}, 'planets': [1]}, 'carol': {'x': 1}}
+    )
+
+    report = sync(local, HttpReplica(client=client))
+    assert report.set == [('alice', 'planets'), ('bob', 'cars')]
+    assert report.deleted == [('carol', 'x')]
+    assert local.root_digest() == remote.root_digest()
+    assert client.get('/sync/root').json() == {'digest': local.root_digest()}
+
+    # writes to the remote's (observed) mall update its digests
+    remote.mall['bob']['cars'] = 4
+    assert local.root_digest() != remote.root_digest()
+    assert sync(local, HttpReplica(client=client)).set == [('bob', 'cars')]
+    assert local.mall['bob']['cars'] == 4
+
+
+def test_empty_users_do_not_change_digests():
+    with_empty = LocalReplica.of_mall({'alice': {'x': 1}, 'dave': {}})
+    without = LocalReplica.of_mall({'alice': {'x': 1}})
+    assert with_empty.root_digest() == without.root_digest()
+    assert sync(with_empty, without).users_compared == 0
+
+    # and emptying a user (key by key) gets the same digests as never having it
+    without.mall['erin'] = {'y': 2}
+    del without.mall['erin']['y']
+    assert without.root_digest() == with_empty.root_digest()
+
+
+def test_non_json_values_are_rejected():
+    with pytest.raises(TypeError):
+        LocalReplica.of_mall({'alice': {'x': {1, 2}}})
+    replica = LocalReplica.of_mall({'alice': {'x': 1}})
+    root = replica.root_digest()
+    with pytest.raises(TypeError):
+        replica.mall['alice']['x'] = object()
+    with pytest.raises(TypeError):
+        replica.mall['bob'] = {'y': 1, 'x': object()}
+    # (rejected before being written: the data and its digests still agree)
+    assert replica.mall['alice']['x'] == 1 and 'bob' not in replica.mall
+    assert replica.root_digest() == root
+
+
+def test_pull_only_from_peers():
+    replica = LocalReplica.of_mall({'alice': {'x': 1}})
+    client = TestClient(add_sync_routes(FastAPI(), replica))
+    assert client.post('/sync/pull', json={'url': 'http://peer'}).status_code == 404
+
+    app = add_sync_routes(FastAPI(), replica, peers=['http://peer:8000/'])
+    response = TestClient(app).post('/sync/pull', json={'url': 'http://169.254.0.1'})
+    assert response.status_code == 403
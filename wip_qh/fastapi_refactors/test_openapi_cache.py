@@ -0,0 +1,88 @@
+"""
+Test that the OpenAPI schema is precomputed, and cached on disk, by keys of what it is
+made of.
+"""
+
+from fastapi.testclient import TestClient
+from pydantic import create_model
+
+from wip_qh.fastapi_refactors.fastapi_refactor_03 import route_specs
+from wip_qh.fastapi_refactors.openapi_cache import openapi_cache_key
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+
+def test_precomputed_openapi(tmp_path):
+    app = fast_api_app(route_specs, openapi_cache_dir=str(tmp_path))
+    with TestClient(app) as client:  # (runs the startup event)
+        assert app.openapi_schema is not None  # computed at startup
+        assert len(list(tmp_path.iterdir())) == 1
+        resp = client.get('/openapi.json')
+        assert resp.headers['content-type'] == 'application/json'
+        schema = resp.json()
+        assert '/store_get/{user}' in schema['paths']
+        assert client.get('/docs').status_code == 200
+
+    # another instance of the same app loads it (without generating it)
+    other = fast_api_app(route_specs, openapi_cache_dir=str(tmp_path))
+    assert openapi_cache_key(other) == openapi_cache_key(app)
+    other.openapi = None  # (it would fail, if called)
+    assert TestClient(other).get('/openapi.json').json() == schema
+
+    # a different app gets a different key
+    specs = dict(list(route_specs.items())[:2])
+    assert openapi_cache_key(fast_api_app(specs)) != openapi_cache_key(app)
+
+
+Item = create_model('Item', name=(str, ...))
+PricedItem = create_model('Item', name=(str, ...), price=(float, ...))
+
+
+def _key_of(func, **api_route_kwargs):
+    api_route_kwargs = {'methods': 'post', 'path': '/items', **api_route_kwargs}
+    return openapi_cache_key(
+        fast_api_app({func: {'api_route_kwargs': api_route_kwargs}})
+    )
+
+
+def test_keys_cover_what_the_schema_is_made_of():
+    def add_item(item: Item):
+        """Add an item"""
+        return item
+
+    key = _key_of(add_item)
+    assert _key_of(add_item) == key
+
+    def add_item(item: Item):
+        """Add an item to the basket"""
+        return item
+
+    assert _key_of(add_item) != key  # (another description)
+
+    def add_item(item: PricedItem):
+        """Add an item"""
+        return item
+
+    assert _key_of(add_item) != key  # (same signature string, other fields)
+
+    def add_item(item: Item):
+        """Add an item"""
+        return item
+
+    assert _key_of(add_item) == key
+    for api_route_kwargs in [
+        {'response_model': Item},
+        {'tags': ['items']},
+        {'summary': 'Add'},
+        {'responses': {404: {'description': 'No basket'}}},
+    ]:
+        assert _key_of(add_item, **api_route_kwargs) != key, api_route_kwargs
+
+
+def test_servers_of_the_root_path():
+    app = fast_api_app(route_specs)
+    schema = TestClient(app).get('/openapi.json').json()
+    assert 'servers' not in schema
+    behind_proxy = TestClient(app, root_path='/api/v1')
+    schema = behind_proxy.get('/openapi.json').json()
+    assert schema['servers'] == [{'url': '/api/v1'}]
+    assert 'servers' not in TestClient(app).get('/openapi.json').json()
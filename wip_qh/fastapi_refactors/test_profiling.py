@@ -0,0 +1,47 @@
+"""
+Test the on-demand profiling of FastAPI endpoints (see `wip_qh.profiling`).
+"""
+
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from wip_qh.profiling import RequestProfiler
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+
+def crunch(n: int):
+    return sum(i * i for i in range(n))
+
+
+def sync_crunch(n: int = 1000):
+    return crunch(n)
+
+
+async def async_crunch(n: int = 1000):
+    await asyncio.sleep(0)
+    return crunch(n)
+
+
+route_specs = {sync_crunch: {}, async_crunch: {}}
+
+
+def test_profiled_endpoints(tmp_path):
+    profiler = RequestProfiler(output_dir=str(tmp_path), token='s3cret')
+    client = TestClient(fast_api_app(route_specs, profiler=profiler))
+    opt_in = {'x-profile': '1', 'x-profile-token': 's3cret'}
+
+    # no token (or a wrong one): not profiled
+    assert client.get('/sync_crunch', headers={'x-profile': '1'}).json() == 332833500
+    client.get('/sync_crunch', headers={**opt_in, 'x-profile-token': 'guess'})
+    assert list(tmp_path.iterdir()) == []
+
+    for name in ['sync_crunch', 'async_crunch']:
+        assert client.get(f'/{name}', headers=opt_in).json() == 332833500
+        [filepath] = tmp_path.glob(f'*-{name}-*.folded')
+        stacks = filepath.read_text()
+        assert ':crunch:' in stacks  # (the endpoint's work)
+        assert 'routing.py' in stacks  # (and the request's, around it)
+
+    client.get('/async_crunch', headers={**opt_in, 'x-profile': 'pstats'})
+    assert len(list(tmp_path.glob('*-async_crunch-*.prof'))) == 1
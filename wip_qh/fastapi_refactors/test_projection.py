@@ -0,0 +1,73 @@
+"""
+Test the projection pushdown of ``store_get`` (its ``select`` parameter).
+"""
+
+from fastapi.testclient import TestClient
+
+from wip_qh.fastapi_refactors import fastapi_refactor_00
+from wip_qh.fastapi_refactors.fastapi_refactor_00 import (
+    backend_mall,
+    reset_backend_mall,
+)
+from wip_qh.fastapi_refactors.fastapi_refactor_03 import app
+from wip_qh.fastapi_refactors.encoded_store import JSONEncodedMall
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_05 import asgi_app
+
+
+class SelectingStore(dict):
+    """A store that does its own projections (and records them)"""
+
+    selected = []
+
+    def select(self, key, paths):
+        self.selected.append((key, paths))
+        return {path[-1]: 'selected' for path in paths}
+
+
+def test_select(monkeypatch):
+    reset_backend_mall(backend_mall)
+    client = TestClient(app)
+
+    resp = client.get('/store_get/alice?key=planets&select=earth,venus')
+    assert resp.json() == {'earth': 30, 'venus': 20}
+    assert client.get('/store_get/alice?key=planets').json() == {
+        'mercury': 10,
+        'venus': 20,
+        'earth': 30,
+    }
+
+    # stores keeping their values encoded
+    mall = JSONEncodedMall(backend_mall)
+    monkeypatch.setattr(fastapi_refactor_00, 'store_getter', mall.__getitem__)
+    resp = client.get('/store_get/bob?key=food&select=carrot')
+    assert resp.json() == {'carrot': 3}
+
+    # stores with a select method do the projection
+    store = SelectingStore(planets={'earth': 30})
+    monkeypatch.setattr(fastapi_refactor_00, 'store_getter', lambda user: store)
+    resp = client.get('/store_get/alice?key=planets&select=earth')
+    assert resp.json() == {'earth': 'selected'}
+    assert store.selected == [('planets', (('earth',),))]
+
+
+def test_invalid_selections_are_client_errors(monkeypatch):
+    store = {'planets': {'earth': 30}, 'rows': [{'a': 1}, {'a': 2}]}
+    monkeypatch.setattr(fastapi_refactor_00, 'store_getter', lambda user: store)
+    client = TestClient(app)
+
+    def get(key, select):
+        return client.get('/store_get/alice', params={'key': key, 'select': select})
+
+    assert get('rows', '1.a').json() == [{'a': 2}]
+    for key, select in [
+        ('planets', ' , '),  # empty
+        ('rows', 'first.a'),  # not a list index
+        ('planets', 'earth.moons'),  # into a number
+    ]:
+        resp = get(key, select)
+        assert resp.status_code == 400, (key, select)
+        assert resp.json()['detail']
+    # (the lean engine answers them the same way)
+    lean_client = TestClient(asgi_app({fastapi_refactor_00.get_store_value: {}}))
+    params = {'user': 'alice', 'key': 'rows', 'select': 'first'}
+    assert lean_client.get('/get_store_value', params=params).status_code == 400
@@ -0,0 +1,96 @@
+"""
+Test the full-response cache of the routes whose specs have a ``"cache"`` entry.
+"""
+
+from fastapi.testclient import TestClient
+
+from wip_qh.response_cache import ResponseCache
+from wip_qh.fastapi_refactors.fastapi_refactor_00 import (
+    backend_mall,
+    reset_backend_mall,
+    get_store_value,
+    greeter,
+)
+from wip_qh.fastapi_refactors.fastapi_refactor_03 import route_specs
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+
+def mk_cached_app(cache):
+    specs = dict(route_specs)
+    specs[get_store_value] = {
+        **specs[get_store_value],
+        'cache': {'ttl': 60, 'key': ['user', 'key']},
+    }
+    specs[greeter] = {**specs[greeter], 'cache': {'precompute': ['/greeter/Hi']}}
+    return fast_api_app(specs, response_cache=cache)
+
+
+def test_cached_responses_skip_the_function():
+    reset_backend_mall(backend_mall)
+    cache = ResponseCache()
+    client = TestClient(mk_cached_app(cache))
+
+    first = client.get('/store_get/alice?key=fruit')
+    assert first.status_code == 200 and 'x-cache' not in first.headers
+    backend_mall['alice']['fruit'] = 'changed'  # the cached response doesn't see it
+    second = client.get('/store_get/alice?key=fruit&unused=1')  # same key
+    assert second.headers['x-cache'] == 'hit'
+    assert second.content == first.content
+    assert second.headers['content-type'] == first.headers['content-type']
+
+    assert cache.invalidate('get_store_value') == 1
+    assert client.get('/store_get/alice?key=fruit').json() == 'changed'
+    reset_backend_mall(backend_mall)
+
+
+def test_precomputed_at_startup():
+    cache = ResponseCache()
+    with TestClient(mk_cached_app(cache)) as client:
+        assert len(cache) == 1
+        response = client.get('/greeter/Hi')
+        assert response.headers['x-cache'] == 'hit'
+        assert response.json() == 'Hi, world!'
+        assert 'x-cache' not in client.get('/greeter/Hi?name=you').headers
+
+
+def test_apps_have_their_own_cache():
+    client = TestClient(mk_cached_app(None))
+    other_client = TestClient(mk_cached_app(None))
+    client.get('/store_get/alice?key=fruit')
+    assert client.get('/store_get/alice?key=fruit').headers['x-cache'] == 'hit'
+    assert 'x-cache' not in other_client.get('/store_get/alice?key=fruit').headers
+    assert client.app.state.response_cache is not other_client.app.state.response_cache
+
+
+def test_writes_invalidate_cached_reads():
+    reset_backend_mall(backend_mall)
+    specs = dict(route_specs)
+    specs[get_store_value] = {
+        **specs[get_store_value],
+        'cache': {'key': ['user', 'key'], 'invalidated_by': ['set_store_value']},
+    }
+    client = TestClient(fast_api_app(specs))
+    client.get('/store_get/alice?key=fruit')
+    assert client.get('/store_get/alice?key=fruit').headers['x-cache'] == 'hit'
+    response = client.post('/store_set/alice?key=fruit', json={'value': 'kiwi'})
+    assert response.status_code == 200
+    response = client.get('/store_get/alice?key=fruit')
+    assert 'x-cache' not in response.headers and response.json() == 'kiwi'
+    reset_backend_mall(backend_mall)
+
+
+def test_negotiated_responses_are_cached_per_accept():
+    import numpy as np
+    from wip_qh.content_codecs import codecs, NDARRAY_MIMETYPE
+
+    def arange(n: int):
+        return np.arange(n)
+
+    app = fast_api_app({arange: {'cache': True}}, codecs=codecs)
+    client = TestClient(app)
+    as_json = client.get('/arange?n=3')
+    as_ndarray = client.get('/arange?n=3', headers={'accept': NDARRAY_MIMETYPE})
+    assert 'x-cache' not in as_ndarray.headers
+    assert as_ndarray.headers['content-type'] == NDARRAY_MIMETYPE
+    again = client.get('/arange?n=3')
+    assert again.headers['x-cache'] == 'hit' and again.content == as_json.content
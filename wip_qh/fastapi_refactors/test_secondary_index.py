@@ -0,0 +1,86 @@
+"""
+Test the inverted index of store values, and its lookup route.
+"""
+
+import time
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from wip_qh.fastapi_refactors import fastapi_refactor_00
+from wip_qh.fastapi_refactors.fastapi_refactor_00 import (
+    backend_mall,
+    reset_backend_mall,
+    StoreAccess,
+)
+from wip_qh.fastapi_refactors.fastapi_refactor_03 import route_specs
+from wip_qh.fastapi_refactors.secondary_index import (
+    observed_with_index,
+    index_route_specs,
+)
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+
+def test_index_lookup(monkeypatch):
+    reset_backend_mall(backend_mall)
+    mall, index = observed_with_index(backend_mall)
+    monkeypatch.setattr(fastapi_refactor_00, 'store_getter', mall.__getitem__)
+    client = TestClient(fast_api_app({**route_specs, **index_route_specs(index)}))
+
+    assert client.get('/index/apple').json() == [
+        {'user': 'alice', 'key': 'fruit'},
+        {'user': 'bob', 'key': 'food'},
+    ]
+    # writes through the web services are indexed
+    client.post('/store_set/alice?key=fruit', json={'value': {'banana': 2}})
+    assert client.get('/index/apple?users_only=true').json() == ['bob']
+    assert client.get('/index/banana?users_only=true').json() == ['alice']
+
+    # and so are those of StoreAccess
+    StoreAccess(mall).write('carol', {'basket': {'apple': 5}})
+    assert index.users_with('apple') == ['bob', 'carol']
+    StoreAccess(mall).delete('bob')
+    assert client.get('/index/apple?users_only=true').json() == ['carol']
+    assert client.get('/index/nothing').json() == []
+    reset_backend_mall(backend_mall)
+
+
+def test_concurrent_writes_leave_the_index_describing_the_last_one():
+    mall, index = observed_with_index({'alice': {'fruit': {}}})
+    notifying_apple = threading.Event()
+
+    def slow_on_apples(user, key, value):  # (notified before the index is)
+        if value == {'apple': 1}:
+            notifying_apple.set()
+            time.sleep(0.1)
+
+    mall.observers.insert(0, slow_on_apples)
+    first = threading.Thread(
+        target=mall['alice'].__setitem__, args=('fruit', {'apple': 1})
+    )
+    first.start()
+    notifying_apple.wait(5)
+    mall['alice']['fruit'] = {'kiwi': 1}  # (waits for the first write to be indexed)
+    first.join()
+    assert mall['alice']['fruit'] == {'kiwi': 1}
+    assert index.lookup('kiwi') == [('alice', 'fruit')]
+    assert index.lookup('apple') == []
+
+
+def test_a_failing_observer_does_not_keep_the_others_from_a_write():
+    mall, index = observed_with_index({'alice': {}})
+
+    def failing(user, key, value):
+        raise RuntimeError("observer down")
+
+    events = []
+    mall.observers[:0] = [failing]
+    mall.add_observer(lambda *event: events.append(event))
+    with pytest.raises(RuntimeError):
+        mall['alice']['fruit'] = {'apple': 1}
+    assert index.lookup('apple') == [('alice', 'fruit')]
+    assert events == [('alice', 'fruit', {'apple': 1})]
+    with pytest.raises(RuntimeError):
+        mall['bob'] = {'food': {'kiwi': 1}, 'car': {'vw': 1}}
+    assert index.users_with('kiwi') == index.users_with('vw') == ['bob']
@@ -0,0 +1,76 @@
+"""Test the ShardedStore (consistent hashing of users over backend stores)."""
+
+import threading
+
+import pytest
+
+from wip_qh.fastapi_refactors.sharded_store import ShardedStore
+
+
+class UnsafeStore(dict):
+    """A dict that complains when it's used by several threads at once"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._busy = threading.Lock()
+
+    def __setitem__(self, key, value):
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("Concurrent write")
+        try:
+            super().__setitem__(key, value)
+        finally:
+            self._busy.release()
+
+
+def _filled_store(n_shards=3, n_users=300):
+    store = ShardedStore({f"s{i}": UnsafeStore() for i in range(n_shards)})
+    for i in range(n_users):
+        store[f"user_{i}"] = {'i': i}
+    return store
+
+
+def test_routing():
+    store = _filled_store()
+    assert len(store) == 300
+    assert sorted(store) == sorted(f"user_{i}" for i in range(300))
+    assert 'user_7' in store and 'nobody' not in store
+    assert 'user_7' in store.shard_for('user_7')
+    del store['user_7']
+    assert 'user_7' not in store and len(store) == 299
+    with pytest.raises(KeyError):
+        store['user_7']
+
+
+def test_resharding_keeps_all_keys():
+    store = _filled_store()
+    before = dict(store)
+    store.add_shard('s3', UnsafeStore())
+    assert dict(store) == before
+    for name, shard in store.shards.items():
+        assert all(store.shard_name_for(key) == name for key in shard)
+    removed = store.remove_shard('s0')
+    assert removed == {} and 's0' not in store.shards
+    assert dict(store) == before
+
+
+def test_remove_shard_errors():
+    store = _filled_store(n_shards=1, n_users=3)
+    with pytest.raises(KeyError):
+        store.remove_shard('nope')
+    with pytest.raises(ValueError):
+        store.remove_shard('s0')
+    assert len(store) == 3  # nothing was lost
+
+
+def test_remove_shard_that_can_not_be_emptied():
+    class StickyStore(dict):
+        def __delitem__(self, key):
+            pass  # (a backend that silently doesn't delete)
+
+    store = ShardedStore({'s0': StickyStore(), 's1': {}})
+    for i in range(20):
+        store[f"user_{i}"] = i
+    with pytest.raises(RuntimeError):
+        store.remove_shard('s0')
+    assert 's0' in store.shards and 's0' in store.ring.nodes
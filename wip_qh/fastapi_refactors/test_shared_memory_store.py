@@ -0,0 +1,118 @@
+"""
+Test that processes share a `SharedMemoryMall`, and that its arena is compacted.
+"""
+
+import time
+import uuid
+import threading
+import multiprocessing
+
+import pytest
+
+from wip_qh.fastapi_refactors.shared_memory_store import (
+    SharedMemoryMall,
+    SharedMemoryStore,
+    SharedMemoryFull,
+)
+
+
+def _write(name, user, n):
+    mall = SharedMemoryMall(name)
+    for i in range(n):
+        mall[user][f"k{i}"] = {'i': i, 'by': user}
+    mall.close()
+
+
+def test_processes_share_the_mall():
+    name = 'wip_qh_test_' + uuid.uuid4().hex[:8]
+    mall = SharedMemoryMall(name, size=2**20, initial={'alice': {}, 'bob': {}})
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        procs = [ctx.Process(target=_write, args=(name, u, 50)) for u in mall]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(30)
+            assert p.exitcode == 0
+        assert len(mall['alice']) == len(mall['bob']) == 50
+        assert mall['bob']['k49'] == {'i': 49, 'by': 'bob'}
+    finally:
+        mall.unlink()
+
+
+def test_compaction():
+    name = 'wip_qh_test_' + uuid.uuid4().hex[:8]
+    s = SharedMemoryStore(name, size=4096)
+    other = SharedMemoryStore(name)
+    try:
+        for i in range(500):  # (far more than fits, if it weren't compacted)
+            s['counter'] = i
+            assert other['counter'] == i
+        other['other'] = 'x'
+        assert s.usage()['epoch'] > 0
+        assert dict(s) == {'counter': 499, 'other': 'x'}
+        with pytest.raises(SharedMemoryFull):
+            s['big'] = 'x' * 5000
+        assert dict(other) == {'counter': 499, 'other': 'x'}
+    finally:
+        other.close()
+        s.unlink()
+
+
+def test_attaching_processes_wait_for_the_fill():
+    name = 'wip_qh_test_' + uuid.uuid4().hex[:8]
+    filling = threading.Event()
+
+    def slow_fill(store):
+        filling.set()
+        for i in range(20):
+            store[i] = i
+            time.sleep(0.01)
+
+    creator = threading.Thread(
+        target=lambda: SharedMemoryStore(name, size=2**16, fill=slow_fill).close()
+    )
+    creator.start()
+    filling.wait(5)
+    other = SharedMemoryStore(name)  # (blocks until the fill is done)
+    try:
+        assert len(other) == 20
+    finally:
+        creator.join()
+        other.unlink()
+
+
+def test_unfinished_fills_start_over():
+    name = 'wip_qh_test_' + uuid.uuid4().hex[:8]
+
+    def crashing_fill(store):
+        store['partial'] = 1
+        raise RuntimeError("died while filling")
+
+    with pytest.raises(RuntimeError):
+        SharedMemoryStore(name, size=2**16, fill=crashing_fill)
+    mall = SharedMemoryMall(name, initial={'alice': {'fruit': 1}})
+    try:
+        assert dict(mall.store) == {('alice', None): True, ('alice', 'fruit'): 1}
+        again = SharedMemoryMall(name, initial={'bob': {}})
+        assert list(again) == ['alice']
+        again.close()
+    finally:
+        mall.unlink()
+
+
+def test_deleted_users_stay_deleted():
+    name = 'wip_qh_test_' + uuid.uuid4().hex[:8]
+    mall = SharedMemoryMall(name, size=2**16, initial={'alice': {'fruit': 1}})
+    other = SharedMemoryMall(name)
+    try:
+        held = other['alice']
+        del mall['alice']
+        with pytest.raises(KeyError):
+            held['fruit'] = 2
+        assert 'alice' not in other and list(other) == [] and len(other) == 0
+        with pytest.raises(KeyError):
+            del other['alice']
+    finally:
+        other.close()
+        mall.unlink()
@@ -0,0 +1,93 @@
+"""
+Test the websocket RPC route that `fast_api_app(..., rpc_path=...)` adds alongside the
+http routes.
+"""
+
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from wip_qh.fastapi_refactors.fastapi_refactor_00 import (
+    backend_mall,
+    reset_backend_mall,
+)
+from wip_qh.fastapi_refactors.fastapi_refactor_04 import app
+
+
+async def sleep_then_return(x, seconds: float = 0.0):
+    await asyncio.sleep(seconds)
+    return x
+
+
+def test_rpc_calls_route_functions():
+    reset_backend_mall(backend_mall)
+    with TestClient(app).websocket_connect('/rpc') as ws:
+        ws.send_json({'id': 1, 'func': 'greeter', 'params': {'greeting': 'Hi'}})
+        assert ws.receive_json() == {'id': 1, 'result': 'Hi, world!'}
+
+        params = {'user': 'alice', 'key': 'fruit'}
+        ws.send_json({'id': 2, 'func': 'get_store_value', 'params': params})
+        assert ws.receive_json() == {'id': 2, 'result': backend_mall['alice']['fruit']}
+
+
+def test_rpc_errors():
+    with TestClient(app).websocket_connect('/rpc') as ws:
+        ws.send_json({'id': 'a', 'func': 'no_such_func', 'params': {}})
+        response = ws.receive_json()
+        assert response['id'] == 'a' and response['error']['type'] == 'KeyError'
+
+        params = {'user': 'nobody', 'key': 'fruit'}
+        ws.send_json({'id': 'b', 'func': 'get_store_value', 'params': params})
+        response = ws.receive_json()
+        assert response['id'] == 'b' and response['error']['type'] == 'KeyError'
+
+        # the connection survives errors
+        ws.send_json({'id': 'c', 'func': 'greeter', 'params': {'greeting': 'Yo'}})
+        assert ws.receive_json() == {'id': 'c', 'result': 'Yo, world!'}
+
+
+def test_rpc_responses_come_in_completion_order():
+    from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+    rpc_app = fast_api_app({sleep_then_return: {}}, rpc_path='/rpc')
+    with TestClient(rpc_app).websocket_connect('/rpc') as ws:
+        slow = {'x': 'slow', 'seconds': 0.3}
+        fast = {'x': 'fast', 'seconds': 0}
+        ws.send_json({'id': 1, 'func': 'sleep_then_return', 'params': slow})
+        ws.send_json({'id': 2, 'func': 'sleep_then_return', 'params': fast})
+        assert ws.receive_json() == {'id': 2, 'result': 'fast'}
+        assert ws.receive_json() == {'id': 1, 'result': 'slow'}
+
+
+def test_rpc_goes_through_the_routes():
+    with TestClient(app).websocket_connect('/rpc') as ws:
+        # the route's input validation applies
+        params = {'smallest': 'one', 'highest': 10}
+        ws.send_json({'id': 1, 'func': 'random_integer', 'params': params})
+        response = ws.receive_json()
+        assert response['error']['status'] == 422
+        assert response['error']['message'][0]['loc'] == ['query', 'smallest']
+        # and so do its defaults (the route spec's, not the function's)
+        ws.send_json({'id': 2, 'func': 'greeter', 'params': {'greeting': 'Hi'}})
+        assert ws.receive_json()['result'] == 'Hi, world!'
+
+    resp = TestClient(app).post(
+        '/rpc/batch',
+        json=[
+            {'id': 1, 'func': 'greeter', 'params': {'greeting': 'Yo', 'n': 2}},
+            {'id': 2, 'func': 'nope'},
+        ],
+    )
+    assert resp.json()[0] == {'id': 1, 'result': 'Yo, world!\nYo, world!'}
+    assert resp.json()[1]['error']['type'] == 'KeyError'
+
+
+def test_rpc_routes_are_opt_in():
+    from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+    client = TestClient(fast_api_app({sleep_then_return: {}}))
+    assert client.post('/rpc/batch', json=[]).status_code == 404
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect('/rpc') as ws:
+            ws.receive_json()
@@ -0,0 +1,96 @@
+"""
+Test the backpressure and shutdown flush of write-behind stores.
+"""
+
+import threading
+import pytest
+
+from wip_qh.fastapi_refactors.write_behind import WriteBehindStore, WriteBehindFull
+
+
+class SlowStore(dict):
+    """A dict whose writes wait for `go` to be set"""
+
+    def __init__(self):
+        super().__init__()
+        self.go = threading.Event()
+
+    def __setitem__(self, key, value):
+        self.go.wait()
+        super().__setitem__(key, value)
+
+
+def test_write_behind_backpressure_and_close():
+    backend = SlowStore()
+    store = WriteBehindStore(
+        backend, flush_interval=60, max_pending=2, put_timeout=0.2, flush_at_exit=False
+    )
+    store['a'], store['b'] = 1, 2
+    store['c'] = 3  # (makes the flusher take a and b, and block on the backend)
+    store['d'] = 4
+    store['c'] = 30  # coalesced: doesn't need room
+    with pytest.raises(WriteBehindFull):
+        store['e'] = 5
+    assert dict(store) == {'a': 1, 'b': 2, 'c': 30, 'd': 4}  # (read your writes)
+
+    backend.go.set()
+    store.close()
+    assert backend == {'a': 1, 'b': 2, 'c': 30, 'd': 4}
+    assert store.stats['coalesced'] == 1
+
+
+class PickyStore(dict):
+    """A dict refusing the values of some keys"""
+
+    def __init__(self, bad_keys):
+        super().__init__()
+        self.bad_keys = set(bad_keys)
+
+    def __setitem__(self, key, value):
+        if key in self.bad_keys:
+            raise ValueError(f"Can't write {key}")
+        super().__setitem__(key, value)
+
+
+def test_write_failures_are_isolated_per_key():
+    backend = PickyStore({'bad'})
+    store = WriteBehindStore(backend, flush_interval=60, flush_at_exit=False)
+    store['a'], store['bad'], store['b'] = 1, 2, 3
+    with pytest.raises(ValueError):
+        store.flush()
+    assert backend == {'a': 1, 'b': 3}  # (the other keys were written)
+    assert store['bad'] == 2 and store.stats['errors'] == 1  # (still pending)
+
+    store['c'] = 4
+    with pytest.raises(ValueError):
+        store.flush()
+    assert backend == {'a': 1, 'b': 3, 'c': 4}  # not blocked by the bad key
+
+    backend.bad_keys.clear()
+    store.flush()
+    assert backend == {'a': 1, 'bad': 2, 'b': 3, 'c': 4}
+    store.close()
+
+
+def test_one_exit_handler_for_all_stores():
+    from wip_qh.fastapi_refactors import write_behind
+
+    stores = [WriteBehindStore({}, flush_interval=60) for _ in range(3)]
+    assert all(id(s) in write_behind._stores_to_close_at_exit for s in stores)
+    stores[0]['a'] = 1
+    write_behind._close_stores_at_exit()
+    assert stores[0].backend == {'a': 1}
+    assert not any(id(s) in write_behind._stores_to_close_at_exit for s in stores)
+
+
+def test_exit_handler_flushes_the_stores_after_a_failing_one(caplog):
+    from wip_qh.fastapi_refactors import write_behind
+
+    failing = WriteBehindStore(PickyStore({'bad'}), flush_interval=60)
+    others = [WriteBehindStore({}, flush_interval=60) for _ in range(2)]
+    failing['bad'] = 1
+    for store in others:
+        store['a'] = 1
+    write_behind._close_stores_at_exit()
+    assert all(store.backend == {'a': 1} for store in others)
+    assert "Failed to flush" in caplog.text
@@ -8,7 +8,7 @@ Contents:
 
 Main: 
 - add_routes_to_app: add routes to a FastAPI app
-- fast_api_app: create a FastAPI app with routes
+- fast_api_app: create a FastAPI app with routes (and, optionally, RPC routes for them)
 
 Helpers:
 - a few unused types for http methods and route method keywords
@@ -17,6 +17,12 @@ Helpers:
 - mk_func_input_validator: make a validator for a function's input parameters 
     (using model_from_function and validate_dict_with_model)
 - mk_endpoint: wrap func to prepare for use as an endpoint
+- ProfilingMiddleware: profile the requests that should be (see wip_qh.profiling)
+- RequestHeadersMiddleware: make the request headers available to endpoints
+- BuffersResponse: a response written as a sequence of (non-joined) buffers
+- _mk_encoded_output: serialize outputs declared JSON-compatible in one pass
+- ResponseCacheMiddleware: serve the responses of cacheable routes from a cache
+- _mk_deadlined: give up on (and cancel, if async) calls that exceed their deadline
 - add_defaults: add defaults to a dictionary if they are not already present
 - mk_api_route_kwargs: make the kwargs for the APIRoute constructor
 
@@ -68,12 +74,50 @@ def value_transformed_dict_equality(d1=None, d2=None, value_transformer=lambda x
 #  therefore making the configuration more concise and less error-prone.
 
 from fastapi.routing import APIRoute
-from fastapi import FastAPI
+from fastapi import FastAPI, Response, HTTPException
 from pydantic import BaseModel, create_model, Field, ValidationError
-from typing import Literal, Dict, Any, Callable, Type, T, Union, Iterable
-from functools import partial
+from typing import Literal, Dict, Any, Callable, Type, T, Union, Iterable, Mapping
+from functools import partial, wraps
+from contextvars import ContextVar
+import json
 import inspect
+import cProfile
+import pstats
+from urllib.parse import parse_qsl
+from starlette.datastructures import Headers
+from starlette.routing import compile_path
 from i2 import Sig, wrap, asis, name_of_obj
+from wip_qh.profiling import RequestProfiler, profiled_coroutine
+from wip_qh.content_codecs import (
+    negotiate,
+    codec_for_content_type,
+    json_dumps_bytes,
+    EncodedJSON,
+    JSON_MIMETYPE,
+)
+from wip_qh.deadlines import (
+    DeadlineExceeded,
+    DeadlinePoolFull,
+    effective_timeout,
+    acall_with_deadline,
+)
+from wip_qh.projection import InvalidSelection
+from wip_qh.response_cache import (
+    CacheSpec,
+    CachedResponse,
+    ResponseCache,
+    cache_spec,
+)
+from wip_qh.fastapi_refactors.websocket_rpc import (
+    add_websocket_rpc_route,
+    add_batch_rpc_route,
+    funcs_of_route_specs,
+)
+from wip_qh.fastapi_refactors.job_routes import add_job_routes
+from wip_qh.fastapi_refactors.blob_routes import add_blob_routes
+from wip_qh.jobs import JobRunner
+from wip_qh.fastapi_refactors.change_feed import ChangeFeed, add_change_feed_route
+from wip_qh.fastapi_refactors.openapi_cache import serve_precomputed_openapi
 
 
 HTTPMethod = Literal[
@@ -156,17 +200,440 @@ def mk_func_input_validator(func: Callable) -> Callable:
     return partial(validate_dict_with_model, model=func_input_model)
 
 
-def mk_endpoint(func, defaults):
+class _RequestProfile:
+    """The profiles of a request: of the event loop's work, and of its threads'"""
+
+    def __init__(self, name: str, fmt: str):
+        self.name, self.fmt = name, fmt
+        self.thread_profiles = []
+
+    def stats(self, loop_profile: cProfile.Profile) -> pstats.Stats:
+        stats = pstats.Stats(loop_profile)
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        return stats
+
+
+# The profile of the current request (None if it's not profiled)
+_request_profile = ContextVar('_request_profile', default=None)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that asks the profiler whether the request should be profiled,
+    and if so, profiles it: all its work on the event loop (routing, validation,
+    async endpoints, serialization...), but not the other tasks', and, through the
+    endpoints made with `mk_endpoint(..., profiler=...)`, the work of sync endpoints
+    in their threads. The profile is dumped once the response is sent.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            headers = Headers(scope=scope)
+            if self.profiler.should_profile(headers):
+                return await self._profiled(scope, receive, send, headers)
+        await self.app(scope, receive, send)
+
+    async def _profiled(self, scope, receive, send, headers):
+        name = scope['path'].strip('/').replace('/', '_') or 'root'
+        request_profile = _RequestProfile(name, self.profiler.fmt_for(headers))
+        loop_profile = cProfile.Profile()
+        token = _request_profile.set(request_profile)
+        try:
+            await profiled_coroutine(self.app(scope, receive, send), loop_profile)
+        finally:
+            _request_profile.reset(token)
+            stats = request_profile.stats(loop_profile)
+            self.profiler.dump(stats, request_profile.name, fmt=request_profile.fmt)
+
+
+def _mk_profiled(endpoint, name: str):
+    """
+    Name the profile of the requests marked for profiling after the endpoint, and
+    profile the calls of a sync endpoint (in the thread it's run in)
+    """
+    if inspect.iscoroutinefunction(endpoint):
+
+        @wraps(endpoint)
+        async def profiled_endpoint(*args, **kwargs):
+            request_profile = _request_profile.get()
+            if request_profile is not None:
+                request_profile.name = name
+            return await endpoint(*args, **kwargs)
+
+    else:
+
+        @wraps(endpoint)
+        def profiled_endpoint(*args, **kwargs):
+            request_profile = _request_profile.get()
+            if request_profile is None:
+                return endpoint(*args, **kwargs)
+            request_profile.name = name
+            profile = cProfile.Profile()
+            request_profile.thread_profiles.append(profile)
+            return profile.runcall(endpoint, *args, **kwargs)
+
+    return profiled_endpoint
+
+
+# The headers of the current request (for the endpoints that need them)
+_request_headers = ContextVar('_request_headers', default=None)
+
+
+class RequestHeadersMiddleware:
+    """ASGI middleware that puts the request headers in a context variable"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        token = _request_headers.set(Headers(scope=scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_headers.reset(token)
+
+
+class BuffersResponse(Response):
+    """
+    A response whose body is given as a sequence of bytes-like chunks, that are
+    sent one after the other, without being joined into one bytes.
+    ASGI bodies have to be bytes, so the chunks that aren't, such as memoryviews, are
+    copied into bytes, one at a time: big buffers are copied once, not twice.
+    """
+
+    def __init__(self, chunks, status_code=200, headers=None, media_type=None):
+        self.chunks = list(chunks)
+        headers = dict(headers or {})
+        headers['content-length'] = str(sum(memoryview(c).nbytes for c in self.chunks))
+        super().__init__(b'', status_code, headers=headers, media_type=media_type)
+
+    async def __call__(self, scope, receive, send):
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': self.status_code,
+                'headers': self.raw_headers,
+            }
+        )
+        last = len(self.chunks) - 1
+        for i, chunk in enumerate(self.chunks):
+            if not isinstance(chunk, bytes):
+                chunk = bytes(chunk)
+            await send(
+                {'type': 'http.response.body', 'body': chunk, 'more_body': i < last}
+            )
+        if last < 0:
+            await send({'type': 'http.response.body', 'body': b''})
+
+
+def _mk_negotiating(endpoint, codecs: Mapping, output: str = None):
+    """
+    Decode (non JSON) bytes bodies with the codec of the request's Content-Type,
+    and encode the output with the codec negotiated from its Accept header.
+
+    If the `output` is declared (see `_mk_encoded_output`), and JSON is negotiated,
+    it's encoded in one pass (or sent as is, if it's encoded already).
+    """
+    _check_output_kind(output)
+
+    def decoded(kwargs):
+        headers = _request_headers.get() or {}
+        codec = codec_for_content_type(headers.get('content-type'), registry=codecs)
+        if codec is None or codec.mimetype == JSON_MIMETYPE:
+            return kwargs
+        return {
+            k: codec.decode(v) if isinstance(v, bytes) else v for k, v in kwargs.items()
+        }
+
+    def response(result):
+        headers = _request_headers.get() or {}
+        if output == 'encoded':
+            result = _json_output(result, output)
+        codec = negotiate(headers.get('accept'), result, registry=codecs)
+        if output is not None and codec.mimetype == JSON_MIMETYPE:
+            return Response(_json_output(result, 'json'), media_type=JSON_MIMETYPE)
+        if isinstance(result, EncodedJSON):  # (to be encoded with another codec)
+            result = json.loads(result)
+        return BuffersResponse(codec.encode_chunks(result), media_type=codec.mimetype)
+
+    if inspect.iscoroutinefunction(endpoint):
+
+        @wraps(endpoint)
+        async def negotiating_endpoint(*args, **kwargs):
+            return response(await endpoint(*args, **decoded(kwargs)))
+
+    else:
+
+        @wraps(endpoint)
+        def negotiating_endpoint(*args, **kwargs):
+            return response(endpoint(*args, **decoded(kwargs)))
+
+    return negotiating_endpoint
+
+
+# The route_specs "output" values: how the function's output is to be serialized
+OUTPUT_KINDS = ('json', 'encoded')
+
+
+def _check_output_kind(output: str = None):
+    if output is not None and output not in OUTPUT_KINDS:
+        raise ValueError(f"output should be one of {OUTPUT_KINDS}: {output!r}")
+
+
+def _json_output(result, output: str) -> EncodedJSON:
+    """The JSON bytes of the result of a function of the given `output` kind"""
+    if output == 'json':
+        return json_dumps_bytes(result)
+    if isinstance(result, EncodedJSON):
+        return result
+    if not isinstance(result, (bytes, bytearray, memoryview)):
+        raise TypeError(
+            f"An output='encoded' function should return bytes: {type(result)}"
+        )
+    return EncodedJSON(result)
+
+
+def _mk_encoded_output(endpoint, output: str):
+    """
+    Send the output as a raw JSON response, skipping FastAPI's ``jsonable_encoder``:
+    with ``output='json'``, the output (JSON-compatible) is encoded in one pass
+    by `json_dumps_bytes`, and with ``output='encoded'``, it's JSON bytes already.
+    """
+    _check_output_kind(output)
+
+    def response(result):
+        return Response(_json_output(result, output), media_type=JSON_MIMETYPE)
+
+    if inspect.iscoroutinefunction(endpoint):
+
+        @wraps(endpoint)
+        async def encoded_output_endpoint(*args, **kwargs):
+            return response(await endpoint(*args, **kwargs))
+
+    else:
+
+        @wraps(endpoint)
+        def encoded_output_endpoint(*args, **kwargs):
+            return response(endpoint(*args, **kwargs))
+
+    return encoded_output_endpoint
+
+
+def _mk_deadlined(endpoint, deadline):
+    """
+    Respond with a 504 when a call exceeds its deadline (the route's, or the shorter
+    one of the request's deadline header; see `wip_qh.deadlines`), and with a 503
+    when there's no thread left to run it in.
+    The endpoint is made async, so that sync functions are run in a thread that can
+    be given up on.
+    """
+
+    @wraps(endpoint)
+    async def deadlined_endpoint(*args, **kwargs):
+        timeout = effective_timeout(deadline, _request_headers.get())
+        try:
+            return await acall_with_deadline(partial(endpoint, *args), kwargs, timeout)
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except DeadlinePoolFull as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+    return deadlined_endpoint
+
+
+class _CachedRoute:
+    def __init__(self, name: str, path: str, spec: CacheSpec):
+        self.name, self.path, self.spec = name, path, spec
+        self.regex = compile_path(path)[0]
+
+
+class _InvalidatingRoute:
+    def __init__(self, path: str, invalidated: Iterable[str]):
+        self.path, self.invalidated = path, tuple(invalidated)
+        self.regex = compile_path(path)[0]
+
+
+class ResponseCacheMiddleware:
+    """
+    ASGI middleware serving the GET requests of cacheable routes (see
+    `wip_qh.response_cache`) from a cache of encoded responses.
+
+    The route is matched, and the cache key computed, from the raw path and query
+    string, so a hit skips routing, validation, the endpoint and serialization.
+    Misses go through the app, and their 200 responses are stored.
+    Precomputable routes are computed when the app starts (on the lifespan startup
+    event), or when `precompute` is called.
+    Successful requests to the `invalidating_routes` drop the cached responses of the
+    routes they invalidate (see `CacheSpec.invalidated_by`).
+    """
+
+    def __init__(
+        self, app, cached_routes, cache: ResponseCache, invalidating_routes=()
+    ):
+        self.app = app
+        self.cached_routes = list(cached_routes)
+        self.cache = cache
+        self.invalidating_routes = list(invalidating_routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.app(scope, receive, self._precomputing_send(scope, send))
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        for invalidating in self.invalidating_routes:
+            if invalidating.regex.match(scope['path']) is not None:
+                send = self._invalidating_send(send, invalidating.invalidated)
+                break
+        if scope['method'] != 'GET':
+            return await self.app(scope, receive, send)
+        for route in self.cached_routes:
+            match = route.regex.match(scope['path'])
+            if match is not None:
+                break
+        else:
+            return await self.app(scope, receive, send)
+
+        query_params = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        headers = Headers(scope=scope) if route.spec.vary else None
+        key = route.spec.key_for(route.name, match.groupdict(), query_params, headers)
+        cached = self.cache.get(key)
+        if cached is not None:
+            start, body = cached.asgi_messages
+            await send(start)
+            await send(body)
+            return
+        generation = self.cache.generation(route.name)
+        storing_send = self._storing_send(send, key, route.spec.ttl, generation)
+        await self.app(scope, receive, storing_send)
+
+    def _invalidating_send(self, send, route_names):
+        async def invalidating_send(message):
+            if message['type'] == 'http.response.start' and message['status'] < 400:
+                for route_name in route_names:
+                    self.cache.invalidate(route_name)
+            await send(message)
+
+        return invalidating_send
+
+    def _storing_send(self, send, key, ttl, generation=None):
+        response = {}
+        chunks = []
+
+        async def storing_send(message):
+            if message['type'] == 'http.response.start':
+                response.update(message)
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+                done = not message.get('more_body', False)
+                if done and response.get('status') == 200:
+                    headers = [
+                        (k.decode('latin-1'), v.decode('latin-1'))
+                        for k, v in response.get('headers', [])
+                    ]
+                    cached = CachedResponse(b''.join(chunks), 200, headers)
+                    self.cache.set(key, cached, ttl, generation=generation)
+            await send(message)
+
+        return storing_send
+
+    def _precomputing_send(self, lifespan_scope, send):
+        async def precomputing_send(message):
+            if message['type'] == 'lifespan.startup.complete':
+                await self.precompute(app=lifespan_scope.get('app'))
+            await send(message)
+
+        return precomputing_send
+
+    async def precompute(self, *, app=None):
+        """Compute (and cache) the responses of the precomputable routes"""
+        for route in self.cached_routes:
+            for target in route.spec.precompute_targets():
+                path, _, query = (target or route.path).partition('?')
+                if route.regex.match(path) is None:
+                    raise ValueError(
+                        f"Can't precompute {route.name}: {target or route.path} "
+                        f"doesn't match its path, {route.path}"
+                    )
+                await self._get(path, query, app=app)
+
+    async def _get(self, path, query, *, app=None):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': query.encode(),
+            'headers': [],
+            'client': None,
+            'server': None,
+        }
+        if app is not None:
+            scope['app'] = app
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def discard(message):
+            pass
+
+        await self(scope, receive, discard)
+
+
+def mk_endpoint(
+    func,
+    defaults,
+    *,
+    profiler: RequestProfiler = None,
+    codecs: Mapping = None,
+    deadline: float = None,
+    output: str = None,
+):
     """
     Wrap func to prepare for use as an endpoint.
 
     Namely, change the defaults to be request parameters (Path, Query, Body, etc.)
+
+    If a profiler is given, the endpoint takes part in the profiling of the requests
+    `ProfilingMiddleware` (which `add_routes_to_app` installs) profiles.
+
+    If a codec registry (see `wip_qh.content_codecs`) is given, the output is encoded
+    according to the request's Accept header (instead of FastAPI's JSON encoding),
+    and non-JSON bodies are decoded according to the Content-Type (this works for
+    non-embedded `Body` parameters, which FastAPI gives us as bytes).
+
+    If `output` is given (``'json'`` or ``'encoded'``), the output is declared to be
+    JSON-compatible (or JSON bytes already), and sent as is (see `_mk_encoded_output`)
+    instead of going through FastAPI's encoding (with codecs, when JSON is the
+    negotiated encoding: other encodings still apply).
+
+    If a deadline (in seconds) is given, calls exceeding it (or the shorter one the
+    client asks for, with the `wip_qh.deadlines.DFLT_DEADLINE_HEADER` header) get a
+    504 response.
     """
     new_sig = Sig(func).ch_defaults(**defaults)
     # Wrap the function to apply changes to the wrapper; not the function itself.
     _func = wrap(func)
     # apply the sigature to the wrapped function
     _func = new_sig(_func)
+    if codecs is not None:
+        _func = _mk_negotiating(_func, codecs, output)
+    elif output is not None:
+        _func = _mk_encoded_output(_func, output)
+    if profiler is not None:
+        _func = _mk_profiled(_func, name_of_obj(func))
+    if deadline is not None:
+        _func = _mk_deadlined(_func, deadline)
     return _func
 
 
@@ -191,8 +658,17 @@ def mk_api_route_kwargs(
     *,
     config_validator: Callable[[T], T] = asis,
     dflt_methods=['GET', 'POST'],
+    profiler: RequestProfiler = None,
+    codecs: Mapping = None,
 ):
-    endpoint = mk_endpoint(func, defaults=config.get('defaults', {}))
+    endpoint = mk_endpoint(
+        func,
+        defaults=config.get('defaults', {}),
+        profiler=profiler,
+        codecs=codecs,
+        deadline=config.get('deadline'),
+        output=config.get('output'),
+    )
     api_route_kwargs = config.get('api_route_kwargs', {})
     name = name_of_obj(func)
     dflt_api_route_kwargs = dict(
@@ -232,6 +708,14 @@ def dflt_mk_route(*args, **kwargs):
     return APIRoute(*args, **kwargs)
 
 
+async def _invalid_selection_response(request, exc: InvalidSelection):
+    return Response(
+        json_dumps_bytes({'detail': str(exc)}),
+        status_code=400,
+        media_type=JSON_MIMETYPE,
+    )
+
+
 # TODO: Make the validation work!!
 def add_routes_to_app(
     app,
@@ -239,20 +723,123 @@ def add_routes_to_app(
     *,
     dflt_methods=['GET', 'POST'],
     mk_route: Callable = dflt_mk_route,
+    profiler: RequestProfiler = None,
+    codecs: Mapping = None,
+    response_cache: ResponseCache = None,
 ):
     config_validator = mk_func_input_validator(mk_route)
     _mk_api_route_kwargs = partial(
         mk_api_route_kwargs,
         dflt_methods=dflt_methods,
         config_validator=config_validator,
+        profiler=profiler,
+        codecs=codecs,
     )
     route_kwargs = map(_mk_api_route_kwargs, *zip(*route_specs.items()))
     routes = [mk_route(**kwargs) for kwargs in route_kwargs]
     app.routes.extend(routes)
+    app.add_exception_handler(InvalidSelection, _invalid_selection_response)
+    if profiler is not None:
+        app.add_middleware(ProfilingMiddleware, profiler=profiler)
+    if codecs is not None or any(c.get('deadline') for c in route_specs.values()):
+        app.add_middleware(RequestHeadersMiddleware)
+    cached_routes = [
+        _CachedRoute(route.name, route.path, cache_spec(config['cache']))
+        for route, config in zip(routes, route_specs.values())
+        if config.get('cache')
+    ]
+    if cached_routes:
+        if codecs is not None:  # (then responses depend on the Accept header)
+            for cached in cached_routes:
+                cached.spec = cached.spec.varying_with('accept')
+        invalidating_routes = []
+        for route in routes:
+            invalidated = [
+                cached.name
+                for cached in cached_routes
+                if route.name in cached.spec.invalidated_by
+            ]
+            if invalidated:
+                invalidating_routes.append(_InvalidatingRoute(route.path, invalidated))
+        if response_cache is None:
+            response_cache = ResponseCache()
+        app.state.response_cache = response_cache
+        # (added last, so that it's the outermost: hits skip the other middlewares)
+        app.add_middleware(
+            ResponseCacheMiddleware,
+            cached_routes=cached_routes,
+            cache=response_cache,
+            invalidating_routes=invalidating_routes,
+        )
     return app
 
 
-def fast_api_app(routes, *, app: FastAPI = None):
+def fast_api_app(
+    routes,
+    *,
+    app: FastAPI = None,
+    profiler: RequestProfiler = None,
+    codecs: Mapping = None,
+    rpc_path: str = None,
+    response_cache: ResponseCache = None,
+    change_feed: ChangeFeed = None,
+    openapi_cache_dir: str = None,
+    jobs: JobRunner = None,
+    blob_prefix: str = None,
+):
+    """
+    Make a FastAPI app (or use the given one) and add routes to it.
+
+    If an `rpc_path` is given (e.g. `websocket_rpc.DFLT_RPC_PATH`), a websocket route
+    serving all the routes over RPC messages (see `websocket_rpc`) is also added, at
+    that path, along with an http route for batches of such messages, at
+    ``{rpc_path}/batch``.
+
+    Give `codecs` (e.g. `wip_qh.content_codecs.codecs`) to have outputs encoded
+    according to the requests' Accept headers.
+
+    Routes whose spec has a ``"cache"`` entry (see `wip_qh.response_cache.cache_spec`)
+    have their GET responses cached, in `response_cache` (by default, a new one, for
+    this app: it's then ``app.state.response_cache``).
+
+    Routes whose spec has an ``"output"`` entry (``'json'``: the output is
+    JSON-compatible, or ``'encoded'``: it's JSON bytes) are serialized in one pass,
+    skipping FastAPI's ``jsonable_encoder``.
+
+    Routes whose spec has a ``"deadline"`` entry (in seconds) respond with a 504 when
+    a call exceeds it, or the (shorter) deadline the request's ``x-deadline-ms``
+    header asks for (see `wip_qh.deadlines`).
+
+    If a `change_feed` is given, a ``/changes/{user}`` route streams its events
+    (see `change_feed.add_change_feed_route`).
+
+    If a `jobs` runner (see `wip_qh.jobs`) is given, the route functions can also be
+    submitted as jobs, at ``/jobs/{func_name}`` (see `job_routes.add_job_routes`).
+
+    If a `blob_prefix` is given (e.g. `blob_routes.DFLT_BLOB_PREFIX`), the streaming
+    upload and Range-aware download versions of the store routes are added under it
+    (see `blob_routes.add_blob_routes`).
+
+    The OpenAPI schema is computed when the app starts, and served as pre-encoded
+    bytes (see `openapi_cache`). Give `openapi_cache_dir` to have it saved there,
+    and loaded from there by the next instances with the same routes.
+    """
     app = app or FastAPI()
-    add_routes_to_app(app, routes)
+    add_routes_to_app(
+        app,
+        routes,
+        profiler=profiler,
+        codecs=codecs,
+        response_cache=response_cache,
+    )
+    if rpc_path is not None:
+        add_websocket_rpc_route(app, routes, path=rpc_path)
+        add_batch_rpc_route(app, routes, path=f"{rpc_path}/batch")
+    if change_feed is not None:
+        add_change_feed_route(app, change_feed)
+    if jobs is not None:
+        add_job_routes(app, jobs, funcs_of_route_specs(routes))
+    if blob_prefix is not None:
+        add_blob_routes(app, prefix=blob_prefix)
+    serve_precomputed_openapi(app, cache_dir=openapi_cache_dir)
     return app
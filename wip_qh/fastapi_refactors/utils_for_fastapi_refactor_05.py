@@ -0,0 +1,457 @@
+"""
+A lean ASGI serving engine, made directly from the same route_specs that
+`utils_for_fastapi_refactor_03.fast_api_app` uses.
+
+FastAPI does a lot of work per request that trivial routes don't need: Starlette's
+routing (a linear scan of regexes), dependency injection (solving the endpoint's
+dependencies, validating with pydantic), and `jsonable_encoder` (a walk over the
+output before `json.dumps` walks it again).
+
+Here, each route spec is compiled, once, into a `LeanRoute` that knows exactly where
+each of the function's arguments comes from (path, query or body), and how to cast it.
+Requests are then dispatched with a dict lookup (static paths) or a precompiled regex
+(templated paths), and outputs are encoded in a single pass (`json_dumps_bytes`).
+
+Routes whose specs need the machinery we skip (`Header`, `Cookie`, `Form`, `File`,
+`Depends`, or body parameters annotated with models or containers), or that have
+spec entries the lean engine doesn't implement (such as ``"deadline"`` or
+``"cache"``), are served by a regular FastAPI app (made with `fast_api_app`) that
+requests fall back to.
+
+Contents:
+
+Main:
+- asgi_app: make a lean ASGI app from route_specs
+
+Helpers:
+- LeanRoute: a compiled route
+- mk_lean_route: compile a (func, spec) pair into a LeanRoute (or None if not lean-able)
+- compile_path: compile a path template into a matcher
+
+(Outputs are encoded with `wip_qh.content_codecs.json_dumps_bytes`.)
+
+"""
+
+import re
+import json
+import inspect
+from dataclasses import dataclass, field
+from typing import Callable, Any, Dict, Optional, Tuple, Iterable
+from urllib.parse import parse_qsl
+
+from fastapi import FastAPI, params as fastapi_params
+from starlette.concurrency import run_in_threadpool
+from i2 import Sig, name_of_obj
+
+from wip_qh.content_codecs import json_dumps_bytes
+from wip_qh.projection import InvalidSelection
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import (
+    fast_api_app,
+    mk_api_route_kwargs,
+    _ensure_list_of_upper_case_strings,
+    _check_output_kind,
+    _json_output,
+)
+
+# -------------------------------------------------------------------------------------
+# Casting
+
+
+_true_strings = {'1', 'true', 'on', 'yes', 't', 'y'}
+_false_strings = {'0', 'false', 'off', 'no', 'f', 'n'}
+
+
+def _str_to_bool(x: str) -> bool:
+    x = x.lower()
+    if x in _true_strings:
+        return True
+    if x in _false_strings:
+        return False
+    raise ValueError(f"Not a boolean: {x}")
+
+
+# Casts for the (string) values of path and query parameters, keyed by annotation
+str_casts = {
+    int: int,
+    float: float,
+    str: str,
+    bool: _str_to_bool,
+    Any: str,
+    inspect.Parameter.empty: str,
+}
+
+# Annotations of body parameters that need no validation (JSON gives them as is)
+passthrough_body_annotations = {Any, inspect.Parameter.empty, dict, list}
+
+
+class UnsupportedSpec(ValueError):
+    """Raised when a route spec needs features that the lean engine doesn't have"""
+
+
+class RequestValidationFailure(ValueError):
+    """Raised when a request doesn't provide valid arguments for a route"""
+
+    def __init__(self, errors: list):
+        super().__init__(errors)
+        self.errors = errors
+
+
+# -------------------------------------------------------------------------------------
+# Paths
+
+_path_param_p = re.compile(r"{(\w+)(?::(\w+))?}")
+
+
+def compile_path(path: str) -> Tuple[Optional[re.Pattern], Tuple[str, ...]]:
+    """
+    Compile a path template into a regex and the names of its path parameters.
+    The regex is None if the path is static (no parameters).
+
+    >>> regex, names = compile_path('/greeter/{greeting}')
+    >>> names
+    ('greeting',)
+    >>> regex.match('/greeter/Hi').groupdict()
+    {'greeting': 'Hi'}
+    >>> compile_path('/random_integer')
+    (None, ())
+    """
+    names = tuple(m.group(1) for m in _path_param_p.finditer(path))
+    if not names:
+        return None, ()
+    pattern, last = '', 0
+    for m in _path_param_p.finditer(path):
+        pattern += re.escape(path[last : m.start()])
+        group = '.*' if m.group(2) == 'path' else '[^/]+'
+        pattern += f"(?P<{m.group(1)}>{group})"
+        last = m.end()
+    pattern += re.escape(path[last:])
+    return re.compile(f"^{pattern}$"), names
+
+
+# -------------------------------------------------------------------------------------
+# Routes
+
+
+def _is_required(default) -> bool:
+    return default is ... or repr(default) == 'PydanticUndefined'
+
+
+@dataclass
+class _Arg:
+    name: str
+    location: str  # 'path', 'query', 'body' or 'embedded_body'
+    alias: str
+    cast: Callable = str
+    required: bool = True
+    default: Any = None
+
+
+@dataclass
+class LeanRoute:
+    """A route compiled from a route spec, ready to serve requests"""
+
+    func: Callable
+    path: str
+    methods: Tuple[str, ...]
+    args: Tuple[_Arg, ...]
+    inline: bool = False
+    regex: Optional[re.Pattern] = None
+    output: Optional[str] = None  # (see `fast_api_app`)
+    is_async: bool = field(init=False)
+    needs_body: bool = field(init=False)
+
+    def __post_init__(self):
+        self.is_async = inspect.iscoroutinefunction(self.func)
+        self.needs_body = any(a.location.endswith('body') for a in self.args)
+
+    def extract_kwargs(self, path_params: dict, query: dict, body: Any) -> dict:
+        kwargs, errors = {}, []
+        for arg in self.args:
+            if arg.location == 'path':
+                value = path_params[arg.alias]
+            elif arg.location == 'query':
+                value = query.get(arg.alias, _missing)
+            elif arg.location == 'body':
+                value = body
+            else:  # embedded_body
+                value = (
+                    body.get(arg.alias, _missing)
+                    if isinstance(body, dict)
+                    else _missing
+                )
+            if value is _missing:
+                if arg.required:
+                    errors.append(_error(arg, 'field required', 'value_error.missing'))
+                else:
+                    kwargs[arg.name] = arg.default
+                continue
+            try:
+                kwargs[arg.name] = arg.cast(value)
+            except (ValueError, TypeError):
+                msg = f"value is not a valid {name_of_obj(arg.cast)}"
+                errors.append(_error(arg, msg, 'type_error'))
+        if errors:
+            raise RequestValidationFailure(errors)
+        return kwargs
+
+    async def call(self, kwargs: dict):
+        if self.is_async:
+            return await self.func(**kwargs)
+        elif self.inline:
+            return self.func(**kwargs)
+        else:
+            return await run_in_threadpool(self.func, **kwargs)
+
+
+_missing = object()
+
+
+def _error(arg: _Arg, msg: str, type_: str) -> dict:
+    loc = 'body' if arg.location.endswith('body') else arg.location
+    return {'loc': [loc, arg.alias], 'msg': msg, 'type': type_}
+
+
+_unsupported_param_types = (
+    fastapi_params.Header,
+    fastapi_params.Cookie,
+    fastapi_params.Form,
+    fastapi_params.File,
+    fastapi_params.Depends,
+)
+
+
+def _mk_args(func, defaults: dict, path_param_names) -> Iterable[_Arg]:
+    sig = Sig(func)
+    body_params = [
+        name for name, d in defaults.items() if isinstance(d, fastapi_params.Body)
+    ]
+    for p in sig.params:
+        if p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD):
+            raise UnsupportedSpec(f"Variadic parameter: {p.name}")
+        spec_default = defaults.get(p.name, p.default)
+        annotation = p.annotation
+        if isinstance(spec_default, _unsupported_param_types):
+            raise UnsupportedSpec(f"{type(spec_default).__name__} parameter: {p.name}")
+        if isinstance(spec_default, fastapi_params.FieldInfo):
+            alias = getattr(spec_default, 'alias', None) or p.name
+            default = spec_default.default
+        else:
+            alias, default = p.name, spec_default
+        required = _is_required(default) or default is p.empty
+        if isinstance(spec_default, fastapi_params.Body):
+            if annotation not in passthrough_body_annotations:
+                raise UnsupportedSpec(f"Body parameter needing validation: {p.name}")
+            embed = spec_default.embed or len(body_params) > 1
+            location = 'embedded_body' if embed else 'body'
+            yield _Arg(p.name, location, alias, lambda x: x, required, default)
+            continue
+        if annotation not in str_casts:
+            raise UnsupportedSpec(f"Annotation needing validation: {p.name}")
+        location = 'path' if p.name in path_param_names else 'query'
+        yield _Arg(p.name, location, alias, str_casts[annotation], required, default)
+
+
+# The route spec keys the lean engine implements (the others fall back to FastAPI)
+lean_spec_keys = frozenset({'api_route_kwargs', 'defaults', 'output', 'inline'})
+
+
+def mk_lean_route(func: Callable, spec: dict) -> Optional[LeanRoute]:
+    """
+    Compile a (func, spec) route_specs item into a LeanRoute, or return None if the
+    spec needs features that only the FastAPI machinery offers, or has keys (other
+    than `lean_spec_keys`) that the lean engine doesn't implement.
+
+    Besides the keys `fast_api_app` uses, a spec can say `"inline": True` to have a
+    sync function called directly on the event loop instead of in a thread pool. Only
+    do this for fast, non-blocking functions.
+
+    >>> def slow():
+    ...     pass
+    >>> mk_lean_route(slow, {'deadline': 0.1}) is None
+    True
+    """
+    if any(k not in lean_spec_keys for k, v in spec.items() if v is not None):
+        return None
+    _check_output_kind(spec.get('output'))
+    api_route_kwargs = mk_api_route_kwargs(func, spec)
+    path = api_route_kwargs['path']
+    methods = tuple(_ensure_list_of_upper_case_strings(api_route_kwargs['methods']))
+    regex, path_param_names = compile_path(path)
+    try:
+        args = tuple(_mk_args(func, spec.get('defaults', {}), path_param_names))
+    except UnsupportedSpec:
+        return None
+    return LeanRoute(
+        func,
+        path,
+        methods,
+        args,
+        inline=spec.get('inline', False),
+        regex=regex,
+        output=spec.get('output'),
+    )
+
+
+# -------------------------------------------------------------------------------------
+# The app
+
+
+def _headers(content_type: bytes, content_length: int):
+    return [
+        (b'content-type', content_type),
+        (b'content-length', str(content_length).encode()),
+    ]
+
+
+async def _send_bytes(send, status: int, body: bytes, content_type=b'application/json'):
+    await send(
+        {
+            'type': 'http.response.start',
+            'status': status,
+            'headers': _headers(content_type, len(body)),
+        }
+    )
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+_not_found = json_dumps_bytes({'detail': 'Not Found'})
+_method_not_allowed = json_dumps_bytes({'detail': 'Method Not Allowed'})
+_internal_error = b'Internal Server Error'
+
+
+class LeanASGIApp:
+    """
+    An ASGI app dispatching to LeanRoutes, falling back to `fallback` (an ASGI app,
+    typically a FastAPI app) for the paths it doesn't have.
+    """
+
+    def __init__(self, routes: Iterable[LeanRoute], fallback=None):
+        self.routes = tuple(routes)
+        self.fallback = fallback
+        # path -> {method: route}, for static paths
+        self.static_routes: Dict[str, Dict[str, LeanRoute]] = {}
+        # (regex, {method: route}), for templated paths
+        templated = {}
+        for route in self.routes:
+            if route.regex is None:
+                methods = self.static_routes.setdefault(route.path, {})
+            else:
+                methods = templated.setdefault(route.regex.pattern, (route.regex, {}))[
+                    1
+                ]
+            methods.update(dict.fromkeys(route.methods, route))
+        self.templated_routes = list(templated.values())
+
+    def match(self, path: str, method: str):
+        """
+        Return ``(route, path_params)`` for path and method, where route is None if
+        there's no route for that method, and path_params too if none for that path.
+        """
+        routes_by_method = self.static_routes.get(path)
+        if routes_by_method is not None:
+            return routes_by_method.get(method), {}
+        path_params = None
+        for regex, routes_by_method in self.templated_routes:
+            m = regex.match(path)
+            if m is not None:
+                route = routes_by_method.get(method)
+                if route is not None:
+                    return route, m.groupdict()
+                path_params = m.groupdict()
+        return None, path_params
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self._not_http(scope, receive, send)
+        route, path_params = self.match(scope['path'], scope['method'])
+        if route is None:
+            # (the fallback may have this path, or this path for this method)
+            if self.fallback is not None:
+                return await self.fallback(scope, receive, send)
+            if path_params is None:
+                return await _send_bytes(send, 404, _not_found)
+            return await _send_bytes(send, 405, _method_not_allowed)
+        await self.handle(route, path_params, scope, receive, send)
+
+    async def handle(self, route: LeanRoute, path_params, scope, receive, send):
+        query = dict(parse_qsl(scope['query_string'].decode('latin-1'), True))
+        body = None
+        if route.needs_body:
+            raw_body = await _read_body(receive)
+            try:
+                body = json.loads(raw_body) if raw_body else None
+            except ValueError:
+                detail = [
+                    {'loc': ['body'], 'msg': 'Invalid JSON', 'type': 'value_error'}
+                ]
+                return await _send_bytes(
+                    send, 422, json_dumps_bytes({'detail': detail})
+                )
+        try:
+            kwargs = route.extract_kwargs(path_params, query, body)
+        except RequestValidationFailure as e:
+            return await _send_bytes(send, 422, json_dumps_bytes({'detail': e.errors}))
+        try:
+            output = await route.call(kwargs)
+        except InvalidSelection as e:
+            detail = json_dumps_bytes({'detail': str(e)})
+            return await _send_bytes(send, 400, detail)
+        except Exception:
+            # Like starlette's ServerErrorMiddleware: respond, then let the server log
+            await _send_bytes(send, 500, _internal_error, b'text/plain; charset=utf-8')
+            raise
+        if route.output is not None:
+            body = _json_output(output, route.output)
+        else:
+            body = json_dumps_bytes(output)
+        await _send_bytes(send, 200, body)
+
+    async def _not_http(self, scope, receive, send):
+        if self.fallback is not None:
+            return await self.fallback(scope, receive, send)
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+
+
+def asgi_app(route_specs: dict, *, fallback_app: FastAPI = None) -> LeanASGIApp:
+    """
+    Make a lean ASGI app from route_specs (the same as `fast_api_app` takes).
+
+    The routes whose specs can't be served by the lean engine are added to a FastAPI
+    app (`fallback_app`, or a new one if there's any such route), which the lean app
+    delegates to for any path it doesn't match.
+
+    >>> from fastapi import Query
+    >>> def add(a: int, b: int = 2):
+    ...     return a + b
+    >>> app = asgi_app({add: {'defaults': {'b': Query(2)}}})
+    >>> [(r.path, r.methods) for r in app.routes]
+    [('/add', ('GET', 'POST'))]
+
+    """
+    lean_routes, fallback_specs = [], {}
+    for func, spec in route_specs.items():
+        route = mk_lean_route(func, spec)
+        if route is None:
+            fallback_specs[func] = spec
+        else:
+            lean_routes.append(route)
+    if fallback_specs:
+        fallback_app = fast_api_app(fallback_specs, app=fallback_app)
+    return LeanASGIApp(lean_routes, fallback=fallback_app)
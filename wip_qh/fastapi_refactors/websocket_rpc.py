@@ -0,0 +1,355 @@
+"""
+A persistent-connection RPC endpoint, over a WebSocket, for the functions of
+route_specs.
+
+Clients send a stream of ``{"id": ..., "func": ..., "params": {...}}`` messages
+and get back ``{"id": ..., "result": ...}`` (or ``{"id": ..., "error": {...}}``)
+messages, in the order the calls complete, not the order they were sent: calls are
+executed concurrently (sync functions in the thread pool, as FastAPI does), so a slow
+call doesn't hold up the ones behind it.
+
+The calls go through the app's http routes (see `RpcDispatcher`), so they're
+validated, profiled, cached, deadlined..., as the routes' requests are. This saves
+the per-call connection and http overhead, for clients making many small calls.
+
+The same messages can also be sent as a batch, in the JSON list body of a single
+http POST (to `DFLT_RPC_BATCH_PATH`), to get back the list of responses (in the order
+of the messages, this time). That's what `wip_qh.client` uses for batched calls.
+
+``utils_for_fastapi_refactor_03.fast_api_app(..., rpc_path='/rpc')`` adds both
+routes (there's no authentication here: only expose them where the routes are meant
+to be reachable anyway).
+
+"""
+
+import json
+import asyncio
+from dataclasses import dataclass
+from typing import Mapping, Any, List, Iterable, Tuple
+from urllib.parse import quote, urlencode
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from fastapi import Body, Request, HTTPException
+from fastapi.routing import APIRoute
+from i2 import name_of_obj
+from wip_qh.content_codecs import json_dumps_bytes, JSON_MIMETYPE
+
+DFLT_RPC_PATH = '/rpc'
+DFLT_RPC_BATCH_PATH = '/rpc/batch'
+DFLT_MAX_IN_FLIGHT = 64
+DFLT_MAX_BATCH_SIZE = 500
+
+
+def _json_dumps(obj) -> str:
+    return json_dumps_bytes(obj).decode('utf-8')
+
+
+def funcs_of_route_specs(route_specs: Mapping) -> dict:
+    """
+    The ``{name: func}`` dict of the functions of route_specs, named as their routes.
+
+    >>> def foo(): ...
+    >>> def bar(): ...
+    >>> funcs = funcs_of_route_specs({foo: {}, bar: {'api_route_kwargs': {'name': 'baz'}}})
+    >>> {name: func.__name__ for name, func in funcs.items()}
+    {'foo': 'foo', 'baz': 'bar'}
+    """
+    return {
+        spec.get('api_route_kwargs', {}).get('name') or name_of_obj(func): func
+        for func, spec in route_specs.items()
+    }
+
+
+class RouteError(Exception):
+    """The (non 2xx) response of a route called for an RPC message"""
+
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(detail)
+        self.status_code, self.detail = status_code, detail
+
+
+def _error(e: BaseException) -> dict:
+    error = {'type': type(e).__name__, 'message': str(e)}
+    if isinstance(e, RouteError):
+        error.update(status=e.status_code, message=e.detail)
+    return error
+
+
+def _query_items(name: str, value) -> Iterable[Tuple[str, str]]:
+    if value is None:
+        return
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _query_items(name, item)
+    elif isinstance(value, bool):
+        yield name, 'true' if value else 'false'
+    else:
+        yield name, str(value)
+
+
+def _request_parts(route: APIRoute, params: Mapping) -> Tuple[str, str, str, bytes]:
+    """
+    The ``(method, path, query_string, body)`` of a request of route, with params:
+    as the route's endpoint declares them (in the path, the query, or the body).
+    """
+    params = dict(params)
+    dependant = route.dependant
+    path = route.path_format
+    for field in dependant.path_params:
+        if field.name not in params:
+            raise ValueError(f"Missing path parameter: {field.name}")
+        value = quote(str(params.pop(field.name)), safe='')
+        path = path.replace('{' + field.alias + '}', value)
+    body = b''
+    body_fields = dependant.body_params
+    if len(body_fields) == 1 and not getattr(body_fields[0].field_info, 'embed', None):
+        if body_fields[0].name in params:
+            body = json_dumps_bytes(params.pop(body_fields[0].name))
+    elif body_fields:
+        body = json_dumps_bytes(
+            {f.alias: params.pop(f.name) for f in body_fields if f.name in params}
+        )
+    aliases = {f.name: f.alias for f in dependant.query_params}
+    query = [
+        item
+        for name, value in params.items()
+        for item in _query_items(aliases.get(name, name), value)
+    ]
+    methods = route.methods
+    if body_fields and 'POST' in methods:
+        method = 'POST'
+    else:
+        method = 'GET' if 'GET' in methods else sorted(methods)[0]
+    return method, path, urlencode(query), body
+
+
+# Headers of the rpc connection (or batch request) not passed on to the routes
+_own_header_prefixes = (
+    'accept',
+    'content-',
+    'connection',
+    'upgrade',
+    'transfer-encoding',
+    'sec-websocket-',
+)
+
+
+def _forwarded_headers(headers: Iterable[Tuple[bytes, bytes]]) -> list:
+    return [
+        (name, value)
+        for name, value in headers
+        if not name.decode('latin-1').lower().startswith(_own_header_prefixes)
+    ]
+
+
+async def _asgi_request(app, scope: dict, body: bytes) -> Tuple[int, dict, bytes]:
+    """Make a request to an ASGI app, in process: ``(status, headers, body)``"""
+    received, status, headers, chunks = False, 500, {}, []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await asyncio.Event().wait()  # (the "client" never disconnects)
+
+    async def send(message):
+        nonlocal status, headers
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            headers = {
+                k.decode('latin-1').lower(): v.decode('latin-1')
+                for k, v in message.get('headers', ())
+            }
+        elif message['type'] == 'http.response.body':
+            chunks.append(bytes(message.get('body', b'')))
+
+    await app(scope, receive, send)
+    return status, headers, b''.join(chunks)
+
+
+def _decoded_body(headers: dict, body: bytes):
+    if not body:
+        return None
+    if headers.get('content-type', '').startswith(JSON_MIMETYPE):
+        return json.loads(body)
+    return body.decode('utf-8', errors='replace')
+
+
+@dataclass
+class RpcDispatcher:
+    """
+    Calls the routes of `names` (the http routes of app), as RPC messages ask.
+
+    A call goes through the app, as an (in process) http request of the route, so
+    it gets what requests get: the route's defaults and input validation, the
+    app's middlewares (profiling, response cache...), deadlines... The routes are
+    asked for JSON, and the headers of the RPC connection are passed on to them.
+    """
+
+    app: Any
+    names: Iterable[str]
+
+    def __post_init__(self):
+        names = set(self.names)
+        self.routes = {
+            route.name: route
+            for route in self.app.routes
+            if isinstance(route, APIRoute) and route.name in names
+        }
+
+    async def call(self, func_name: str, params: dict, headers=()) -> Any:
+        method, path, query_string, body = _request_parts(
+            self.routes[func_name], params
+        )
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode('latin-1'),
+            'root_path': '',
+            'query_string': query_string.encode('latin-1'),
+            'headers': [
+                *_forwarded_headers(headers),
+                (b'accept', JSON_MIMETYPE.encode()),
+                (b'content-type', JSON_MIMETYPE.encode()),
+                (b'content-length', str(len(body)).encode()),
+            ],
+            'client': None,
+            'server': None,
+        }
+        status, response_headers, response_body = await _asgi_request(
+            self.app, scope, body
+        )
+        output = _decoded_body(response_headers, response_body)
+        if not 200 <= status < 300:
+            detail = (
+                output.get('detail', output) if isinstance(output, dict) else output
+            )
+            raise RouteError(status, detail)
+        return output
+
+    async def handle_message(self, message: Any, headers=()) -> dict:
+        """Return the ``{id, result}`` or ``{id, error}`` response for a message"""
+        if not isinstance(message, dict):
+            error = ValueError("A message should be a {id, func, params} object")
+            return {'id': None, 'error': _error(error)}
+        msg_id = message.get('id')
+        func_name = message.get('func')
+        if func_name not in self.routes:
+            error = KeyError(f"No such function: {func_name}")
+            return {'id': msg_id, 'error': _error(error)}
+        params = message.get('params') or {}
+        try:
+            if not isinstance(params, dict):
+                raise ValueError("The params should be an object")
+            result = await self.call(func_name, params, headers)
+        except Exception as e:
+            return {'id': msg_id, 'error': _error(e)}
+        return {'id': msg_id, 'result': result}
+
+
+async def serve_rpc_websocket(
+    websocket: WebSocket,
+    dispatcher: RpcDispatcher,
+    *,
+    max_in_flight: int = DFLT_MAX_IN_FLIGHT,
+):
+    """
+    Serve RPC messages on a websocket until the client disconnects.
+
+    At most `max_in_flight` calls run at once: past that, we stop reading messages
+    until some calls complete (backpressure, instead of unbounded task creation).
+    """
+    await websocket.accept()
+    in_flight = asyncio.Semaphore(max_in_flight)
+    send_lock = asyncio.Lock()
+    tasks = set()
+
+    async def send(response: dict):
+        try:
+            text = _json_dumps(response)
+        except Exception as e:  # (a result that can't be encoded)
+            text = _json_dumps({'id': response.get('id'), 'error': _error(e)})
+        async with send_lock:
+            await websocket.send_text(text)
+
+    async def respond(message):
+        try:
+            response = await dispatcher.handle_message(message, headers)
+        finally:
+            in_flight.release()
+        await send(response)
+
+    headers = websocket.scope.get('headers', ())
+
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                message = json.loads(text)
+            except ValueError as e:
+                await send({'id': None, 'error': _error(e)})
+                continue
+            await in_flight.acquire()
+            task = asyncio.create_task(respond(message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        for task in tasks:
+            task.cancel()
+
+
+def add_websocket_rpc_route(
+    app,
+    route_specs: Mapping,
+    *,
+    path: str = DFLT_RPC_PATH,
+    max_in_flight: int = DFLT_MAX_IN_FLIGHT,
+):
+    """Add a websocket RPC route, serving the (routes of) route_specs, to app"""
+    dispatcher = RpcDispatcher(app, funcs_of_route_specs(route_specs))
+
+    async def rpc(websocket: WebSocket):
+        await serve_rpc_websocket(websocket, dispatcher, max_in_flight=max_in_flight)
+
+    app.add_api_websocket_route(path, rpc, name='rpc')
+    return app
+
+
+def add_batch_rpc_route(
+    app,
+    route_specs: Mapping,
+    *,
+    path: str = DFLT_RPC_BATCH_PATH,
+    max_in_flight: int = DFLT_MAX_IN_FLIGHT,
+    max_batch_size: int = DFLT_MAX_BATCH_SIZE,
+):
+    """
+    Add an http route that takes a (JSON) list of RPC messages, runs them
+    concurrently, and returns the list of their responses, in the same order.
+
+    Batches of more than `max_batch_size` messages are refused (413), so that one
+    request can't queue up an unbounded amount of work.
+    """
+    dispatcher = RpcDispatcher(app, funcs_of_route_specs(route_specs))
+
+    async def rpc_batch(request: Request, messages: List[Any] = Body(...)):
+        if len(messages) > max_batch_size:
+            raise HTTPException(
+                413, f"Batches are limited to {max_batch_size} messages"
+            )
+        in_flight = asyncio.Semaphore(max_in_flight)
+        headers = request.scope.get('headers', ())
+
+        async def handle(message):
+            async with in_flight:
+                return await dispatcher.handle_message(message, headers)
+
+        return await asyncio.gather(*map(handle, messages))
+
+    app.add_api_route(path, rpc_batch, methods=['POST'], name='rpc_batch')
+    return app
@@ -0,0 +1,370 @@
+"""
+Write-behind stores: writes update an in-memory layer and return immediately, and a
+background thread flushes them, in batches, to the (slow) backend store.
+
+Repeated writes to the same key, between two flushes, are coalesced: only the last
+value is written to the backend. Reads see the pending writes (read-your-writes).
+
+The number of pending keys is bounded (`max_pending`): past that, writers wait
+for the flusher to make room (backpressure), instead of piling up unbounded memory.
+`flush()` writes everything pending now, and `close()` (to call on shutdown; by
+default, it's also called at interpreter exit) flushes and stops the flusher.
+
+A key whose backend write fails stays pending (to be retried), without holding up
+the writes of the other keys.
+
+To have the web services' writes (`set_store_value`) go through a write-behind layer:
+
+    from wip_qh.fastapi_refactors import fastapi_refactor_00
+    mall = WriteBehindMall(fastapi_refactor_00.backend_mall, flush_interval=0.5)
+    fastapi_refactor_00.store_getter = mall.__getitem__
+    app.add_event_handler('shutdown', mall.close)
+
+and for `StoreAccess`, use ``store_access.with_write_behind()``.
+
+"""
+
+import atexit
+import logging
+import threading
+import time
+import weakref
+from typing import MutableMapping, Optional, Iterable
+
+DFLT_FLUSH_INTERVAL = 1.0
+DFLT_MAX_PENDING = 10_000
+DFLT_FLUSH_THRESHOLD = 1_000
+
+logger = logging.getLogger(__name__)
+
+
+class _Deleted:
+    def __repr__(self):
+        return 'DELETED'
+
+
+_DELETED = _Deleted()
+
+
+class WriteBehindFull(RuntimeError):
+    """Raised when a write waited `put_timeout` seconds for room, in vain"""
+
+
+# The stores to close at interpreter exit (one atexit handler for all of them)
+_stores_to_close_at_exit = weakref.WeakValueDictionary()
+
+
+@atexit.register
+def _close_stores_at_exit():
+    for store in list(_stores_to_close_at_exit.values()):
+        try:
+            store.close()
+        except Exception:  # (the other stores still get flushed)
+            logger.exception("Failed to flush a write-behind store at exit")
+
+
+class WriteBehindStore(MutableMapping):
+    """
+    A MutableMapping whose writes are buffered, coalesced, and flushed to `backend`
+    by a background thread, every `flush_interval` seconds, or as soon as
+    `flush_threshold` keys are pending.
+
+    >>> backend = {'a': 1}
+    >>> s = WriteBehindStore(backend, flush_interval=60)
+    >>> s['b'] = 2
+    >>> s['b'] = 3  # coalesced with the previous write
+    >>> del s['a']
+    >>> dict(s), backend  # (not flushed yet)
+    ({'b': 3}, {'a': 1})
+    >>> s.flush()
+    >>> backend, s.stats['flushed'], s.stats['coalesced']
+    ({'b': 3}, 2, 1)
+    >>> s.close()
+    """
+
+    def __init__(
+        self,
+        backend: MutableMapping,
+        *,
+        flush_interval: float = DFLT_FLUSH_INTERVAL,
+        max_pending: int = DFLT_MAX_PENDING,
+        flush_threshold: int = DFLT_FLUSH_THRESHOLD,
+        put_timeout: Optional[float] = None,
+        flush_at_exit: bool = True,
+    ):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.flush_threshold = flush_threshold
+        self.put_timeout = put_timeout
+        self._pending = {}  # key -> value (or _DELETED), not yet taken by the flusher
+        self._in_flight = {}  # key -> value (or _DELETED), being written to backend
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # (so that batches are written in order)
+        self._flush_requested = False
+        self._closed = False
+        self.last_error: Optional[BaseException] = None
+        self.stats = {'written': 0, 'coalesced': 0, 'flushed': 0, 'errors': 0}
+        self._thread = threading.Thread(
+            target=self._flush_loop, name='write-behind-flusher', daemon=True
+        )
+        self._thread.start()
+        if flush_at_exit:
+            _stores_to_close_at_exit[id(self)] = self
+
+    # ---------------------------------------------------------------------------------
+    # Reads see pending, then in-flight, writes, then the backend
+
+    def _lookup(self, key):
+        for layer in (self._pending, self._in_flight):
+            if key in layer:
+                return layer[key]
+        return self.backend[key]
+
+    def __getitem__(self, key):
+        with self._cond:
+            if key in self._pending or key in self._in_flight:
+                value = self._lookup(key)
+                if value is _DELETED:
+                    raise KeyError(key)
+                return value
+        return self.backend[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def _overlaid_keys(self, backend_keys: Iterable, select=lambda key: True):
+        with self._cond:
+            overlay = {**self._in_flight, **self._pending}
+        overlay = {k: v for k, v in overlay.items() if select(k)}
+        for key in backend_keys:
+            if key not in overlay:
+                yield key
+        for key, value in overlay.items():
+            if value is not _DELETED:
+                yield key
+
+    def __iter__(self):
+        return self._overlaid_keys(self.backend)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    # ---------------------------------------------------------------------------------
+    # Writes go to the pending layer
+
+    def _put(self, key, value):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("This write-behind store is closed")
+            if key in self._pending:
+                self.stats['coalesced'] += 1
+            else:
+                deadline = None
+                if self.put_timeout is not None:
+                    deadline = time.monotonic() + self.put_timeout
+                while len(self._pending) >= self.max_pending:
+                    self._flush_requested = True
+                    self._cond.notify_all()
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        raise WriteBehindFull(
+                            f"{len(self._pending)} writes are pending already"
+                        )
+                    self._cond.wait(timeout)
+            self._pending[key] = value
+            self.stats['written'] += 1
+            if len(self._pending) >= self.flush_threshold:
+                self._flush_requested = True
+                self._cond.notify_all()
+
+    def __setitem__(self, key, value):
+        self._put(key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._put(key, _DELETED)
+
+    # ---------------------------------------------------------------------------------
+    # Flushing
+
+    def _write_batch(self, batch: dict) -> dict:
+        """Write batch to the backend. Returns the ``{key: error}`` of the failures."""
+        errors = {}
+        for key, value in batch.items():
+            try:
+                if value is _DELETED:
+                    try:
+                        del self.backend[key]
+                    except KeyError:
+                        pass
+                else:
+                    self.backend[key] = value
+            except Exception as e:  # (the other keys are still written)
+                errors[key] = e
+        return errors
+
+    def _flush_once(self) -> int:
+        """Write the pending writes to the backend. Returns the number written."""
+        with self._flush_lock:
+            return self._flush_pending()
+
+    def _flush_pending(self) -> int:
+        """
+        Write the pending writes to the backend. Returns the number written, or,
+        if some failed, raises the first error (once the others are written).
+        """
+        with self._cond:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._in_flight = batch
+            self._cond.notify_all()  # (there's room for blocked writers now)
+        try:
+            errors = self._write_batch(batch)
+        except BaseException as e:  # (e.g. KeyboardInterrupt: retry it all later)
+            errors = {key: e for key in batch}
+        with self._cond:
+            self._in_flight = {}
+            self.stats['flushed'] += len(batch) - len(errors)
+            if errors:
+                self.last_error = next(iter(errors.values()))
+                self.stats['errors'] += len(errors)
+                # Re-queue what wasn't superseded by newer writes, to retry later
+                failed = {key: batch[key] for key in errors}
+                self._pending = {**failed, **self._pending}
+            self._cond.notify_all()
+        if errors:
+            raise next(iter(errors.values()))
+        return len(batch)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if not self._flush_requested and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                self._flush_requested = False
+                closed = self._closed
+            try:
+                self._flush_once()
+            except Exception:
+                time.sleep(min(self.flush_interval, 1.0))  # (retried next round)
+            if closed:
+                return
+
+    def flush(self):
+        """Write all the pending writes to the backend, now (raising its errors)"""
+        while self._flush_once():
+            pass
+
+    def close(self):
+        """Flush, and stop the flusher thread"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        _stores_to_close_at_exit.pop(id(self), None)
+        self._thread.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# -------------------------------------------------------------------------------------
+# Malls
+
+
+class _FlatMall(MutableMapping):
+    """A ``{(user, key): value}`` view of a ``{user: {key: value}}`` mall"""
+
+    def __init__(self, mall: MutableMapping):
+        self.mall = mall
+
+    def __getitem__(self, k):
+        user, key = k
+        return self.mall[user][key]
+
+    def __setitem__(self, k, value):
+        user, key = k
+        self.mall[user][key] = value
+
+    def __delitem__(self, k):
+        user, key = k
+        del self.mall[user][key]
+
+    def __iter__(self):
+        for user in self.mall:
+            for key in self.mall[user]:
+                yield user, key
+
+    def __len__(self):
+        return sum(len(self.mall[user]) for user in self.mall)
+
+
+class _WriteBehindUserStore(MutableMapping):
+    def __init__(self, store: WriteBehindStore, user):
+        self._store = store
+        self.user = user
+
+    def __getitem__(self, key):
+        return self._store[(self.user, key)]
+
+    def __setitem__(self, key, value):
+        self._store[(self.user, key)] = value
+
+    def __delitem__(self, key):
+        del self._store[(self.user, key)]
+
+    def __iter__(self):
+        user_keys = ((self.user, key) for key in self._store.backend.mall[self.user])
+        keys = self._store._overlaid_keys(user_keys, lambda k: k[0] == self.user)
+        return (key for _, key in keys)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class WriteBehindMall:
+    """
+    A ``{user: store}`` mall, whose stores' writes are write-behind, all flushed
+    (to `mall`) by one flusher thread.
+
+    >>> backend_mall = {'alice': {'fruit': 1}}
+    >>> mall = WriteBehindMall(backend_mall, flush_interval=60)
+    >>> mall['alice']['planets'] = 2
+    >>> sorted(mall['alice']), backend_mall
+    (['fruit', 'planets'], {'alice': {'fruit': 1}})
+    >>> mall.close()
+    >>> backend_mall
+    {'alice': {'fruit': 1, 'planets': 2}}
+    """
+
+    def __init__(self, mall: MutableMapping, **write_behind_kwargs):
+        self.mall = mall
+        self.store = WriteBehindStore(_FlatMall(mall), **write_behind_kwargs)
+
+    def __getitem__(self, user) -> _WriteBehindUserStore:
+        self.mall[user]  # (raises KeyError for unknown users)
+        return _WriteBehindUserStore(self.store, user)
+
+    def __iter__(self):
+        return iter(self.mall)
+
+    def __contains__(self, user):
+        return user in self.mall
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
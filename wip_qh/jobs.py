@@ -0,0 +1,400 @@
+"""
+Jobs: long-running calls that are submitted, and return a job id right away, instead
+of holding an HTTP connection (and a worker) for as long as they run.
+
+A `JobRunner` runs the submitted calls in a local pool of worker threads, and keeps
+track of them in a job store (`SQLiteJobStore`, in memory or in a file):
+
+- ``queued`` -> ``running`` -> ``succeeded`` (with a JSON result) or ``failed``
+  (with an error), or ``cancelled``, at any point before finishing
+
+Cancelling a queued job means it'll never run, and a running async function is
+cancelled (in its event loop); a running sync function can't be stopped, but its
+result is discarded. Finished jobs are kept for `retention` seconds (and at most
+`max_jobs` of them), then purged. At most `max_pending` jobs can be queued or
+running: past that, submissions are refused (with a 429), until some finish.
+
+The HTTP routes (the same for ``fast_api_app(..., jobs=runner)``, see
+`fastapi_refactors.job_routes`, and ``dispatch_funcs(..., jobs=runner)``):
+
+- ``POST /jobs/{func_name}`` (params in the JSON body): 202, and the job (400 if the
+  body isn't JSON, 422 if the params don't fit the function's signature, 429 if
+  there are too many pending jobs)
+- ``GET /jobs/{job_id}``: the job (its status, timestamps...)
+- ``GET /jobs/{job_id}/result``: the result (202 if not finished, 500 if failed,
+  410 if cancelled)
+- ``DELETE /jobs/{job_id}``: cancel it (409 if already finished)
+
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import inspect
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Callable, Mapping, Optional, Tuple
+
+from wip_qh.content_codecs import json_dumps_bytes
+
+DFLT_MAX_WORKERS = 4
+DFLT_RETENTION_SECONDS = 3600.0
+DFLT_MAX_JOBS = 10_000
+DFLT_MAX_PENDING = 1_000
+DFLT_JOBS_PREFIX = 'jobs'
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = (
+    'queued',
+    'running',
+    'succeeded',
+    'failed',
+    'cancelled',
+)
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class TooManyPendingJobs(RuntimeError):
+    """Raised when submitting a job to a runner that has max_pending jobs already"""
+
+
+@dataclass
+class Job:
+    id: str
+    func_name: str
+    status: str
+    created: float
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
+    result_json: Optional[str] = None  # (the result, JSON-encoded)
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def result(self):
+        return None if self.result_json is None else json.loads(self.result_json)
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        del d['result_json']
+        return d
+
+
+# -------------------------------------------------------------------------------------
+# Job store
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    func_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    result_json TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+"""
+_COLUMNS = 'id, func_name, status, created, started, finished, error, result_json'
+
+
+class SQLiteJobStore:
+    """
+    Jobs, in an SQLite database (in memory, by default).
+
+    >>> store = SQLiteJobStore()
+    >>> job = store.create('plus_one')
+    >>> store.start(job.id), store.start(job.id)  # (only queued jobs can start)
+    (True, False)
+    >>> store.finish(job.id, SUCCEEDED, result_json='4')
+    True
+    >>> store.get(job.id).result, store.cancel(job.id)  # (too late to cancel)
+    (4, False)
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params)
+
+    def create(self, func_name: str) -> Job:
+        job = Job(uuid.uuid4().hex, func_name, QUEUED, time.time())
+        self._execute(
+            f"INSERT INTO jobs ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            tuple(asdict(job).values()),
+        )
+        return job
+
+    def get(self, job_id: str) -> Job:
+        row = self._execute(
+            f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        return Job(*row)
+
+    def start(self, job_id: str) -> bool:
+        """Mark a queued job as running (False if it's not queued anymore)"""
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, started = ? WHERE id = ? AND status = ?",
+            (RUNNING, time.time(), job_id, QUEUED),
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, status: str, *, result_json=None, error=None) -> bool:
+        """Record the outcome of a running job (False if it's not running anymore)"""
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, finished = ?, result_json = ?, error = ? "
+            "WHERE id = ? AND status = ?",
+            (status, time.time(), result_json, error, job_id, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def cancel(self, job_id: str) -> bool:
+        """Mark an unfinished job as cancelled (False if it's finished already)"""
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, finished = ? "
+            "WHERE id = ? AND status IN (?, ?)",
+            (CANCELLED, time.time(), job_id, QUEUED, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def purge(self, *, older_than: float, max_jobs: int) -> int:
+        """Delete the jobs finished before `older_than`, and the oldest finished jobs
+        past the `max_jobs` most recent. Returns the number of deleted jobs."""
+        deleted = self._execute(
+            "DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?",
+            (older_than,),
+        ).rowcount
+        deleted += self._execute(
+            "DELETE FROM jobs WHERE finished IS NOT NULL AND id NOT IN "
+            "(SELECT id FROM jobs ORDER BY created DESC LIMIT ?)",
+            (max_jobs,),
+        ).rowcount
+        return deleted
+
+    def __len__(self):
+        return self._execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# -------------------------------------------------------------------------------------
+# Runner
+
+
+class JobRunner:
+    """
+    Runs submitted calls of `funcs` (a ``{name: func}`` mapping) in a pool of
+    `max_workers` threads, keeping track of them in `store`. At most `max_pending`
+    jobs can be queued or running at once (see `TooManyPendingJobs`).
+
+    >>> runner = JobRunner({'add': lambda x, y: x + y})
+    >>> job = runner.submit('add', {'x': 1, 'y': 2})
+    >>> runner.wait(job.id).status, runner.get(job.id).result
+    ('succeeded', 3)
+    >>> runner.wait(runner.submit('add', {'x': 1}).id).error
+    "TypeError: <lambda>() missing 1 required positional argument: 'y'"
+    >>> runner.shutdown()
+    """
+
+    def __init__(
+        self,
+        funcs: Mapping[str, Callable] = None,
+        *,
+        store: SQLiteJobStore = None,
+        max_workers: int = DFLT_MAX_WORKERS,
+        retention: float = DFLT_RETENTION_SECONDS,
+        max_jobs: int = DFLT_MAX_JOBS,
+        max_pending: int = DFLT_MAX_PENDING,
+    ):
+        self.funcs = dict(funcs or {})
+        self.store = SQLiteJobStore() if store is None else store
+        self.retention = retention
+        self.max_jobs = max_jobs
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._futures = {}  # job_id -> future (of the queued and running jobs)
+        self._tasks = {}  # job_id -> (loop, task) of the running async functions
+
+    def submit(self, func_name: str, params: Mapping = ()) -> Job:
+        """
+        Queue a call of func_name (KeyError if there's no such function, and
+        TooManyPendingJobs if max_pending jobs are queued or running already).
+        """
+        func = self.funcs[func_name]
+        self.purge()
+        with self._lock:
+            if len(self._futures) >= self.max_pending:
+                raise TooManyPendingJobs(
+                    f"There are {len(self._futures)} pending jobs already"
+                )
+            job = self.store.create(func_name)
+            future = self._executor.submit(self._execute, job.id, func, dict(params))
+            self._futures[job.id] = future
+        future.add_done_callback(lambda _: self._forget(job.id))
+        return job
+
+    def _forget(self, job_id):
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _execute(self, job_id: str, func: Callable, params: dict):
+        if not self.store.start(job_id):  # (cancelled while queued)
+            return
+        try:
+            if inspect.iscoroutinefunction(func):
+                result = asyncio.run(self._run_async(job_id, func, params))
+            else:
+                result = func(**params)
+            result_json = json_dumps_bytes(result).decode('utf-8')
+        except asyncio.CancelledError:
+            return  # (the job is marked as cancelled already)
+        except Exception as e:
+            self.store.finish(job_id, FAILED, error=f"{type(e).__name__}: {e}")
+            return
+        self.store.finish(job_id, SUCCEEDED, result_json=result_json)
+
+    async def _run_async(self, job_id, func, params):
+        with self._lock:
+            self._tasks[job_id] = (asyncio.get_running_loop(), asyncio.current_task())
+        try:
+            return await func(**params)
+        finally:
+            with self._lock:
+                self._tasks.pop(job_id, None)
+
+    def get(self, job_id: str) -> Job:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job (False if it was finished already; KeyError if unknown)"""
+        self.store.get(job_id)
+        if not self.store.cancel(job_id):
+            return False
+        with self._lock:
+            future = self._futures.get(job_id)
+            loop_and_task = self._tasks.get(job_id)
+        if future is not None:
+            future.cancel()  # (only works if it didn't start yet)
+        if loop_and_task is not None:
+            loop, task = loop_and_task
+            loop.call_soon_threadsafe(task.cancel)
+        return True
+
+    def wait(self, job_id: str, timeout: float = None, poll: float = 0.01) -> Job:
+        """Wait for a job to finish (or timeout seconds), and return it"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job.done or (deadline is not None and time.monotonic() > deadline):
+                return job
+            time.sleep(poll)
+
+    def purge(self) -> int:
+        """Delete the jobs past retention"""
+        return self.store.purge(
+            older_than=time.time() - self.retention, max_jobs=self.max_jobs
+        )
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# -------------------------------------------------------------------------------------
+# HTTP (transport agnostic)
+
+
+def _json(obj) -> bytes:
+    return bytes(json_dumps_bytes(obj))
+
+
+HttpResponse = Tuple[int, bytes, dict]  # status code, JSON body, headers
+
+
+def _not_found(what: str, name: str) -> HttpResponse:
+    return 404, _json({'detail': f"{what} not found: {name}"}), {}
+
+
+def error_response(status_code: int, detail) -> HttpResponse:
+    return status_code, _json({'detail': detail}), {}
+
+
+def invalid_params_response(func: Callable, params: Mapping) -> Optional[HttpResponse]:
+    """
+    A 422 response if params can't be the arguments of func, or None if they can
+    (checked before submitting, so that bad submissions fail now, not as jobs).
+
+    >>> def add(a, b: int = 2):
+    ...     return a + b
+    >>> invalid_params_response(add, {'a': 1}) is None
+    True
+    >>> status_code, body, _ = invalid_params_response(add, {'b': 1, 'c': 3})
+    >>> status_code, json.loads(body)
+    (422, {'detail': "missing a required argument: 'a'"})
+    """
+    try:
+        inspect.signature(func).bind(**params)
+    except TypeError as e:
+        return error_response(422, str(e))
+    return None
+
+
+def submit_response(
+    runner: JobRunner, func_name: str, params, *, prefix: str = DFLT_JOBS_PREFIX
+) -> HttpResponse:
+    """The response to a submission (with the job's url in a Location header)"""
+    if func_name not in runner.funcs:
+        return _not_found('Function', func_name)
+    try:
+        job = runner.submit(func_name, params)
+    except TooManyPendingJobs as e:
+        return 429, _json({'detail': str(e)}), {'retry-after': '1'}
+    location = f"/{prefix.strip('/')}/{job.id}"
+    return 202, _json(job.to_dict()), {'location': location}
+
+
+def status_response(runner: JobRunner, job_id: str) -> HttpResponse:
+    try:
+        return 200, _json(runner.get(job_id).to_dict()), {}
+    except KeyError:
+        return _not_found('Job', job_id)
+
+
+def result_response(runner: JobRunner, job_id: str) -> HttpResponse:
+    """
+    The response to a request for the result of a job: the result itself (as it was
+    encoded when the job finished), or the job, if it has none (yet).
+    """
+    try:
+        job = runner.get(job_id)
+    except KeyError:
+        return _not_found('Job', job_id)
+    if job.status == SUCCEEDED:
+        return 200, job.result_json.encode('utf-8'), {}
+    status_code = {FAILED: 500, CANCELLED: 410}.get(job.status, 202)
+    return status_code, _json(job.to_dict()), {}
+
+
+def cancel_response(runner: JobRunner, job_id: str) -> HttpResponse:
+    try:
+        cancelled = runner.cancel(job_id)
+    except KeyError:
+        return _not_found('Job', job_id)
+    return (200 if cancelled else 409), _json(runner.get(job_id).to_dict()), {}
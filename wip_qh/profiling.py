@@ -0,0 +1,232 @@
+"""
+On-demand, per-request profiling.
+
+A `RequestProfiler` decides, for each request, whether it should be profiled
+(because the client sent an opt-in header, or because the request was sampled),
+runs the call under `cProfile`, and writes the result to a directory, either as a
+pstats dump (for `pstats`, snakeviz, ...) or as collapsed stacks (the input format of
+flamegraph.pl, speedscope, inferno, ...).
+
+Since profiling a request costs time and disk space, the opt-in header is only
+honoured for requests that also carry the profiler's `token` (in the
+``x-profile-token`` header), and only if it has one (by default, the value of the
+``WIP_QH_PROFILE_TOKEN`` environment variable).
+
+The web-service wrappers (`AzureWrap`, and the endpoints made by
+`utils_for_fastapi_refactor_03.add_routes_to_app`) only install the hook when given a
+profiler, so when profiling is off, there's nothing to pay for.
+
+"""
+
+import os
+import hmac
+import time
+import types
+import random
+import cProfile
+import pstats
+import tempfile
+import itertools
+from contextlib import contextmanager
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Mapping, Literal, Iterable, Optional, Union
+
+ProfileFormat = Literal['pstats', 'collapsed']
+
+DFLT_PROFILE_HEADER = 'x-profile'
+DFLT_PROFILE_TOKEN_HEADER = 'x-profile-token'
+DFLT_PROFILE_TOKEN = os.environ.get('WIP_QH_PROFILE_TOKEN') or None
+DFLT_PROFILE_DIR = os.environ.get(
+    'WIP_QH_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'wip_qh_profiles')
+)
+_profile_formats = ('pstats', 'collapsed')
+_falsy_header_values = {'', '0', 'false', 'no', 'off'}
+_file_extensions = {'pstats': '.prof', 'collapsed': '.folded'}
+_counter = itertools.count()
+
+
+def _func_label(func: tuple) -> str:
+    """Make a collapsed-stack frame label from a pstats ``(file, line, name)`` key"""
+    filename, lineno, name = func
+    if filename == '~':  # builtins
+        label = name
+    else:
+        label = f"{os.path.basename(filename)}:{name}:{lineno}"
+    return label.replace(';', ',').replace(' ', '_')
+
+
+def collapsed_stacks(stats: pstats.Stats, *, min_seconds=1e-6) -> Iterable[str]:
+    """
+    Yield ``"frame;frame;...;frame microseconds"`` lines from a ``pstats.Stats``.
+
+    cProfile only records caller-callee edges, not full stacks, so stacks are rebuilt
+    by walking the call graph from the roots, apportioning each function's time
+    to its callers pro rata of the cumulative time spent along each edge.
+
+    >>> import cProfile, pstats
+    >>> def leaf():
+    ...     return sum(range(10_000))
+    >>> def root():
+    ...     return [leaf() for _ in range(20)]
+    >>> profile = cProfile.Profile()
+    >>> _ = profile.runcall(root)
+    >>> lines = list(collapsed_stacks(pstats.Stats(profile)))
+    >>> any(':root:' in line and ':leaf:' in line for line in lines)
+    True
+    >>> all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    True
+    """
+    raw = stats.stats
+    children = defaultdict(list)
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, (_, _, _, edge_ct) in callers.items():
+            children[caller].append((func, edge_ct))
+    roots = [func for func, (*_, callers) in raw.items() if not callers]
+
+    weights = defaultdict(float)
+
+    def walk(func, stack, on_stack, ct_in):
+        _, _, tt, ct, _ = raw[func]
+        scale = ct_in / ct if ct else 0.0
+        stack = stack + (_func_label(func),)
+        weights[stack] += tt * scale
+        for child, edge_ct in children[func]:
+            if child not in on_stack and edge_ct * scale >= min_seconds:
+                walk(child, stack, on_stack | {child}, edge_ct * scale)
+
+    for root in roots:
+        walk(root, (), {root}, raw[root][3])
+
+    for stack, seconds in weights.items():
+        microseconds = int(seconds * 1e6)
+        if microseconds > 0:
+            yield f"{';'.join(stack)} {microseconds}"
+
+
+@types.coroutine
+def _yield(value):
+    return (yield value)
+
+
+async def profiled_coroutine(coro, profile: cProfile.Profile):
+    """
+    Await coro, with profile enabled only while coro runs: not while it's suspended,
+    when the event loop runs other tasks (that profiling the whole await would
+    include).
+
+    >>> import asyncio, pstats
+    >>> async def nap():
+    ...     await asyncio.sleep(0)
+    ...     return 'rested'
+    >>> profile = cProfile.Profile()
+    >>> asyncio.run(profiled_coroutine(nap(), profile))
+    'rested'
+    >>> any(name == 'nap' for _, _, name in pstats.Stats(profile).stats)
+    True
+    """
+    value, error = None, None
+    while True:
+        profile.enable()
+        try:
+            if error is None:
+                yielded = coro.send(value)
+            else:
+                yielded = coro.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            profile.disable()
+        try:
+            value, error = await _yield(yielded), None
+        except BaseException as e:  # (e.g. the task was cancelled: pass it on)
+            value, error = None, e
+
+
+@dataclass
+class RequestProfiler:
+    """
+    Decides which requests to profile, profiles them, and dumps the profiles.
+
+    A request is profiled if it carries the `header` (with a value that isn't one of
+    ``0``, ``false``, ``no``, ``off``) along with the `token` (in the `token_header`),
+    or, failing that, with probability `sample_rate`. The header value can also be
+    ``pstats`` or ``collapsed``, to override the `fmt` of that one profile.
+
+    >>> profiler = RequestProfiler(sample_rate=0, token='s3cret')
+    >>> profiler.should_profile({'x-profile': '1', 'x-profile-token': 's3cret'})
+    True
+    >>> profiler.should_profile({'x-profile': '1', 'x-profile-token': 'guess'})
+    False
+    >>> profiler.should_profile({'x-profile': 'off', 'x-profile-token': 's3cret'})
+    False
+    >>> RequestProfiler(sample_rate=1).should_profile({})
+    True
+
+    Without a token, the header is ignored:
+
+    >>> RequestProfiler(sample_rate=0, token=None).should_profile({'x-profile': '1'})
+    False
+    """
+
+    output_dir: str = DFLT_PROFILE_DIR
+    header: str = DFLT_PROFILE_HEADER
+    sample_rate: float = 0.0
+    fmt: ProfileFormat = 'collapsed'
+    token: Optional[str] = DFLT_PROFILE_TOKEN
+    token_header: str = DFLT_PROFILE_TOKEN_HEADER
+
+    def __post_init__(self):
+        if self.fmt not in _profile_formats:
+            raise ValueError(f"fmt should be one of {_profile_formats}: {self.fmt}")
+
+    def _header_value(self, headers: Mapping) -> Optional[str]:
+        """The value of the opt-in header, if the request has the token"""
+        value = headers.get(self.header)
+        if value is None or self.token is None:
+            return None
+        given = headers.get(self.token_header) or ''
+        if not hmac.compare_digest(given.encode(), self.token.encode()):
+            return None
+        return value.strip().lower()
+
+    def should_profile(self, headers: Mapping) -> bool:
+        value = self._header_value(headers)
+        if value is not None:
+            return value not in _falsy_header_values
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def fmt_for(self, headers: Mapping) -> ProfileFormat:
+        """The profile format asked for by the header value, or the default `fmt`"""
+        value = self._header_value(headers)
+        return value if value in _profile_formats else self.fmt
+
+    @contextmanager
+    def profiling(self, name: str, *, fmt: ProfileFormat = None):
+        """Context manager that profiles its block and dumps the profile on exit"""
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            self.dump(profile, name, fmt=fmt)
+
+    def dump(
+        self, profile: Union[cProfile.Profile, pstats.Stats], name: str, *, fmt=None
+    ) -> str:
+        """Write the profile (or stats) to `output_dir` and return the filepath"""
+        fmt = fmt or self.fmt
+        stats = profile if isinstance(profile, pstats.Stats) else pstats.Stats(profile)
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = time.strftime('%Y%m%dT%H%M%S')
+        name = name.replace(os.sep, '_')
+        filename = f"{timestamp}-{name}-{os.getpid()}-{next(_counter)}"
+        filepath = os.path.join(self.output_dir, filename + _file_extensions[fmt])
+        if fmt == 'pstats':
+            stats.dump_stats(filepath)
+        else:
+            with open(filepath, 'w') as f:
+                for line in collapsed_stacks(stats):
+                    f.write(line + '\n')
+        return filepath
@@ -0,0 +1,125 @@
+"""
+Projections of nested (JSON-like) values: the parts of a value a client asked for.
+
+A selection is a comma-separated list of dot-separated paths (or a list of paths),
+such as ``'earth'``, ``'fruit.apple,fruit.banana'`` or ``['a.0.name', 'b']`` (numbers
+index lists). Projecting a value keeps the selected subtrees, in their place:
+
+    {'earth': 30, 'mars': 40, 'venus': 20}  --  'earth,venus'  -->  {'earth': 30, 'venus': 20}
+
+Stores that can read parts of their values without loading the whole (databases with
+projections, stores of flattened values, ...) can have a ``select(key, paths)``
+method, which `select_from_store` uses (projecting the whole value otherwise).
+
+Selections that can't apply to a value (empty ones, non-numeric indices of lists,
+paths into numbers or strings) raise an `InvalidSelection` (a client error, which
+the web services answer with a 400), and paths that aren't in a value, a KeyError.
+
+"""
+
+from typing import Sequence, Union, Tuple, MutableMapping
+
+Path = Tuple[str, ...]
+Selection = Union[str, Sequence[str], None]
+
+
+class InvalidSelection(ValueError):
+    """Raised when a selection is empty, or can't apply to the value selected from"""
+
+
+def parse_selection(selection: Selection) -> Tuple[Path, ...]:
+    """
+    The paths of a selection.
+
+    >>> parse_selection('planets.earth, fruit')
+    (('planets', 'earth'), ('fruit',))
+    >>> parse_selection(['a.0.name', ('b', 'c')])
+    (('a', '0', 'name'), ('b', 'c'))
+    """
+    if isinstance(selection, str):
+        selection = selection.split(',')
+    paths = tuple(
+        p if isinstance(p, tuple) else tuple(p.strip().split('.'))
+        for p in selection
+        if isinstance(p, tuple) or p.strip()
+    )
+    if not paths:
+        raise InvalidSelection(f"Empty selection: {selection!r}")
+    return paths
+
+
+def _is_list(value) -> bool:
+    return isinstance(value, Sequence) and not isinstance(value, (str, bytes))
+
+
+def _index(field: str) -> int:
+    try:
+        return int(field)
+    except ValueError:
+        raise InvalidSelection(f"Not a list index: {field!r}")
+
+
+def _child(value, field: str):
+    if _is_list(value):
+        try:
+            return value[_index(field)]
+        except IndexError:
+            raise KeyError(field)
+    try:
+        return value[field]
+    except TypeError:
+        raise InvalidSelection(
+            f"Can't select {field!r} in a value of type {type(value).__name__}"
+        )
+
+
+def _pruned(value, paths: Sequence[Path]):
+    if any(not path for path in paths):  # (the whole of value is selected)
+        return value
+    heads = {}
+    for head, *rest in paths:
+        heads.setdefault(head, []).append(tuple(rest))
+    if _is_list(value):
+        indices = sorted(heads, key=_index)
+        return [_pruned(_child(value, i), heads[i]) for i in indices]
+    return {head: _pruned(_child(value, head), rest) for head, rest in heads.items()}
+
+
+def project(value, selection: Selection):
+    """
+    The part of value made of the selected subtrees.
+    Raises a KeyError if a selected path isn't in value, and an `InvalidSelection`
+    if it can't be (it goes through a number, a string, or a list by a non-index).
+
+    >>> planets = {'mercury': 10, 'venus': 20, 'earth': {'moons': 1, 'pop': 8e9}}
+    >>> project(planets, 'earth.moons,venus')
+    {'earth': {'moons': 1}, 'venus': 20}
+    >>> project({'rows': [{'a': 1, 'b': 2}, {'a': 3}, {'a': 5}]}, 'rows.2.a,rows.0')
+    {'rows': [{'a': 1, 'b': 2}, {'a': 5}]}
+    >>> project(planets, 'pluto')
+    Traceback (most recent call last):
+      ...
+    KeyError: 'pluto'
+    >>> project(planets, 'venus.moons')
+    Traceback (most recent call last):
+      ...
+    wip_qh.projection.InvalidSelection: Can't select 'moons' in a value of type int
+    """
+    return _pruned(value, parse_selection(selection))
+
+
+def select_from_store(store: MutableMapping, key, selection: Selection = None):
+    """
+    The (projected, if a selection is given) value of key in store, read with the
+    store's ``select`` method if it has one.
+
+    >>> select_from_store({'planets': {'earth': 30, 'mars': 40}}, 'planets', 'mars')
+    {'mars': 40}
+    """
+    if selection is None:
+        return store[key]
+    paths = parse_selection(selection)
+    select = getattr(store, 'select', None)
+    if select is not None:
+        return select(key, paths)
+    return _pruned(store[key], paths)
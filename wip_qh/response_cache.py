@@ -0,0 +1,237 @@
+"""
+Full-response caching for pure (or slowly changing) routes.
+
+A route marked as cacheable (with a `CacheSpec`) gets its successful responses
+stored, as already-encoded bytes (with their status and headers), in a
+`ResponseCache`, under a key made of the route's name and selected request
+parameters. A cache hit sends these bytes back as is, skipping everything else:
+ingress, validation, the function, and serialization.
+
+Routes whose output never changes (like `list_funcs`) can be precomputed at startup
+(or, for Azure, at the first request). Routes whose output changes when other routes
+are called (like `get_store_value`, when `set_store_value` is) can name those, so
+that their successful calls drop the cached responses.
+
+Each app gets its own `ResponseCache` (unless one is given), and, when its outputs
+are encoded according to the requests' Accept headers, caches them per ``accept``.
+
+In route_specs (see `utils_for_fastapi_refactor_03.fast_api_app`):
+
+    get_store_value: {
+        "api_route_kwargs": {"methods": 'get', "path": "/store_get/{user}"},
+        "defaults": {"key": Query()},
+        "cache": {
+            "ttl": 5,
+            "key": ["user", "key", "select"],
+            "invalidated_by": ["set_store_value"],
+        },
+    },
+
+and for Azure, with ``azure_wrap(cache=...)``, or, in `dispatch_funcs`,
+``cache={'list_funcs': {'precompute': True}}``.
+
+"""
+
+import time
+import threading
+from functools import cached_property
+from dataclasses import dataclass, field, replace
+from typing import Optional, Sequence, Union, Mapping, Hashable, Tuple
+
+DFLT_MAX_ENTRIES = 10_000
+CACHE_STATUS_HEADER = 'x-cache'
+
+
+@dataclass
+class CacheSpec:
+    """
+    How to cache the responses of a route.
+
+    - `ttl`: seconds a response stays valid (None: forever)
+    - `key`: names of the (path and query) params the response depends on
+      (None: all of them)
+    - `vary`: names of the request headers the response depends on (e.g. ``accept``)
+    - `precompute`: True to compute the response (of the parameterless request) at
+      startup, or the request targets (e.g. ``['/greeter/Hi?name=you']``) to do so for
+    - `invalidated_by`: names of the routes whose successful calls change this route's
+      responses (so drop the cached ones)
+
+    >>> spec = CacheSpec(key=['user', 'key'])
+    >>> spec.key_for('store_get', {'user': 'bob'}, {'key': 'cars', 'verbose': '1'})
+    ('store_get', ('bob', 'cars'), ())
+    >>> CacheSpec().key_for('store_get', {'user': 'bob'}, {'key': 'cars'})
+    ('store_get', (('key', 'cars'), ('user', 'bob')), ())
+    """
+
+    ttl: Optional[float] = None
+    key: Optional[Sequence[str]] = None
+    vary: Sequence[str] = ()
+    precompute: Union[bool, Sequence[str]] = False
+    invalidated_by: Sequence[str] = ()
+
+    def key_for(
+        self,
+        route_name: str,
+        path_params: Mapping,
+        query_params: Mapping,
+        headers: Optional[Mapping] = None,
+    ) -> Tuple:
+        params = {**query_params, **path_params}
+        if self.key is None:
+            values = tuple(sorted(params.items()))
+        else:
+            values = tuple(params.get(name) for name in self.key)
+        if self.vary and headers is not None:
+            return route_name, values, tuple(headers.get(h) for h in self.vary)
+        return route_name, values, ()
+
+    def varying_with(self, header: str) -> 'CacheSpec':
+        """
+        This spec, with header added to the `vary` ones (if it isn't already there).
+
+        >>> CacheSpec(vary=['accept']).varying_with('Accept').vary
+        ['accept']
+        >>> CacheSpec().varying_with('Accept').vary
+        ('accept',)
+        """
+        header = header.lower()
+        if header in map(str.lower, self.vary):
+            return self
+        return replace(self, vary=(*self.vary, header))
+
+    def precompute_targets(self) -> Sequence[str]:
+        if self.precompute is True:
+            return ('',)
+        return tuple(self.precompute or ())
+
+
+def cache_spec(spec) -> Optional[CacheSpec]:
+    """
+    Make a `CacheSpec` from the short forms route configurations can use:
+    None or False (no caching), True (cache forever), a number (a ttl), or a dict.
+
+    >>> cache_spec(60)
+    CacheSpec(ttl=60, key=None, vary=(), precompute=False, invalidated_by=())
+    >>> cache_spec({'precompute': True}).precompute
+    True
+    >>> cache_spec(None) is None
+    True
+    """
+    if spec is None or spec is False:
+        return None
+    if spec is True:
+        return CacheSpec()
+    if isinstance(spec, CacheSpec):
+        return spec
+    if isinstance(spec, (int, float)):
+        return CacheSpec(ttl=spec)
+    if isinstance(spec, Mapping):
+        return CacheSpec(**spec)
+    raise TypeError(f"Can't make a CacheSpec from {spec!r}")
+
+
+@dataclass
+class CachedResponse:
+    """An encoded response, ready to be sent again"""
+
+    body: bytes
+    status_code: int = 200
+    headers: Sequence[Tuple[str, str]] = ()
+    media_type: Optional[str] = None
+
+    @cached_property
+    def asgi_messages(self) -> Tuple[dict, dict]:
+        """The (start, body) ASGI messages that send this response"""
+        headers = [
+            (k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in self.headers
+        ]
+        headers.append((CACHE_STATUS_HEADER.encode(), b'hit'))
+        start = {
+            'type': 'http.response.start',
+            'status': self.status_code,
+            'headers': headers,
+        }
+        return start, {'type': 'http.response.body', 'body': self.body}
+
+
+@dataclass
+class ResponseCache:
+    """
+    A store of `CachedResponse`s, with expiration. When full, the oldest entries
+    are dropped first.
+
+    To not store a response computed before an invalidation happened (but finished
+    after it), take the `generation` of the route before computing it, and give it
+    to `set`: the response is only stored if no invalidation happened in between.
+
+    >>> cache = ResponseCache()
+    >>> cache.set(('foo', (), ()), CachedResponse(b'[1, 2]'), ttl=None)
+    >>> cache.get(('foo', (), ())).body
+    b'[1, 2]'
+    >>> cache.set(('bar', (), ()), CachedResponse(b'3'), ttl=-1)  # already expired
+    >>> cache.get(('bar', (), ())) is None
+    True
+    >>> cache.invalidate('foo')
+    1
+    >>> len(cache)
+    0
+    >>> generation = cache.generation('foo')
+    >>> _ = cache.invalidate('foo')  # (while the response was being computed)
+    >>> cache.set(('foo', (), ()), CachedResponse(b'[1]'), None, generation=generation)
+    >>> len(cache)
+    0
+    """
+
+    max_entries: int = DFLT_MAX_ENTRIES
+    _entries: dict = field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._generations = {}  # route name -> number of invalidations
+        self._epoch = 0  # number of invalidations of all routes
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            self._entries.pop(key, None)
+            return None
+        return response
+
+    def generation(self, route_name: str) -> Tuple[int, int]:
+        """Changes whenever the entries of the route are invalidated"""
+        return self._epoch, self._generations.get(route_name, 0)
+
+    def set(
+        self,
+        key: Hashable,
+        response: CachedResponse,
+        ttl: Optional[float],
+        *,
+        generation: Optional[Tuple[int, int]] = None,
+    ):
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            if generation is not None and generation != self.generation(key[0]):
+                return  # (computed before an invalidation: it may be stale)
+            self._entries.pop(key, None)
+            while len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (response, expires_at)
+
+    def invalidate(self, route_name: Optional[str] = None) -> int:
+        """Drop the entries of a route (or all of them). Returns how many were."""
+        with self._lock:
+            if route_name is None:
+                self._epoch += 1
+            else:
+                self._generations[route_name] = self._generations.get(route_name, 0) + 1
+            keys = [k for k in self._entries if route_name in (None, k[0])]
+            for k in keys:
+                del self._entries[k]
+        return len(keys)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,135 @@
+"""
+Test the clients `wip_qh.client` makes, against the apps made from the same
+declarations (using the app as the transport, so no server is needed).
+"""
+
+import asyncio
+import inspect
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from wip_qh.client import (
+    mk_client,
+    mk_async_client,
+    route_calls_of_funcs,
+    RemoteCallError,
+    DFLT_RPC_BATCH_PATH,
+)
+from wip_qh.fastapi_refactors.fastapi_refactor_00 import (
+    backend_mall,
+    reset_backend_mall,
+    greeter,
+)
+from wip_qh.fastapi_refactors.fastapi_refactor_04 import app, expected_route_specs
+from wip_qh.fastapi_refactors.utils_for_fastapi_refactor_03 import fast_api_app
+
+BASE_URL = 'http://testserver'
+
+
+def _client(**client_kwargs):
+    return mk_client(
+        expected_route_specs,
+        BASE_URL,
+        http_client=TestClient(app, raise_server_exceptions=False),
+        **client_kwargs,
+    )
+
+
+def test_client_methods_have_the_route_signatures():
+    client = _client()
+    assert inspect.signature(client.greeter) == inspect.signature(greeter)
+    assert client.greeter.__doc__ == 'GET /greeter/{greeting}'
+
+
+def test_client_calls():
+    reset_backend_mall(backend_mall)
+    client = _client()
+    assert client.greeter('Hi') == 'Hi, world!'
+    assert client.greeter('Yo', name='you', n=2) == 'Yo, you!\nYo, you!'
+    assert (
+        client.get_store_value('alice', key='fruit') == backend_mall['alice']['fruit']
+    )
+    client.set_store_value('alice', key='fruit', value='kiwi')
+    assert client.get_store_value('alice', 'fruit') == 'kiwi'
+    assert 'fruit' in client.get_store_list('alice')
+    with pytest.raises(httpx.HTTPStatusError):
+        client.get_store_value('nobody', key='fruit')
+
+
+def test_path_params_are_quoted():
+    client = _client()
+    assert client.greeter('a b?') == 'a b?, world!'
+
+
+@pytest.mark.parametrize('batch_path', [None, DFLT_RPC_BATCH_PATH])
+def test_batches(batch_path):
+    reset_backend_mall(backend_mall)
+    client = _client(batch_path=batch_path, max_batch_size=2)
+    with client.batch() as batch:
+        results = [batch.greeter(greeting) for greeting in ['Hi', 'Yo', 'Hey']]
+        missing = batch.get_store_value('nobody', key='fruit')
+        assert not results[0].done()
+    assert [r.result() for r in results] == ['Hi, world!', 'Yo, world!', 'Hey, world!']
+    with pytest.raises(RemoteCallError):
+        missing.result()
+
+
+def test_batches_default_to_concurrent_calls():
+    # a service without the (opt-in) rpc routes can still be batched
+    plain_app = fast_api_app(expected_route_specs)
+    client = mk_client(
+        expected_route_specs, BASE_URL, http_client=TestClient(plain_app)
+    )
+    assert client.batch_path is None
+    with client.batch() as batch:
+        result = batch.greeter('Hi')
+    assert result.result() == 'Hi, world!'
+
+
+def test_server_limits_batch_size():
+    message = {'id': 0, 'func': 'greeter', 'params': {'greeting': 'Hi'}}
+    response = TestClient(app).post(DFLT_RPC_BATCH_PATH, json=[message] * 500)
+    assert response.status_code == 200
+    messages = [message] * 501
+    response = TestClient(app).post(DFLT_RPC_BATCH_PATH, json=messages)
+    assert response.status_code == 413
+
+
+def test_async_client():
+    reset_backend_mall(backend_mall)
+
+    async def calls():
+        transport = httpx.ASGITransport(app=app)
+        async with mk_async_client(
+            expected_route_specs,
+            BASE_URL,
+            http_client=httpx.AsyncClient(transport=transport),
+            batch_path=DFLT_RPC_BATCH_PATH,
+        ) as client:
+            greeting = await client.greeter('Hi', name='you')
+            async with client.batch() as batch:
+                value = batch.get_store_value('alice', key='fruit')
+                missing = batch.get_store_value('nobody', key='fruit')
+            return greeting, value, missing
+
+    greeting, value, missing = asyncio.run(calls())
+    assert greeting == 'Hi, you!'
+    assert value.result() == backend_mall['alice']['fruit']
+    with pytest.raises(RemoteCallError):
+        missing.result()
+
+
+def test_route_calls_of_funcs():
+    def add(a, b: int = 2):
+        return a + b
+
+    (route,) = route_calls_of_funcs([add])
+    assert route.request_parts(route.arguments(1)) == {
+        'method': 'POST',
+        'url': '/add',
+        'json': {'a': 1},
+    }
+    (route,) = route_calls_of_funcs({'plus': add}, single_route='fn/{func_name}')
+    assert route.request_parts(route.arguments(1, b=3))['url'] == '/fn/plus'